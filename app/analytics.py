@@ -0,0 +1,104 @@
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from pymongo.errors import CollectionInvalid, PyMongoError
+from telegram.ext import ContextTypes
+
+from . import tenants
+from .models import User
+
+EVENTS_COLLECTION = "events"
+
+# Funnel steps in order; "approve" closes the loop from the admin side.
+FUNNEL = ("view", "pay", "receipt", "approve")
+
+logger = logging.getLogger(__name__)
+
+_buffer_size = 10000
+# Events go to the tenant's own database, so each tenant buffers separately
+_buffers: "tenants.Local[Deque[Dict[str, Any]]]" = tenants.Local(lambda: deque(maxlen=_buffer_size))
+_collection_ready: Set[str] = set()
+
+
+def configure(buffer_size: int):
+    global _buffer_size
+    _buffer_size = buffer_size
+
+
+def track(event: str, user_id: Optional[int], course_id: Optional[str] = None):
+    """Record an event in memory only; never touches the database."""
+    _buffers.get().append({
+        "ts": datetime.utcnow(),
+        "meta": {"event": event, "course_id": course_id},
+        "user_id": user_id,
+    })
+
+
+def _events():
+    return User.get_motor_collection().database[EVENTS_COLLECTION]
+
+
+async def _ensure_collection():
+    if tenants.current() in _collection_ready:
+        return
+    db = User.get_motor_collection().database
+    try:
+        await db.create_collection(
+            EVENTS_COLLECTION,
+            timeseries={"timeField": "ts", "metaField": "meta", "granularity": "seconds"},
+        )
+    except CollectionInvalid:
+        # Already exists
+        pass
+    except PyMongoError:
+        # Servers older than 5.0 have no time-series collections; a plain one works too
+        logger.warning("time-series collections unavailable, using a regular collection")
+    _collection_ready.add(tenants.current())
+
+
+async def flush() -> int:
+    """Bulk insert everything buffered so far."""
+    _buffer = _buffers.get()
+    if not _buffer:
+        return 0
+    batch: List[Dict[str, Any]] = []
+    while _buffer:
+        batch.append(_buffer.popleft())
+    try:
+        await _ensure_collection()
+        await _events().insert_many(batch, ordered=False)
+    except PyMongoError:
+        # Put the events back ahead of the ones tracked meanwhile. Only as many as still fit:
+        # extendleft on a full deque would push the newest events out of the other end.
+        room = _buffer.maxlen - len(_buffer)
+        _buffer.extendleft(reversed(batch[-room:] if room > 0 else []))
+        raise
+    return len(batch)
+
+
+async def flush_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await flush()
+    except PyMongoError as e:
+        logger.warning("analytics flush failed: %r", e)
+
+
+async def conversion_by_course(days: int = 30) -> List[Dict[str, Any]]:
+    """view -> pay -> receipt -> approve counts (unique students) per course."""
+    since = datetime.utcnow() - timedelta(days=days)
+    pipeline = [
+        {"$match": {"ts": {"$gte": since}, "meta.event": {"$in": list(FUNNEL)}}},
+        {"$group": {"_id": {"course": "$meta.course_id", "event": "$meta.event"}, "users": {"$addToSet": "$user_id"}}},
+        {"$group": {"_id": "$_id.course", "steps": {"$push": {"k": "$_id.event", "v": {"$size": "$users"}}}}},
+    ]
+    rows: List[Dict[str, Any]] = []
+    async for doc in _events().aggregate(pipeline):
+        steps = {s["k"]: s["v"] for s in doc["steps"]}
+        row = {"course_id": doc["_id"], **{step: steps.get(step, 0) for step in FUNNEL}}
+        row["view_to_receipt"] = row["receipt"] / row["view"] if row["view"] else 0.0
+        row["receipt_to_approve"] = row["approve"] / row["receipt"] if row["receipt"] else 0.0
+        rows.append(row)
+    rows.sort(key=lambda r: r["view"], reverse=True)
+    return rows
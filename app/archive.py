@@ -0,0 +1,138 @@
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+from telegram.ext import ContextTypes
+
+from .catalog import COURSES
+from .models import User
+
+ARCHIVE_USERS = "users_archive"
+ARCHIVE_ENROLLMENTS = "enrollments_archive"
+
+logger = logging.getLogger(__name__)
+
+
+def _hot():
+    return User.get_motor_collection()
+
+
+def _cold(name: str):
+    return _hot().database[name]
+
+
+def duration_months(course: Dict[str, Any]) -> Optional[int]:
+    m = re.search(r"\d+", str(course.get("duration") or ""))
+    return int(m.group()) if m else None
+
+
+def _closed_enrollment_filters(cutoff: datetime) -> List[Dict[str, Any]]:
+    """Enrollments that no longer need to stay in the hot collection."""
+    filters: List[Dict[str, Any]] = [{"approval_status": "rejected", "created_at": {"$lt": cutoff}}]
+    # Approved professional courses count as completed once their duration has run out.
+    for cid, course in COURSES.items():
+        months = duration_months(course)
+        if not months:
+            continue
+        filters.append({
+            "course_id": cid,
+            "approval_status": "approved",
+            "created_at": {"$lt": cutoff - timedelta(days=30 * months)},
+        })
+    return filters
+
+
+async def archive_inactive_users(horizon_days: int, batch_size: int = 500) -> int:
+    """Move users inactive for longer than ``horizon_days`` into the archive."""
+    cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+    hot, cold = _hot(), _cold(ARCHIVE_USERS)
+    # Never archive students who still wait for a payment decision.
+    query = {"last_active": {"$lt": cutoff}, "courses.approval_status": {"$ne": "pending"}}
+    moved = 0
+    while True:
+        docs = await hot.find(query).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        ids = [d["_id"] for d in docs]
+        await cold.bulk_write([ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs], ordered=False)
+        res = await hot.delete_many({"_id": {"$in": ids}, **query})
+        if res.deleted_count < len(ids):
+            # Some users came back while the batch was copied; keep them hot only.
+            still_hot = [d["_id"] async for d in hot.find({"_id": {"$in": ids}}, {"_id": 1})]
+            await cold.delete_many({"_id": {"$in": still_hot}})
+            moved += len(ids) - len(still_hot)
+            if len(still_hot) == len(ids):
+                break
+        else:
+            moved += len(ids)
+    return moved
+
+
+async def archive_closed_enrollments(horizon_days: int, batch_size: int = 500) -> int:
+    """Move rejected and completed enrollments out of hot user documents."""
+    cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+    filters = _closed_enrollment_filters(cutoff)
+    hot, cold = _hot(), _cold(ARCHIVE_ENROLLMENTS)
+    query = {"courses": {"$elemMatch": {"$or": filters}}}
+    moved = 0
+    while True:
+        docs = await hot.find(query, {"telegram_id": 1, "courses": 1}).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        now = datetime.utcnow()
+        archived: List[Dict[str, Any]] = []
+        updates: List[UpdateOne] = []
+        for d in docs:
+            for e in d.get("courses", []):
+                if _matches_any(e, filters):
+                    archived.append({**e, "telegram_id": d.get("telegram_id"), "user_id": d["_id"], "archived_at": now})
+            updates.append(UpdateOne(
+                {"_id": d["_id"]},
+                {"$pull": {"courses": {"$or": filters}}, "$set": {"updated_at": now}},
+            ))
+        if archived:
+            await cold.insert_many(archived, ordered=False)
+        await hot.bulk_write(updates, ordered=False)
+        moved += len(archived)
+    return moved
+
+
+def _matches_any(enrollment: Dict[str, Any], filters: List[Dict[str, Any]]) -> bool:
+    for f in filters:
+        if "course_id" in f and enrollment.get("course_id") != f["course_id"]:
+            continue
+        if enrollment.get("approval_status") != f["approval_status"]:
+            continue
+        created = enrollment.get("created_at")
+        if created and created < f["created_at"]["$lt"]:
+            return True
+    return False
+
+
+async def restore_user(telegram_id: int) -> Optional[User]:
+    """Bring an archived user back into the hot collection."""
+    hot, cold = _hot(), _cold(ARCHIVE_USERS)
+    doc = await cold.find_one({"telegram_id": telegram_id})
+    if not doc:
+        return None
+    doc["last_active"] = doc["updated_at"] = datetime.utcnow()
+    # Insert first so a crash in between can only leave a stale archived copy behind.
+    await hot.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+    await cold.delete_one({"_id": doc["_id"]})
+    logger.info("restored archived user %s", telegram_id)
+    return await User.find_one(User.telegram_id == telegram_id)
+
+
+async def archive_job(context: ContextTypes.DEFAULT_TYPE):
+    data = context.job.data or {}
+    horizon = data.get("horizon_days", 365)
+    batch = data.get("batch_size", 500)
+    try:
+        users = await archive_inactive_users(horizon, batch)
+        enrollments = await archive_closed_enrollments(horizon, batch)
+    except Exception:
+        logger.exception("archive run failed")
+        return
+    logger.info("archived %s users and %s enrollments", users, enrollments)
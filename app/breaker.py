@@ -0,0 +1,191 @@
+"""Circuit breakers for the two things every handler waits on: Mongo and Telegram.
+
+A breaker opens after ``failures`` consecutive timeouts or connection errors and from then on
+fails calls at once with the dependency's own "unavailable" error, so the existing
+``except PyMongoError`` / ``except TelegramError`` paths take over without waiting. After
+``reset_seconds`` a single call is let through as a probe: success closes the breaker, another
+failure keeps it open. While Mongo's breaker is open, :class:`DegradedGuard` lets catalog
+browsing (in-memory data) and the journal-backed flows (registration, receipts) through and
+answers everything else right away.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional, Type
+
+from pymongo.errors import AutoReconnect, ConnectionFailure, NetworkTimeout
+from telegram import Update
+from telegram.error import BadRequest, NetworkError, TimedOut
+from telegram.ext import Application, ApplicationHandlerStop, BaseHandler, ContextTypes
+
+from .router import Router
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BUSY = "⏳ الخدمة مشغولة حالياً، حاول مرة أخرى بعد قليل"
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        is_failure: Callable[[BaseException], bool],
+        unavailable: Type[Exception],
+        timed_out: Type[Exception],
+        failures: int = 5,
+        reset_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._is_failure = is_failure
+        self._unavailable = unavailable
+        self._timed_out = timed_out
+        self._count = 0
+        self._opened_at = 0.0
+        self._probing = False
+        # Errors already counted, so one that propagates through the error handler counts once
+        self._last_error: Optional[BaseException] = None
+
+    @property
+    def state(self) -> str:
+        if not self._opened_at:
+            return CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return HALF_OPEN
+        return OPEN
+
+    def available(self) -> bool:
+        """Whether a call made now would be attempted."""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and not self._probing)
+
+    def success(self):
+        if self._opened_at:
+            logger.info("%s circuit closed", self.name)
+        self._count = 0
+        self._opened_at = 0.0
+
+    def failure(self):
+        self._count += 1
+        if self._opened_at or self._count >= self.failures:
+            if not self._opened_at:
+                logger.warning("%s circuit open after %d failures", self.name, self._count)
+            # A failed probe starts the wait over
+            self._opened_at = time.monotonic()
+
+    def record(self, error: BaseException) -> bool:
+        """Count ``error`` if it means the dependency is unavailable; returns whether it does."""
+        if not self._is_failure(error):
+            return False
+        if error is not self._last_error:
+            self._last_error = error
+            self.failure()
+        return True
+
+    async def call(self, func: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        if not self.available():
+            error = self._unavailable(f"{self.name} circuit open")
+            self._last_error = error
+            raise error
+        probe = self.state == HALF_OPEN
+        self._probing = self._probing or probe
+        try:
+            if timeout:
+                result = await asyncio.wait_for(func(), timeout)
+            else:
+                result = await func()
+        except asyncio.TimeoutError as e:
+            error = self._timed_out(f"{self.name} call exceeded {timeout}s")
+            self.record(error)
+            raise error from e
+        except Exception as e:
+            if not self.record(e):
+                # Answered, just not the way the caller hoped: the dependency is up
+                self.success()
+            raise
+        finally:
+            if probe:
+                self._probing = False
+        self.success()
+        return result
+
+
+def _mongo_failure(error: BaseException) -> bool:
+    # Duplicate keys, validation errors etc. mean the server answered
+    return isinstance(error, ConnectionFailure) or bool(getattr(error, "timeout", False))
+
+
+def _telegram_failure(error: BaseException) -> bool:
+    return isinstance(error, NetworkError) and not isinstance(error, BadRequest)
+
+
+MONGO = CircuitBreaker("mongo", _mongo_failure, AutoReconnect, NetworkTimeout)
+TELEGRAM = CircuitBreaker("telegram", _telegram_failure, NetworkError, TimedOut)
+
+
+def configure(failures: int, reset_seconds: float):
+    for breaker in (MONGO, TELEGRAM):
+        breaker.failures = max(failures, 1)
+        breaker.reset_seconds = reset_seconds
+
+
+async def _busy(update: Update):
+    try:
+        if update.callback_query:
+            await update.callback_query.answer(BUSY)
+        elif update.effective_message:
+            await update.effective_message.reply_text(BUSY)
+    except Exception:
+        pass
+
+
+class DegradedGuard(BaseHandler[Update, ContextTypes.DEFAULT_TYPE]):
+    """While Mongo is unavailable, stops every update the router can't serve offline.
+
+    Goes in the same early group as the flood guard. Routes registered with ``offline=True``
+    pass through, and so do updates one of the ``offline`` handlers takes: those write through
+    :mod:`app.journal`, which queues the write until Mongo is back. Anything else gets an
+    immediate "try again shortly" instead of a spinner that waits on the database.
+    """
+
+    def __init__(self, router: Router, offline: Iterable[BaseHandler] = ()):
+        super().__init__(self._degraded)
+        self._router = router
+        self._offline = list(offline)
+
+    def check_update(self, update: object) -> Optional[bool]:
+        if MONGO.available() or not isinstance(update, Update) or not update.effective_user:
+            return None
+        route = self._router.check_update(update)
+        if route is not None and route.offline:
+            return None
+        for handler in self._offline:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                return None
+        return True
+
+    async def handle_update(self, update: Update, application: Application, check_result: bool, context: ContextTypes.DEFAULT_TYPE):
+        logger.debug("mongo unavailable, turning away an update from %s", update.effective_user.id)
+        await _busy(update)
+        raise ApplicationHandlerStop
+
+    async def _degraded(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # handle_update does the work
+        return None
+
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Feeds handler failures into the breakers and tells the student to retry."""
+    error = context.error
+    if not (MONGO.record(error) or TELEGRAM.record(error)):
+        logger.error("Exception while handling an update", exc_info=error)
+        return
+    logger.warning("update failed on an unavailable dependency: %r", error)
+    if isinstance(update, Update):
+        await _busy(update)
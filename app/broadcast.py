@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from pymongo import ReturnDocument
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.ext import Application, ContextTypes
+
+from . import tenants
+from .models import BroadcastJob, User
+from .ratelimit import BULK
+
+LEASE = timedelta(seconds=60)
+PROGRESS_EVERY = 5.0
+MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+_concurrency = 10
+# Tenants with a runner active in this process
+_running: Set[str] = set()
+
+
+def configure(concurrency: int):
+    global _concurrency
+    _concurrency = concurrency
+
+
+def format_message(text: str) -> str:
+    return f"📢 **رسالة من المعلمة**\n\n{text}"
+
+
+async def create_job(text: str, progress_chat_id: Optional[int] = None, source: str = "bot") -> BroadcastJob:
+    job = BroadcastJob(
+        text=text,
+        source=source,
+        progress_chat_id=progress_chat_id,
+        total=await User.find_all().count(),
+    )
+    await job.insert()
+    return job
+
+
+async def _claim() -> Optional[BroadcastJob]:
+    """Take the lease on the oldest unfinished job, including ones orphaned by a crash."""
+    now = datetime.utcnow()
+    doc = await BroadcastJob.get_motor_collection().find_one_and_update(
+        {"status": {"$in": ["queued", "running"]}, "lease_until": {"$lte": now}},
+        {"$set": {"status": "running", "lease_until": now + LEASE}, "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return BroadcastJob.parse_obj(doc) if doc else None
+
+
+async def _send_one(bot: Bot, chat_id: int, text: str) -> bool:
+    # Pacing, RetryAfter and retries are handled by the shared rate limiter
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, rate_limit_args={"priority": BULK})
+        return True
+    except TelegramError:
+        return False
+
+
+async def _update_progress(bot: Bot, job: BroadcastJob, done: bool = False):
+    if not job.progress_chat_id:
+        return
+    if job.status == "failed":
+        title = "⚠️ توقف البث بسبب خطأ"
+    else:
+        title = "اكتمل البث" if done else "جارٍ إرسال البث"
+    text = (
+        f"📢 {title}\n\n"
+        f"✅ أُرسلت: {job.sent}\n"
+        f"❌ فشلت: {job.failed}\n"
+        f"👥 الإجمالي: {job.total}"
+    )
+    try:
+        if job.progress_message_id:
+            await bot.edit_message_text(chat_id=job.progress_chat_id, message_id=job.progress_message_id, text=text)
+        else:
+            msg = await bot.send_message(chat_id=job.progress_chat_id, text=text)
+            job.progress_message_id = msg.message_id
+            await BroadcastJob.get_motor_collection().update_one(
+                {"_id": job.id}, {"$set": {"progress_message_id": msg.message_id}}
+            )
+    except TelegramError:
+        pass
+
+
+async def run_job(bot: Bot, job: BroadcastJob):
+    """Stream recipients by telegram_id and checkpoint after every chunk so a restart resumes."""
+    coll = BroadcastJob.get_motor_collection()
+    text = format_message(job.text)
+    sem = asyncio.Semaphore(_concurrency)
+    chunk_size = max(_concurrency * 3, 1)
+    last_progress = 0.0
+
+    async def send(chat_id: int) -> bool:
+        async with sem:
+            return await _send_one(bot, chat_id, text)
+
+    await _update_progress(bot, job)
+    cursor = User.get_motor_collection().find(
+        {"telegram_id": {"$gt": job.last_telegram_id}}, {"telegram_id": 1}
+    ).sort("telegram_id", 1).batch_size(500)
+    chunk: List[int] = []
+    exhausted = False
+    while not exhausted:
+        try:
+            doc = await cursor.next()
+            chunk.append(doc["telegram_id"])
+        except StopAsyncIteration:
+            exhausted = True
+        if len(chunk) < chunk_size and not exhausted:
+            continue
+        if chunk:
+            results = await asyncio.gather(*(send(cid) for cid in chunk))
+            ok = sum(results)
+            job.sent += ok
+            job.failed += len(chunk) - ok
+            job.last_telegram_id = chunk[-1]
+            await coll.update_one(
+                {"_id": job.id},
+                {
+                    "$set": {
+                        "last_telegram_id": job.last_telegram_id,
+                        "lease_until": datetime.utcnow() + LEASE,
+                        "attempts": 0,
+                    },
+                    "$inc": {"sent": ok, "failed": len(chunk) - ok},
+                },
+            )
+            chunk = []
+            if time.monotonic() - last_progress >= PROGRESS_EVERY:
+                last_progress = time.monotonic()
+                await _update_progress(bot, job)
+
+    await coll.update_one({"_id": job.id}, {"$set": {"status": "done", "finished_at": datetime.utcnow()}})
+    await _update_progress(bot, job, done=True)
+    logger.info("broadcast %s done: %s sent, %s failed", job.id, job.sent, job.failed)
+
+
+async def claim_and_run(bot: Bot):
+    job = await _claim()
+    while job:
+        try:
+            await run_job(bot, job)
+        except Exception as e:
+            if job.attempts < MAX_ATTEMPTS:
+                # Leave the lease to expire so the next poll resumes from the checkpoint
+                logger.exception("broadcast %s interrupted", job.id)
+                return
+            logger.exception("broadcast %s failed %d times without progress, giving up", job.id, job.attempts)
+            job.status = "failed"
+            await BroadcastJob.get_motor_collection().update_one(
+                {"_id": job.id}, {"$set": {"status": "failed", "error": repr(e), "finished_at": datetime.utcnow()}}
+            )
+            await _update_progress(bot, job, done=True)
+        job = await _claim()
+
+
+def start(application: Application):
+    """Run queued jobs in the background unless a runner is already active in this process."""
+    tenant = tenants.current()
+    if tenant in _running:
+        return
+    _running.add(tenant)
+
+    async def runner():
+        try:
+            await claim_and_run(application.bot)
+        finally:
+            _running.discard(tenant)
+
+    application.create_task(runner())
+
+
+async def poll_job(context: ContextTypes.DEFAULT_TYPE):
+    """Pick up queued jobs (e.g. from the web admin) and jobs left over by a restart."""
+    start(context.application)
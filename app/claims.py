@@ -0,0 +1,78 @@
+"""One reviewer at a time per pending enrollment.
+
+Opening a request from the pending list claims it for the reviewer with a single conditional
+update, which only succeeds while nobody else holds a live claim, so several admins and
+moderators can work the queue in parallel. Decisions check the same condition (see
+:func:`app.enrollments.set_status`): approving or rejecting is a compare-and-set on "still pending
+and not someone else's", and a second click on the same receipt finds it already decided.
+Claims are never swept; one past its deadline simply stops counting, so a reviewer who walks away
+doesn't block the item for longer than the timeout.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from .models import User
+
+# Clears the claim on the enrollment matched by the positional operator
+RELEASED = {"courses.$.claimed_by": None, "courses.$.claimed_until": None}
+
+_timeout = timedelta(minutes=15)
+
+
+def configure(timeout_minutes: int):
+    global _timeout
+    _timeout = timedelta(minutes=max(timeout_minutes, 1))
+
+
+def minutes() -> int:
+    return int(_timeout.total_seconds() // 60)
+
+
+def free_for(reviewer: int, now: datetime) -> Dict[str, Any]:
+    """``$elemMatch`` condition: unclaimed, claimed by ``reviewer``, or the claim has expired."""
+    return {"$or": [{"claimed_by": None}, {"claimed_by": reviewer}, {"claimed_until": {"$lte": now}}]}
+
+
+def holder(claimed_by: Optional[int], claimed_until: Optional[datetime], now: Optional[datetime] = None) -> Optional[int]:
+    """The reviewer holding a live claim, if any."""
+    if claimed_by and claimed_until and claimed_until > (now or datetime.utcnow()):
+        return claimed_by
+    return None
+
+
+async def current(telegram_id: int, course_id: str) -> Optional[int]:
+    """Who holds the claim on a pending enrollment right now; None if nobody or not pending."""
+    doc = await User.get_motor_collection().find_one(
+        {"telegram_id": telegram_id}, {"courses": {"$elemMatch": {"course_id": course_id}}}
+    )
+    enrollment = ((doc or {}).get("courses") or [{}])[0]
+    if enrollment.get("approval_status") != "pending":
+        return None
+    return holder(enrollment.get("claimed_by"), enrollment.get("claimed_until"))
+
+
+async def claim(telegram_id: int, course_id: str, reviewer: int) -> Optional[int]:
+    """Claim a pending enrollment for ``reviewer``, or extend their claim.
+
+    Returns who holds it afterwards: ``reviewer`` on success, someone else's id if it is taken,
+    None if it is no longer pending.
+    """
+    now = datetime.utcnow()
+    match = {"course_id": course_id, "approval_status": "pending", **free_for(reviewer, now)}
+    doc = await User.get_motor_collection().find_one_and_update(
+        {"telegram_id": telegram_id, "courses": {"$elemMatch": match}},
+        {"$set": {"courses.$.claimed_by": reviewer, "courses.$.claimed_until": now + _timeout}},
+        projection={"_id": 1},
+    )
+    if doc:
+        return reviewer
+    return await current(telegram_id, course_id)
+
+
+async def release(telegram_id: int, course_id: str, reviewer: int) -> bool:
+    """Give a claim back before it times out. Returns whether ``reviewer`` held it."""
+    result = await User.get_motor_collection().update_one(
+        {"telegram_id": telegram_id, "courses": {"$elemMatch": {"course_id": course_id, "claimed_by": reviewer}}},
+        {"$set": RELEASED},
+    )
+    return result.modified_count > 0
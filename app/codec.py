@@ -0,0 +1,120 @@
+"""Compact callback data.
+
+``pack("a", 123456789, "year3_sem2_software_eng1")`` gives something like ``"#a" + 10 base64 chars``
+instead of a 45-byte string. Catalog ids are interned as small integers; ids outside the catalog
+are carried inline. The first payload byte is a catalog fingerprint, so buttons rendered before a
+catalog change are rejected instead of silently pointing at the wrong item. Tags in
+``STABLE_TAGS`` carry ids inline behind a fixed marker instead: admin review buttons name students
+and enrollments, not catalog positions, and must keep working across a catalog change at deploy.
+"""
+import base64
+import zlib
+from typing import List, Tuple, Union
+
+from .catalog import COURSES, MATERIALS
+
+PREFIX = "#"
+
+# Tags in use: s/d/t/c/x/p university cart screens, v/a/r admin review of one enrollment,
+# A approve everything left on a receipt message, S/C approve all of a student/course,
+# m/M multi-select over the pending queue, u release a claimed enrollment
+STABLE_TAGS = frozenset("varASCmMu")
+
+_INT, _REF, _STR = 0, 1, 2
+
+_IDS: List[str] = sorted(set(COURSES) | set(MATERIALS))
+_INDEX = {cid: i for i, cid in enumerate(_IDS)}
+_VERSION = zlib.crc32("\n".join(_IDS).encode()) & 0xFF
+# First byte of catalog-independent payloads; never a catalog fingerprint
+_STABLE = 0xFF
+if _VERSION == _STABLE:
+    _VERSION = 0xFE
+
+
+class StaleCallback(ValueError):
+    """Callback data from an older catalog, or not ours at all."""
+
+
+def _varint(n: int, out: bytearray):
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+
+def pack(tag: str, *values: Union[int, str]) -> str:
+    """Encode non-negative ints and catalog ids behind ``#<tag>``."""
+    stable = tag in STABLE_TAGS
+    out = bytearray([_STABLE if stable else _VERSION])
+    for v in values:
+        if isinstance(v, int):
+            _varint(v << 2 | _INT, out)
+        elif v in _INDEX and not stable:
+            _varint(_INDEX[v] << 2 | _REF, out)
+        else:
+            raw = v.encode()
+            _varint(len(raw) << 2 | _STR, out)
+            out += raw
+    data = PREFIX + tag + base64.urlsafe_b64encode(bytes(out)).decode().rstrip("=")
+    if len(data.encode()) > 64:
+        raise ValueError(f"callback data too long: {data!r}")
+    return data
+
+
+def unpack(data: str) -> Tuple[str, List[Union[int, str]]]:
+    if not data.startswith(PREFIX) or len(data) < 3:
+        raise StaleCallback(data)
+    tag, body = data[1], data[2:]
+    try:
+        buf = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+        if not buf or buf[0] not in (_VERSION, _STABLE):
+            raise StaleCallback(data)
+        stable = buf[0] == _STABLE
+        values: List[Union[int, str]] = []
+        pos = 1
+        while pos < len(buf):
+            n, pos = _read_varint(buf, pos)
+            kind, n = n & 3, n >> 2
+            if kind == _INT:
+                values.append(n)
+            elif kind == _REF:
+                if stable:
+                    raise StaleCallback(data)
+                values.append(_IDS[n])
+            else:
+                values.append(buf[pos:pos + n].decode())
+                pos += n
+    except (ValueError, IndexError) as e:
+        raise StaleCallback(data) from e
+    return tag, values
+
+
+def route(tag: str) -> str:
+    """Router prefix for callbacks packed with ``tag``."""
+    return PREFIX + tag
+
+
+def mask_of(indexes) -> int:
+    mask = 0
+    for i in indexes:
+        mask |= 1 << i
+    return mask
+
+
+def indexes_of(mask: int) -> List[int]:
+    return [i for i in range(mask.bit_length()) if mask >> i & 1]
@@ -18,6 +18,50 @@ class Config:
     BOT_WEBHOOK_URL: str
     WEBAPP_HOST: str
     WEBAPP_PORT: int
+    TELEGRAM_API_URL: str = "https://api.telegram.org"
+    TELEGRAM_LOCAL_MODE: bool = False
+    ARCHIVE_INACTIVE_DAYS: int = 365
+    ARCHIVE_BATCH_SIZE: int = 500
+    ARCHIVE_INTERVAL_HOURS: int = 24
+    JOURNAL_PATH: str = "journal/pending.ndjson"
+    JOURNAL_REPLAY_SECONDS: int = 15
+    JOURNAL_WRITE_TIMEOUT: float = 5.0
+    COURSE_SEATS: int = 0
+    ANALYTICS_BUFFER_SIZE: int = 10000
+    ANALYTICS_FLUSH_SECONDS: int = 5
+    MAX_CONCURRENT_UPDATES: int = 32
+    TELEGRAM_GLOBAL_RATE: float = 30.0
+    TELEGRAM_BULK_RATE: float = 25.0
+    TELEGRAM_CHAT_RATE: float = 1.0
+    PERSISTENCE_FLUSH_SECONDS: int = 10
+    USER_DATA_IDLE_MINUTES: int = 60
+    CONVERSATION_TIMEOUT_MINUTES: int = 30
+    ADMIN_DIGEST_MINUTES: int = 0
+    ADMIN_DIGEST_URGENT: str = ""
+    REMINDER_TICK_SECONDS: int = 30
+    REMINDER_WINDOW_MINUTES: int = 60
+    INSTALLMENT_DAYS: int = 30
+    STALE_PENDING_HOURS: int = 24
+    STALE_PENDING_REPEATS: int = 3
+    FLOOD_LIMITS: str = "callback=10/10,command=3/10,text=6/10,other=6/10"
+    CONTACT_DEBOUNCE_SECONDS: float = 20.0
+    INVITE_POOL_SIZE: int = 0
+    INVITE_REFILL_SECONDS: int = 60
+    INVITE_FAKE_API: bool = False
+    OUTBOX_POLL_SECONDS: float = 1.0
+    MONGO_TIMEOUT_SECONDS: float = 5.0
+    TELEGRAM_TIMEOUT_SECONDS: float = 10.0
+    BREAKER_FAILURES: int = 5
+    BREAKER_RESET_SECONDS: float = 30.0
+    BROADCAST_CONCURRENCY: int = 10
+    BROADCAST_POLL_SECONDS: int = 10
+    TENANTS_FILE: str = ""
+    DATA_DIR: str = ""
+    TELEGRAM_ADMIN_IDS: str = ""
+    TELEGRAM_MODERATOR_IDS: str = ""
+    CLAIM_TIMEOUT_MINUTES: int = 15
+    # Set per tenant by app.tenants.load
+    TENANT_ID: str = ""
 
 
 def load_config() -> Config:
@@ -33,4 +77,46 @@ def load_config() -> Config:
         BOT_WEBHOOK_URL=os.getenv("BOT_WEBHOOK_URL", ""),
         WEBAPP_HOST=os.getenv("WEBAPP_HOST", "0.0.0.0"),
         WEBAPP_PORT=int(port_str),
+        TELEGRAM_API_URL=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/"),
+        TELEGRAM_LOCAL_MODE=str_to_bool(os.getenv("TELEGRAM_LOCAL_MODE", "false")),
+        ARCHIVE_INACTIVE_DAYS=int(os.getenv("ARCHIVE_INACTIVE_DAYS", "365")),
+        ARCHIVE_BATCH_SIZE=int(os.getenv("ARCHIVE_BATCH_SIZE", "500")),
+        ARCHIVE_INTERVAL_HOURS=int(os.getenv("ARCHIVE_INTERVAL_HOURS", "24")),
+        JOURNAL_PATH=os.getenv("JOURNAL_PATH", "journal/pending.ndjson"),
+        JOURNAL_REPLAY_SECONDS=int(os.getenv("JOURNAL_REPLAY_SECONDS", "15")),
+        JOURNAL_WRITE_TIMEOUT=float(os.getenv("JOURNAL_WRITE_TIMEOUT", "5")),
+        COURSE_SEATS=int(os.getenv("COURSE_SEATS", "0")),
+        ANALYTICS_BUFFER_SIZE=int(os.getenv("ANALYTICS_BUFFER_SIZE", "10000")),
+        ANALYTICS_FLUSH_SECONDS=int(os.getenv("ANALYTICS_FLUSH_SECONDS", "5")),
+        MAX_CONCURRENT_UPDATES=int(os.getenv("MAX_CONCURRENT_UPDATES", "32")),
+        TELEGRAM_GLOBAL_RATE=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+        TELEGRAM_BULK_RATE=float(os.getenv("TELEGRAM_BULK_RATE", "25")),
+        TELEGRAM_CHAT_RATE=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+        PERSISTENCE_FLUSH_SECONDS=int(os.getenv("PERSISTENCE_FLUSH_SECONDS", "10")),
+        USER_DATA_IDLE_MINUTES=int(os.getenv("USER_DATA_IDLE_MINUTES", "60")),
+        CONVERSATION_TIMEOUT_MINUTES=int(os.getenv("CONVERSATION_TIMEOUT_MINUTES", "30")),
+        ADMIN_DIGEST_MINUTES=int(os.getenv("ADMIN_DIGEST_MINUTES", "0")),
+        ADMIN_DIGEST_URGENT=os.getenv("ADMIN_DIGEST_URGENT", ""),
+        REMINDER_TICK_SECONDS=int(os.getenv("REMINDER_TICK_SECONDS", "30")),
+        REMINDER_WINDOW_MINUTES=int(os.getenv("REMINDER_WINDOW_MINUTES", "60")),
+        INSTALLMENT_DAYS=int(os.getenv("INSTALLMENT_DAYS", "30")),
+        STALE_PENDING_HOURS=int(os.getenv("STALE_PENDING_HOURS", "24")),
+        STALE_PENDING_REPEATS=int(os.getenv("STALE_PENDING_REPEATS", "3")),
+        FLOOD_LIMITS=os.getenv("FLOOD_LIMITS", "callback=10/10,command=3/10,text=6/10,other=6/10"),
+        CONTACT_DEBOUNCE_SECONDS=float(os.getenv("CONTACT_DEBOUNCE_SECONDS", "20")),
+        INVITE_POOL_SIZE=int(os.getenv("INVITE_POOL_SIZE", "0")),
+        INVITE_REFILL_SECONDS=int(os.getenv("INVITE_REFILL_SECONDS", "60")),
+        INVITE_FAKE_API=str_to_bool(os.getenv("INVITE_FAKE_API", "false")),
+        OUTBOX_POLL_SECONDS=float(os.getenv("OUTBOX_POLL_SECONDS", "1")),
+        MONGO_TIMEOUT_SECONDS=float(os.getenv("MONGO_TIMEOUT_SECONDS", "5")),
+        TELEGRAM_TIMEOUT_SECONDS=float(os.getenv("TELEGRAM_TIMEOUT_SECONDS", "10")),
+        BREAKER_FAILURES=int(os.getenv("BREAKER_FAILURES", "5")),
+        BREAKER_RESET_SECONDS=float(os.getenv("BREAKER_RESET_SECONDS", "30")),
+        BROADCAST_CONCURRENCY=int(os.getenv("BROADCAST_CONCURRENCY", "10")),
+        BROADCAST_POLL_SECONDS=int(os.getenv("BROADCAST_POLL_SECONDS", "10")),
+        TENANTS_FILE=os.getenv("TENANTS_FILE", ""),
+        DATA_DIR=os.getenv("DATA_DIR", ""),
+        TELEGRAM_ADMIN_IDS=os.getenv("TELEGRAM_ADMIN_IDS", ""),
+        TELEGRAM_MODERATOR_IDS=os.getenv("TELEGRAM_MODERATOR_IDS", ""),
+        CLAIM_TIMEOUT_MINUTES=int(os.getenv("CLAIM_TIMEOUT_MINUTES", "15")),
     )
@@ -0,0 +1,106 @@
+import logging
+import time
+from typing import Dict, List
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes
+
+from . import digest, tenants
+
+# A burst is forwarded at the latest this long after its first line, even if the student keeps typing
+MAX_WAIT = 120.0
+MAX_MESSAGE = 4000
+
+logger = logging.getLogger(__name__)
+
+_debounce = 20.0
+# telegram_id -> {"name", "lines", "first"}; kept in memory, a restart drops an unsent burst
+_bursts: "tenants.Local[Dict[int, Dict]]" = tenants.Local(dict)
+
+
+def configure(debounce_seconds: float):
+    global _debounce
+    _debounce = debounce_seconds
+
+
+def _job_name(telegram_id: int) -> str:
+    return f"contact:{telegram_id}"
+
+
+def render(telegram_id: int, name: str, lines: List[str]) -> str:
+    body = "\n".join(lines)
+    header = (
+        f"📧 رسالة من الطالب\n\n"
+        f"👤 الاسم: {name}\n"
+        f"🆔 المعرف: {telegram_id}\n\n"
+        f"💬 الرسالة{f' ({len(lines)} أسطر)' if len(lines) > 1 else ''}:\n"
+    )
+    text = header + body
+    return text if len(text) <= MAX_MESSAGE else text[:MAX_MESSAGE - 1] + "…"
+
+
+def reply_keyboard(telegram_id: int) -> InlineKeyboardMarkup:
+    # Opens the direct message conversation with this student
+    return InlineKeyboardMarkup([[InlineKeyboardButton("↩️ رد", callback_data=f"admin_msg_{telegram_id}")]])
+
+
+async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Buffer one line of a student's contact message and (re)start the debounce timer.
+
+    Consecutive lines sent within the window go to the admin as one message. The student stays in
+    contact mode until the burst is forwarded.
+    """
+    user = update.effective_user
+    name = user.full_name or f"الطالب {user.id}"
+    bursts = _bursts.get()
+    burst = bursts.get(user.id)
+    first = burst is None
+    if first:
+        burst = bursts[user.id] = {"name": name, "lines": [], "first": time.monotonic()}
+    burst["lines"].append(update.message.text)
+
+    if not context.job_queue or _debounce <= 0:
+        await flush(context, user.id)
+    else:
+        for job in context.job_queue.get_jobs_by_name(_job_name(user.id)):
+            job.schedule_removal()
+        delay = min(_debounce, max(MAX_WAIT - (time.monotonic() - burst["first"]), 0))
+        context.job_queue.run_once(flush_job, delay, user_id=user.id, name=_job_name(user.id))
+    if first:
+        await update.message.reply_text("✅ تم استلام رسالتك وسيتم إيصالها للمعلمة شهد طراف. يمكنك إضافة المزيد.")
+
+
+async def flush(context: ContextTypes.DEFAULT_TYPE, telegram_id: int):
+    burst = _bursts.get().pop(telegram_id, None)
+    if context.user_data is not None:
+        context.user_data.pop("awaiting_contact_message", None)
+    if not burst:
+        return
+    lines = burst["lines"]
+    deferred = await digest.defer("contact", f"{burst['name']} ({telegram_id}): {' / '.join(lines)}", telegram_id)
+    if deferred:
+        return
+    try:
+        await context.bot.send_message(
+            chat_id=context.bot_data.get("ADMIN_ID"),
+            text=render(telegram_id, burst["name"], lines),
+            reply_markup=reply_keyboard(telegram_id),
+        )
+    except Exception as e:
+        logger.warning("could not forward contact message of %s: %r", telegram_id, e)
+        try:
+            await context.bot.send_message(chat_id=telegram_id, text=f"❌ حدث خطأ: {str(e)}")
+        except Exception:
+            pass
+
+
+async def flush_job(context: ContextTypes.DEFAULT_TYPE):
+    await flush(context, context.job.user_id)
+
+
+def discard(telegram_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """Drop an unsent burst, e.g. on /cancel."""
+    _bursts.get().pop(telegram_id, None)
+    if context.job_queue:
+        for job in context.job_queue.get_jobs_by_name(_job_name(telegram_id)):
+            job.schedule_removal()
@@ -1,19 +1,39 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
-from .models import User
+from . import tenants
+from .archive import ARCHIVE_USERS
+from .models import User, CourseSeats, BroadcastJob, Reminder
 from typing import Dict, Any
 
 _client = None
+# Databases Beanie has been initialised on (one per tenant, all on the same client)
+_ready: set = set()
+# Deadline for every Mongo operation (pymongo's timeoutMS); None waits as long as the driver does
+_timeout_ms = None
+
+
+def configure(timeout_seconds: float):
+    global _timeout_ms
+    _timeout_ms = int(timeout_seconds * 1000) or None
 
 
 async def init_db(mongo_url: str, db_name: str):
+    # The driver reconnects on its own, so an existing client is kept: replacing it would strand
+    # the per-tenant collections already bound to it (see tenants.collection)
+    if _client is None:
+        await _connect(mongo_url)
+    if db_name in _ready:
+        return
+    # Indexes are created through the models, which resolve the current tenant's database
+    with tenants.use(tenants.owner(db_name)):
+        await init_beanie(database=_client[db_name], document_models=[User, CourseSeats, BroadcastJob, Reminder])
+    # find_user falls back to the archive on every miss, including each new student's /start
+    await _client[db_name][ARCHIVE_USERS].create_index("telegram_id")
+    _ready.add(db_name)
+
+
+async def _connect(mongo_url: str):
     global _client
-    if _client is not None:
-        try:
-            await _client.admin.command("ping")
-            return
-        except Exception:
-            _client = None
     tls_kwargs: Dict[str, Any] = {}
     try:
         if mongo_url.startswith("mongodb+srv://") or "mongodb.net" in mongo_url:
@@ -24,18 +44,16 @@ async def init_db(mongo_url: str, db_name: str):
 
     # First attempt: strict TLS with CA
     try:
-        _client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=30000, **tls_kwargs)
+        _client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=30000, timeoutMS=_timeout_ms, **tls_kwargs)
         await _client.admin.command("ping")
     except Exception:
         # Retry with permissive TLS to bypass corporate MITM or strict SSL issues
         retry_kwargs = dict(tls_kwargs)
         retry_kwargs["tls"] = True
         retry_kwargs["tlsAllowInvalidCertificates"] = True
-        _client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=30000, **retry_kwargs)
+        _client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=30000, timeoutMS=_timeout_ms, **retry_kwargs)
         await _client.admin.command("ping")
 
-    await init_beanie(database=_client[db_name], document_models=[User])
-
 
 def get_client() -> AsyncIOMotorClient:
     return _client
@@ -0,0 +1,137 @@
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo.errors import PyMongoError
+from telegram import Bot
+from telegram.ext import ContextTypes
+
+from .models import User
+
+DIGEST_COLLECTION = "admin_digest"
+MAX_MESSAGE = 4000
+# A worker that died mid-send releases its events after this long
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+# Section titles, in the order they appear in the digest
+KINDS = {
+    "receipt": "💳 إيصالات دفع جديدة",
+    "web_proof": "🌐 إثباتات دفع من الموقع",
+    "registration": "👤 طلاب جدد",
+    "contact": "📧 رسائل الطلاب",
+    "web_contact": "🌐 رسائل الموقع",
+}
+
+logger = logging.getLogger(__name__)
+
+_minutes = 0
+_urgent: set = set()
+
+
+def configure(minutes: int, urgent_kinds: Iterable[str] = ()):
+    global _minutes, _urgent
+    _minutes = minutes
+    _urgent = {k.strip() for k in urgent_kinds if k.strip()}
+
+
+def enabled() -> bool:
+    return _minutes > 0
+
+
+def buffers(kind: str) -> bool:
+    """Whether ``kind`` events go into the digest rather than straight to the admin."""
+    return enabled() and kind not in _urgent
+
+
+def _events():
+    return User.get_motor_collection().database[DIGEST_COLLECTION]
+
+
+async def defer(kind: str, line: str, telegram_id: Optional[int] = None, urgent: bool = False) -> bool:
+    """Queue an admin notification for the next digest.
+
+    Returns False when the caller should notify right away: digest mode is off, the event is
+    urgent, or the buffer can't be written.
+    """
+    if urgent or not buffers(kind):
+        return False
+    try:
+        await _events().insert_one({"kind": kind, "line": line, "telegram_id": telegram_id, "at": datetime.utcnow(), "claim": None})
+    except PyMongoError as e:
+        logger.warning("digest buffer unavailable, notifying directly: %r", e)
+        return False
+    return True
+
+
+def _deep_link(bot: Bot, payload: str) -> str:
+    return f"https://t.me/{bot.username}?start={payload}"
+
+
+def render(bot: Bot, events: List[Dict[str, Any]]) -> List[str]:
+    """Digest text split into messages that fit Telegram's limit."""
+    by_kind: Dict[str, List[Dict[str, Any]]] = {}
+    for e in events:
+        by_kind.setdefault(e["kind"], []).append(e)
+    lines = [f"🗂 ملخص آخر {_minutes} دقيقة ({len(events)} حدث)"]
+    for kind, title in KINDS.items():
+        items = by_kind.get(kind)
+        if not items:
+            continue
+        lines.append("")
+        lines.append(f"{title} ({len(items)}):")
+        for e in items:
+            line = f"• {e['line']}"
+            if kind == "receipt" and e.get("telegram_id"):
+                line += f"\n  ↳ {_deep_link(bot, 's' + str(e['telegram_id']))}"
+            lines.append(line)
+    if "receipt" in by_kind:
+        lines.append("")
+        lines.append(f"📥 كل الطلبات المعلقة: {_deep_link(bot, 'pending')}")
+
+    messages: List[str] = []
+    current = ""
+    for line in lines:
+        if len(line) > MAX_MESSAGE:
+            line = line[:MAX_MESSAGE - 1] + "…"
+        if current and len(current) + len(line) + 1 > MAX_MESSAGE:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+async def send_digest(bot: Bot, admin_id: int) -> int:
+    """Send everything buffered so far as one summary. Returns the number of events sent."""
+    coll = _events()
+    # Claim first so a second worker running the same job doesn't send the same events
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    await coll.update_many(
+        {"$or": [{"claim": None}, {"claimed_at": {"$lt": now - CLAIM_TIMEOUT}}]},
+        {"$set": {"claim": token, "claimed_at": now}},
+    )
+    events = await coll.find({"claim": token}).sort("at", 1).to_list(length=None)
+    if not events:
+        return 0
+    try:
+        for text in render(bot, events):
+            await bot.send_message(chat_id=admin_id, text=text, disable_web_page_preview=True)
+    except Exception:
+        # Release the claim; the next run tries again
+        await coll.update_many({"claim": token}, {"$set": {"claim": None}})
+        raise
+    await coll.delete_many({"claim": token})
+    return len(events)
+
+
+async def digest_job(context: ContextTypes.DEFAULT_TYPE):
+    admin_id = context.bot_data.get("ADMIN_ID")
+    if not admin_id:
+        return
+    try:
+        await send_digest(context.bot, admin_id)
+    except Exception as e:
+        logger.warning("admin digest failed: %r", e)
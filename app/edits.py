@@ -0,0 +1,97 @@
+"""Message edits that skip no-ops and merge rapid changes to the same message.
+
+``edit_text`` remembers a hash of what was last sent to each message and does nothing when the
+new text and markup hash the same, which also avoids Telegram's "message is not modified" error.
+``later`` delays an edit by a short window; further calls for the same message inside the window
+only replace the renderer, so a burst of taps costs one edit showing the final state.
+
+Both are kept per tenant: each bot numbers its messages separately, and a private chat has the
+user's id with every bot, so (chat_id, message_id) alone would mix up two tenants' messages.
+"""
+import asyncio
+import json
+import logging
+import time
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from . import tenants
+
+WINDOW = 0.5
+# Hashes of messages not edited for this long are forgotten
+TTL = 600.0
+MAX_TRACKED = 5000
+
+Key = Tuple[int, int]
+Render = Callable[[], Tuple[str, Optional[InlineKeyboardMarkup]]]
+
+logger = logging.getLogger(__name__)
+
+_sent: "tenants.Local[Dict[Key, Tuple[int, float]]]" = tenants.Local(dict)
+_pending: "tenants.Local[Dict[Key, Render]]" = tenants.Local(dict)
+
+
+def _hash(text: str, markup: Optional[InlineKeyboardMarkup]) -> int:
+    payload = json.dumps([text, markup.to_dict() if markup else None], sort_keys=True, ensure_ascii=False)
+    return zlib.crc32(payload.encode())
+
+
+def _prune(sent: Dict[Key, Tuple[int, float]], now: float):
+    if len(sent) <= MAX_TRACKED:
+        return
+    for key in [k for k, (_, at) in sent.items() if now - at > TTL]:
+        del sent[key]
+
+
+async def edit_text(
+    bot: Bot, chat_id: int, message_id: int, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None
+) -> bool:
+    """Edit unless the message already shows exactly this. Returns True if an edit was sent."""
+    key = (chat_id, message_id)
+    h = _hash(text, reply_markup)
+    now = time.monotonic()
+    sent = _sent.get()
+    last = sent.get(key)
+    if last and last[0] == h:
+        return False
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+    _prune(sent, now)
+    sent[key] = (h, now)
+    return True
+
+
+def later(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, render: Render):
+    """Schedule an edit of this message; ``render`` is called when the window closes."""
+    key = (chat_id, message_id)
+    pending = _pending.get()
+    first = key not in pending
+    pending[key] = render
+    if not first:
+        return
+
+    async def flush():
+        await asyncio.sleep(WINDOW)
+        latest = pending.pop(key, None)
+        if latest is None:
+            return
+        text, markup = latest()
+        try:
+            await edit_text(context.bot, chat_id, message_id, text, markup)
+        except Exception as e:
+            logger.warning("coalesced edit of %s failed: %r", key, e)
+
+    context.application.create_task(flush())
+
+
+def forget(chat_id: int, message_id: int):
+    """The message was changed some other way; drop what we know about it."""
+    _sent.get().pop((chat_id, message_id), None)
+    _pending.get().pop((chat_id, message_id), None)
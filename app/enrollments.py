@@ -0,0 +1,341 @@
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import ReturnDocument, UpdateOne
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from . import claims, codec, invites, outbox, reminders, seats
+from .loaders import get_course_by_id, get_group_link
+from .models import CourseEnrollment, Notification, User
+from .ratelimit import BULK
+from .users import find_user
+
+
+async def submit_receipt(
+    telegram_id: int,
+    course_ids: List[str],
+    method: str,
+    file_id: str,
+    notify_admin: Union[int, List[int], None] = None,
+    op_id: Optional[str] = None,
+) -> Tuple[str, List[str]]:
+    """Mark every course in ``course_ids`` as pending review with the given receipt.
+
+    Courses whose cohort is full are waitlisted instead. With ``notify_admin`` (one reviewer id or
+    a list of them), the review request for the rest goes into the outbox in the same
+    transaction. Returns the student name and the waitlisted course ids.
+
+    ``op_id`` is the journal entry id: running the same entry again doesn't repeat the change or
+    its notifications.
+    """
+    reviewers = [notify_admin] if isinstance(notify_admin, int) else list(notify_admin or [])
+    student = await find_user(telegram_id)
+    if student and op_id and any(n.op_id == op_id for n in student.notifications):
+        # Applied by an attempt that timed out after the write; only the review request may be missing
+        waitlisted = [e.course_id for e in student.courses if e.course_id in course_ids and e.approval_status == "waitlisted"]
+        to_review = [cid for cid in course_ids if cid not in waitlisted]
+        if reviewers and to_review:
+            name = student.full_name or str(telegram_id)
+            await outbox.enqueue(
+                [receipt_notice(r, telegram_id, name, to_review, method, file_id) for r in reviewers], key=op_id
+            )
+        return student.full_name, waitlisted
+    if not student:
+        student = User(
+            telegram_id=telegram_id,
+            full_name="",
+            phone="",
+            email="",
+        )
+    waitlisted: List[str] = []
+    for course_id in course_ids:
+        status = "pending"
+        if await seats.reserve(course_id, telegram_id) == seats.WAITLISTED:
+            status = "waitlisted"
+            waitlisted.append(course_id)
+        updated = False
+        for e in student.courses:
+            if e.course_id == course_id:
+                e.payment_method = method
+                e.payment_receipt = file_id
+                e.approval_status = status
+                e.claimed_by = e.claimed_until = None
+                updated = True
+                break
+        if not updated:
+            student.courses.append(
+                CourseEnrollment(
+                    course_id=course_id,
+                    payment_method=method,
+                    payment_receipt=file_id,
+                    approval_status=status,
+                )
+            )
+    student.notifications.append(
+        Notification(
+            student_id=student.telegram_id,
+            type="payment_submitted",
+            message="تم إرسال إثبات الدفع",
+            op_id=op_id,
+        )
+    )
+    student.last_active = datetime.utcnow()
+    to_review = [cid for cid in course_ids if cid not in waitlisted]
+    async with outbox.transaction() as session:
+        await student.save(session=session)
+        if reviewers and to_review:
+            name = student.full_name or str(telegram_id)
+            await outbox.enqueue(
+                [receipt_notice(r, telegram_id, name, to_review, method, file_id) for r in reviewers],
+                session=session,
+                key=op_id,
+            )
+    for course_id in course_ids:
+        if course_id not in waitlisted:
+            await reminders.on_status(telegram_id, course_id, "pending")
+    return student.full_name, waitlisted
+
+
+async def save_profile(
+    telegram_id: int,
+    full_name: str,
+    phone: str,
+    email: str,
+    study_year: Optional[int],
+    specialization: str,
+    op_id: Optional[str] = None,
+) -> bool:
+    """Create or update the registration profile. Returns True for new students.
+
+    The profile is absolute state, so ``op_id`` (the journal entry id) isn't needed to run an
+    entry again safely.
+    """
+    user_doc = await find_user(telegram_id)
+    is_new = user_doc is None
+    if not user_doc:
+        user_doc = User(
+            telegram_id=telegram_id,
+            full_name=full_name,
+            phone=phone,
+            email=email,
+            study_year=study_year,
+            specialization=specialization,
+        )
+    else:
+        user_doc.full_name = full_name
+        user_doc.phone = phone
+        user_doc.email = email
+        user_doc.study_year = study_year
+        user_doc.specialization = specialization
+        user_doc.last_active = datetime.utcnow()
+    await user_doc.save()
+    return is_new
+
+
+async def set_status(
+    telegram_id: int,
+    course_id: str,
+    status: str,
+    message: str,
+    notify: Optional[List[Dict]] = None,
+    reviewer: Optional[int] = None,
+    op_id: Optional[str] = None,
+) -> Optional[str]:
+    """Atomically set one enrollment's status. Returns the student name, or None if missing.
+
+    ``notify`` are outbox messages written together with the change (see :mod:`app.outbox`).
+    With ``reviewer`` this is a review decision: it only applies while the enrollment is pending
+    and not claimed by another reviewer, so None also means "decided or taken meanwhile".
+    ``op_id`` is the journal entry id; the change and its notices are applied once per entry.
+    """
+    now = datetime.utcnow()
+    notification = Notification(student_id=telegram_id, type=status, message=message, op_id=op_id)
+    match: Dict = {"course_id": course_id}
+    if reviewer is not None:
+        match.update(approval_status="pending", **claims.free_for(reviewer, now))
+    query: Dict = {"telegram_id": telegram_id, "courses": {"$elemMatch": match}}
+    if op_id:
+        query["notifications.op_id"] = {"$ne": op_id}
+    async with outbox.transaction() as session:
+        doc = await User.get_motor_collection().find_one_and_update(
+            query,
+            {
+                "$set": {"courses.$.approval_status": status, "updated_at": now, **claims.RELEASED},
+                "$push": {"notifications": notification.dict()},
+            },
+            projection={"full_name": 1},
+            return_document=ReturnDocument.AFTER,
+            session=session,
+        )
+        if doc and notify:
+            await outbox.enqueue(notify, session=session, key=op_id)
+    if not doc and op_id:
+        # Applied before by this entry (the attempt timed out after the write): finish its notices
+        doc = await User.get_motor_collection().find_one(
+            {"telegram_id": telegram_id, "notifications.op_id": op_id}, {"full_name": 1}
+        )
+        if doc and notify:
+            await outbox.enqueue(notify, key=op_id)
+    if not doc:
+        return None
+    await reminders.on_status(telegram_id, course_id, status, now)
+    return doc.get("full_name") or ""
+
+
+async def approve(
+    telegram_id: int, course_id: str, reviewer: Optional[int] = None, op_id: Optional[str] = None
+) -> Optional[str]:
+    """Approve one enrollment; the student's notice with their group link is written with it.
+
+    The personal link is issued first: issuing is idempotent per student and course, so a
+    decision that loses the compare-and-set leaves the link reserved for that student rather than
+    using up another one. Returns the student name, or None if nothing was approved.
+    """
+    course = get_course_by_id(course_id) or {"name": course_id}
+    link = await invites.issue(telegram_id, course_id)
+    text = f"تمت الموافقة على تسجيلك في {course.get('name')} ✅"
+    if link:
+        text += f"\n\nرابط المجموعة: {link}"
+    return await set_status(
+        telegram_id,
+        course_id,
+        "approved",
+        f"تمت الموافقة على تسجيلك في {course_id}",
+        notify=[outbox.message(telegram_id, text)],
+        reviewer=reviewer,
+        op_id=op_id,
+    )
+
+
+async def pending_items(
+    telegram_ids: Optional[List[int]] = None, course_id: Optional[str] = None, reviewer: Optional[int] = None
+) -> List[Tuple[int, str, str]]:
+    """(telegram_id, course_id, student name) of pending enrollments, sorted for stable paging.
+
+    With ``reviewer``, enrollments other reviewers have claimed are left out.
+    """
+    now = datetime.utcnow()
+    match: Dict = {"approval_status": "pending"}
+    if course_id is not None:
+        match["course_id"] = course_id
+    query: Dict = {"courses": {"$elemMatch": match}}
+    if telegram_ids is not None:
+        query["telegram_id"] = {"$in": telegram_ids}
+    items: List[Tuple[int, str, str]] = []
+    cursor = User.get_motor_collection().find(query, {"telegram_id": 1, "full_name": 1, "courses": 1})
+    async for doc in cursor:
+        for e in doc.get("courses", []):
+            if e.get("approval_status") != "pending" or (course_id is not None and e.get("course_id") != course_id):
+                continue
+            if reviewer is None or claims.holder(e.get("claimed_by"), e.get("claimed_until"), now) in (None, reviewer):
+                items.append((doc["telegram_id"], e["course_id"], doc.get("full_name") or ""))
+    items.sort(key=lambda i: (i[0], i[1]))
+    return items
+
+
+async def bulk_set_status(
+    items: Iterable[Tuple[int, str]], status: str, reviewer: Optional[int] = None
+) -> List[Tuple[int, str]]:
+    """Move pending enrollments to ``status`` with a single bulk_write.
+
+    Only enrollments still pending are touched, so a repeated or overlapping bulk action is a
+    no-op; with ``reviewer``, so are the ones another reviewer has claimed. Returns the
+    (telegram_id, course_id) pairs this call changed: an item decided or claimed by someone else
+    between the read and the write is left out, so nothing downstream acts on it.
+
+    Each changed item's notice goes into the outbox in the same transaction, keyed by the
+    decision and the item.
+    """
+    wanted = {(int(tid), cid) for tid, cid in items}
+    if not wanted:
+        return []
+    tids = sorted({tid for tid, _ in wanted})
+    pending = {(tid, cid) for tid, cid, _ in await pending_items(telegram_ids=tids, reviewer=reviewer)} & wanted
+    if not pending:
+        return []
+    # Links are issued once per student and course, so one left over by a lost item isn't wasted
+    links = await invites.issue_many(sorted(pending)) if status == "approved" else {}
+    now = datetime.utcnow()
+    decision_id = uuid.uuid4().hex
+    ops = []
+    for tid, cid in sorted(pending):
+        notification = Notification(student_id=tid, type=status, message=status_notice(status, [cid]))
+        match: Dict = {"course_id": cid, "approval_status": "pending"}
+        if reviewer is not None:
+            match.update(claims.free_for(reviewer, now))
+        ops.append(UpdateOne(
+            {"telegram_id": tid, "courses": {"$elemMatch": match}},
+            {
+                "$set": {
+                    "courses.$.approval_status": status,
+                    "courses.$.decision_id": decision_id,
+                    "updated_at": now,
+                    **claims.RELEASED,
+                },
+                "$push": {"notifications": notification.dict()},
+            },
+        ))
+    coll = User.get_motor_collection()
+    async with outbox.transaction() as session:
+        result = await coll.bulk_write(ops, ordered=False, session=session)
+        applied = pending
+        if result.modified_count < len(ops):
+            # Some conditions no longer held at write time; only the ones stamped by us changed
+            applied = set()
+            cursor = coll.find(
+                {"telegram_id": {"$in": tids}, "courses.decision_id": decision_id},
+                {"telegram_id": 1, "courses": 1},
+                session=session,
+            )
+            async for doc in cursor:
+                for e in doc.get("courses", []):
+                    if e.get("decision_id") == decision_id:
+                        applied.add((doc["telegram_id"], e["course_id"]))
+        for tid, cid in sorted(applied):
+            text = status_notice(status, [cid], {cid: links.get((tid, cid))})
+            await outbox.enqueue(
+                [outbox.message(tid, text, priority=BULK)], session=session, key=f"{decision_id}:{tid}:{cid}"
+            )
+    for tid, cid in sorted(applied):
+        await reminders.on_status(tid, cid, status, now)
+    return sorted(applied)
+
+
+def status_notice(status: str, course_ids: List[str], links: Optional[Dict[str, Optional[str]]] = None) -> str:
+    """Student-facing message for one or more decisions, with group links on approval.
+
+    ``links`` overrides the static group link per course, e.g. with personal invite links.
+    """
+    names = [(get_course_by_id(cid) or {"name": cid}).get("name") for cid in course_ids]
+    if status == "approved":
+        lines = []
+        for cid, name in zip(course_ids, names):
+            link = (links or {}).get(cid) or get_group_link(cid)
+            lines.append(f"• {name}" + (f"\nرابط المجموعة: {link}" if link else ""))
+        return "تمت الموافقة على تسجيلك ✅\n\n" + "\n\n".join(lines)
+    return "تم رفض طلبك ❌\n\n" + "\n".join(f"• {n}" for n in names)
+
+
+def receipt_notice(
+    admin_id: int, student_id: int, student_name: str, course_ids: List[str], method: str, file_id: Optional[str] = None
+) -> Dict:
+    """Outbox message asking the admin to review a receipt: the photo once, a row of controls per item."""
+    names = [(get_course_by_id(cid) or {"name": cid}).get("name") for cid in course_ids]
+    caption = (
+        f"طلب جديد لموافقة الدفع\n"
+        f"الطالب: {student_name}\n"
+        f"الطريقة: {'Sham' if method=='sham' else 'HARAM'}\n"
+        f"الدورة/المادة:\n"
+        + "\n".join(f"• {n}" for n in names)
+    )
+    rows = [
+        [
+            InlineKeyboardButton(f"✅ {name}", callback_data=codec.pack("a", student_id, cid)),
+            InlineKeyboardButton("❌ رفض", callback_data=codec.pack("r", student_id, cid)),
+        ]
+        for cid, name in zip(course_ids, names)
+    ]
+    if len(course_ids) > 1:
+        rows.append([InlineKeyboardButton("✅ الموافقة على الكل", callback_data=codec.pack("A", student_id))])
+    return outbox.message(admin_id, caption, InlineKeyboardMarkup(rows), photo=file_id)
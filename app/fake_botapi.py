@@ -0,0 +1,119 @@
+"""Stand-in for a local ``telegram-bot-api`` server, for tests and offline runs.
+
+Answers the Bot API methods this project uses with plausible objects and records every call::
+
+    uvicorn app.fake_botapi:app --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_LOCAL_MODE=true python bot.py
+
+``GET /_calls`` lists the recorded calls and ``DELETE /_calls`` clears them.
+"""
+import asyncio
+import itertools
+import json
+import secrets
+import time
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+
+CALLS: List[Dict[str, Any]] = []
+_message_ids = itertools.count(1)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+
+
+def _param(value: Any) -> Any:
+    # PTB sends nested objects (reply_markup, ...) as JSON-encoded form fields
+    if isinstance(value, str) and value[:1] in "[{":
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _chat(chat_id: Any) -> Dict[str, Any]:
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return {"id": -1, "type": "channel", "username": str(chat_id).lstrip("@")}
+    return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+
+
+def _message(params: Dict[str, Any], **extra) -> Dict[str, Any]:
+    message = {
+        "message_id": int(params.get("message_id") or next(_message_ids)),
+        "date": int(time.time()),
+        "chat": _chat(params.get("chat_id")),
+        "from": BOT_USER,
+    }
+    if params.get("reply_markup"):
+        message["reply_markup"] = params["reply_markup"]
+    message.update(extra)
+    return message
+
+
+def _file_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+async def _result(method: str, params: Dict[str, Any]) -> Any:
+    if method == "getMe":
+        return BOT_USER
+    if method == "getUpdates":
+        # Behave like an idle long poll, but don't hold the client for the whole timeout
+        await asyncio.sleep(min(float(params.get("timeout") or 0), 1.0))
+        return []
+    if method in ("sendMessage", "editMessageText"):
+        return _message(params, text=params.get("text", ""))
+    if method in ("sendPhoto", "editMessageCaption"):
+        photo = [{"file_id": _file_id(), "file_unique_id": _file_id(), "width": 1, "height": 1}]
+        return _message(params, photo=photo, caption=params.get("caption", ""))
+    if method == "editMessageReplyMarkup":
+        return _message(params)
+    if method == "createChatInviteLink":
+        return {
+            "invite_link": f"https://t.me/+{secrets.token_urlsafe(12)}",
+            "creator": BOT_USER,
+            "creates_join_request": False,
+            "is_primary": False,
+            "is_revoked": False,
+            "member_limit": int(params.get("member_limit") or 0) or None,
+            "name": params.get("name"),
+        }
+    if method == "getFile":
+        file_id = params.get("file_id", "")
+        # Local mode hands out absolute paths on the server's disk
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": 0, "file_path": f"/tmp/fake_botapi/{file_id}"}
+    if method == "getWebhookInfo":
+        return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+    # answerCallbackQuery, setWebhook, deleteWebhook, setMyCommands, close, logOut, ...
+    return True
+
+
+@app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+async def bot_method(token: str, method: str, request: Request):
+    params: Dict[str, Any] = dict(request.query_params)
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        params.update(await request.json())
+    elif request.method == "POST":
+        form = await request.form()
+        for key, value in form.items():
+            params[key] = value.filename if hasattr(value, "filename") else _param(value)
+    CALLS.append({"method": method, "params": params, "at": time.time()})
+    return JSONResponse({"ok": True, "result": await _result(method, params)})
+
+
+@app.get("/_calls")
+async def calls():
+    return CALLS
+
+
+@app.delete("/_calls")
+async def clear_calls():
+    CALLS.clear()
+    return {"ok": True}
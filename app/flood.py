@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from telegram import CallbackQuery, Update
+from telegram.ext import ApplicationHandlerStop, BaseHandler, ContextTypes, filters
+
+from .ratelimit import TokenBucket
+
+KINDS = ("callback", "command", "text", "other")
+# Throttled callbacks get at most one "slow down" answer per user in this many seconds
+WARN_EVERY = 3.0
+MAX_TRACKED = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """``"callback=10/10,command=3/10"`` -> {kind: (updates, seconds)}; unknown kinds are ignored."""
+    limits: Dict[str, Tuple[float, float]] = {}
+    for part in spec.split(","):
+        kind, _, value = part.strip().partition("=")
+        if kind not in KINDS or "/" not in value:
+            continue
+        count, seconds = value.split("/", 1)
+        try:
+            limits[kind] = (float(count), float(seconds))
+        except ValueError:
+            logger.warning("bad flood limit %r", part)
+    return limits
+
+
+def _kind(update: Update) -> str:
+    if update.callback_query:
+        return "callback"
+    if update.message and update.message.text:
+        return "command" if filters.COMMAND.check_update(update) else "text"
+    return "other"
+
+
+class FloodGuard(BaseHandler[Update, ContextTypes.DEFAULT_TYPE]):
+    """Per-user token buckets, meant for a handler group that runs before everything else.
+
+    Everything happens in ``check_update``, so no update touches the database here. Updates within
+    the limit are passed on. Updates over the limit raise ``ApplicationHandlerStop`` right there:
+    PTB catches it in the same loop that would otherwise build the context and load the user's
+    data from persistence before ``handle_update``. Throttled callback queries get a short answer
+    (sent in the background) so the button stops spinning; everything else is dropped.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], exempt: Iterable[int] = ()):
+        super().__init__(self._throttled)
+        self._limits = limits
+        self._exempt = set(exempt)
+        self._buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self._warned: Dict[int, float] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _bucket(self, user_id: int, kind: str, now: float) -> Optional[TokenBucket]:
+        limit = self._limits.get(kind)
+        if not limit:
+            return None
+        key = (user_id, kind)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) > MAX_TRACKED:
+                # Forget users whose bucket has refilled; they start from a full one anyway
+                for k in [k for k, b in self._buckets.items() if b.wait_time(now) == 0 and b.tokens >= b.capacity]:
+                    del self._buckets[k]
+                self._warned = {u: t for u, t in self._warned.items() if now - t < WARN_EVERY}
+            count, seconds = limit
+            bucket = TokenBucket(count / seconds, count)
+            self._buckets[key] = bucket
+        return bucket
+
+    def check_update(self, update: object) -> None:
+        if not isinstance(update, Update) or not update.effective_user:
+            return None
+        user_id = update.effective_user.id
+        if user_id in self._exempt:
+            return None
+        kind = _kind(update)
+        now = time.monotonic()
+        bucket = self._bucket(user_id, kind, now)
+        if bucket is None or bucket.wait_time(now) == 0:
+            if bucket is not None:
+                bucket.tokens -= 1
+            return None
+        logger.debug("throttled %s from %s", kind, user_id)
+        q = update.callback_query
+        if q and now - self._warned.get(user_id, 0.0) >= WARN_EVERY:
+            self._warned[user_id] = now
+            task = asyncio.get_running_loop().create_task(self._warn(q))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        raise ApplicationHandlerStop
+
+    async def _warn(self, q: CallbackQuery):
+        try:
+            await q.answer("⏳ على مهلك، حاول بعد لحظات")
+        except Exception:
+            pass
+
+    async def _throttled(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Never called: check_update stops throttled updates itself
+        return None
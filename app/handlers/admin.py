@@ -1,31 +1,54 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import logging
+import zlib
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram.ext import ContextTypes, CommandHandler
 
-from ..models import User, Notification
-from ..loaders import get_course_by_id, get_group_link
+from .. import analytics, broadcast, claims, codec, contact, enrollments, journal, outbox, review, roles, seats
+from ..models import User
+from ..loaders import get_course_by_id
+from ..router import Router
+from ..users import find_user
 
 
 AWAITING_DIRECT_MESSAGE = 11
 
 
 def _is_admin(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
-    return user_id == context.bot_data.get("ADMIN_ID")
+    return roles.is_admin(context.bot_data, user_id)
 
 
-async def _send_pending_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    users: List[User] = await User.find_all().to_list()
+def _is_reviewer(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> bool:
+    return roles.is_reviewer(context.bot_data, user_id)
+
+
+def _parse_item(data: str) -> Tuple[int, str]:
+    """(student id, course id) from a packed callback or the older ``admin_<action>_<sid>_<cid>``."""
+    if data.startswith(codec.PREFIX):
+        _, (sid, course_id) = codec.unpack(data)
+        return sid, course_id
+    _, _, sid, course_id = data.split("_", 3)
+    return int(sid), course_id
+
+
+async def _send_pending_list(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: Optional[int] = None):
+    query = {"courses.approval_status": "pending"}
+    if telegram_id is not None:
+        query["telegram_id"] = telegram_id
+    users: List[User] = await User.find(query).to_list()
+    reviewer = update.effective_user.id
     buttons = []
     for u in users:
         for e in u.courses:
             if e.approval_status == "pending":
                 course = get_course_by_id(e.course_id) or {"name": e.course_id}
                 student_name = u.full_name or str(u.telegram_id)
+                # Still listed, so it can be picked up once the other reviewer's claim lapses
+                taken = claims.holder(e.claimed_by, e.claimed_until) not in (None, reviewer)
                 buttons.append([
                     InlineKeyboardButton(
-                        f"{student_name} • {course.get('name')}",
-                        callback_data=f"admin_pending_{u.telegram_id}_{e.course_id}",
+                        f"{'🔒 ' if taken else ''}{student_name} • {course.get('name')}",
+                        callback_data=codec.pack("v", u.telegram_id, e.course_id),
                     )
                 ])
     if not buttons:
@@ -35,6 +58,7 @@ async def _send_pending_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
         else:
             await update.effective_chat.send_message(msg)
         return
+    buttons.append([InlineKeyboardButton("☑️ تحديد متعدد", callback_data=codec.pack("m", 0))])
     text = "✅ **الطلبات المعلقة للموافقة على الدفع**\n\nاختر طلبًا لعرض التفاصيل:"
     if update.message:
         await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
@@ -42,8 +66,19 @@ async def _send_pending_list(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.effective_chat.send_message(text, reply_markup=InlineKeyboardMarkup(buttons))
 
 
+async def open_deep_link(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> bool:
+    """``/start pending`` or ``/start s<telegram_id>`` from the admin digest."""
+    if payload == "pending":
+        await _send_pending_list(update, context)
+        return True
+    if payload.startswith("s") and payload[1:].isdigit():
+        await _send_pending_list(update, context, telegram_id=int(payload[1:]))
+        return True
+    return False
+
+
 async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not _is_admin(context, update.effective_user.id):
+    if not _is_reviewer(context, update.effective_user.id):
         await update.message.reply_text("❌ غير مخول.")
         return
     await _send_pending_list(update, context)
@@ -55,10 +90,9 @@ async def handle_admin_menu_text(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     text = update.message.text.strip()
-    admin_id = context.bot_data.get("ADMIN_ID")
     
-    # Only admin can use these buttons
-    if update.effective_user.id != admin_id:
+    # Only admins can use these buttons
+    if not _is_admin(context, update.effective_user.id):
         return
     
     if text == "✅ الموافقة على الدفع":
@@ -80,15 +114,22 @@ async def handle_admin_menu_text(update: Update, context: ContextTypes.DEFAULT_T
 async def admin_pending_detail_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    if not _is_admin(context, q.from_user.id):
+    if not _is_reviewer(context, q.from_user.id):
         await q.edit_message_text("❌ غير مخول.")
         return
     try:
-        _, _, sid, course_id = q.data.split("_", 3)
-        sid = int(sid)
+        sid, course_id = _parse_item(q.data)
     except Exception:
         await q.edit_message_text("❌ بيانات الطلب غير صالحة.")
         return
+    # Opening a request claims it, so two reviewers don't work the same one
+    holder = await claims.claim(sid, course_id, q.from_user.id)
+    if holder is None:
+        await q.edit_message_text("⚠️ لم يعد هذا الطلب قيد الانتظار.")
+        return
+    if holder != q.from_user.id:
+        await q.edit_message_text(f"🔒 هذا الطلب قيد المراجعة من مشرف آخر ({holder}). حاول لاحقاً.")
+        return
     user: User = await User.find_one(User.telegram_id == sid)
     course = get_course_by_id(course_id) or {"name": course_id}
     student_name = (user.full_name if user else None) or str(sid)
@@ -97,6 +138,7 @@ async def admin_pending_detail_cb(update: Update, context: ContextTypes.DEFAULT_
         f"الطالب: {student_name}\n"
         f"المعرف: {sid}\n"
         f"الدورة/المادة: {course.get('name')}\n"
+        f"🔒 محجوز لك لمدة {claims.minutes()} دقيقة\n"
     )
     receipt = None
     if user:
@@ -106,9 +148,12 @@ async def admin_pending_detail_cb(update: Update, context: ContextTypes.DEFAULT_
                 break
     kb = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("موافقة", callback_data=f"admin_approve_{sid}_{course_id}"),
-            InlineKeyboardButton("رفض", callback_data=f"admin_reject_{sid}_{course_id}"),
-        ]
+            InlineKeyboardButton("موافقة", callback_data=codec.pack("a", sid, course_id)),
+            InlineKeyboardButton("رفض", callback_data=codec.pack("r", sid, course_id)),
+        ],
+        [InlineKeyboardButton("✅ كل طلبات الطالب", callback_data=codec.pack("S", sid))],
+        [InlineKeyboardButton("✅ كل طلبات هذه المادة", callback_data=codec.pack("C", course_id))],
+        [InlineKeyboardButton("🔓 تحرير الطلب", callback_data=codec.pack("u", sid, course_id))],
     ])
     if receipt:
         try:
@@ -125,6 +170,34 @@ async def admin_pending_detail_cb(update: Update, context: ContextTypes.DEFAULT_
     await q.edit_message_text(text, reply_markup=kb)
 
 
+async def release_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Hand an opened request back to the queue before the claim times out."""
+    q = update.callback_query
+    await q.answer()
+    if not _is_reviewer(context, q.from_user.id):
+        return
+    try:
+        _, (sid, course_id) = codec.unpack(q.data)
+    except (codec.StaleCallback, ValueError):
+        await q.answer("❌ بيانات الطلب غير صالحة.", show_alert=True)
+        return
+    await claims.release(sid, course_id, q.from_user.id)
+    await _mark_done(q, sid, [course_id], "🔓 تم تحرير الطلب")
+
+
+async def _not_applied(q, sid: int, course_id: str):
+    """A decision that didn't go through: another reviewer has the request, or it's decided."""
+    holder = await claims.current(sid, course_id)
+    if holder and holder != q.from_user.id:
+        # Keep the controls; they work again once that claim lapses
+        try:
+            await q.message.reply_text(f"🔒 هذا الطلب قيد المراجعة من مشرف آخر ({holder}).")
+        except Exception:
+            pass
+        return
+    await _mark_done(q, sid, [course_id], "⚠️ لا يوجد طلب")
+
+
 # ========== Student -> Admin contact ==========
 async def contact_admin_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -146,44 +219,20 @@ async def capture_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     # Student contacting admin
     if context.user_data.get("awaiting_contact_message") and update.message and update.message.text:
-        admin_id = context.bot_data.get("ADMIN_ID")
-        student_name = update.effective_user.full_name or f"الطالب {update.effective_user.id}"
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"📧 **رسالة من الطالب**\n\n"
-                     f"👤 الاسم: {student_name}\n"
-                     f"🆔 المعرف: {update.effective_user.id}\n\n"
-                     f"💬 الرسالة:\n{update.message.text}",
-            )
-        except Exception as e:
-            await update.message.reply_text(f"❌ حدث خطأ: {str(e)}")
-            return
-        context.user_data.pop("awaiting_contact_message", None)
-        await update.message.reply_text("✅ تم إرسال رسالتك للمعلمة شهد طراف بنجاح!")
+        await contact.add(update, context)
         return
 
     # Admin broadcast flow
     if _is_admin(context, update.effective_user.id) and context.user_data.get("awaiting_broadcast") and update.message and update.message.text:
-        from ..models import User
         text = update.message.text
         try:
-            users = await User.find_all().to_list()
-            success_count = 0
-            for u in users:
-                try:
-                    await context.bot.send_message(
-                        chat_id=u.telegram_id, 
-                        text=f"📢 **رسالة من المعلمة**\n\n{text}"
-                    )
-                    success_count += 1
-                except Exception:
-                    continue
+            await broadcast.create_job(text, progress_chat_id=update.effective_chat.id)
         except Exception as e:
             await update.message.reply_text(f"❌ حدث خطأ: {str(e)}")
             return
         context.user_data.pop("awaiting_broadcast", None)
-        await update.message.reply_text(f"✅ تم إرسال البث لـ {success_count} طالب.")
+        # Progress is reported by editing a single message in this chat
+        broadcast.start(context.application)
         return
 
     # Admin direct message flow
@@ -208,112 +257,314 @@ async def capture_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
 
+def _item_of(button: InlineKeyboardButton) -> Optional[Tuple[str, int, str]]:
+    try:
+        tag, values = codec.unpack(button.callback_data or "")
+    except codec.StaleCallback:
+        return None
+    if tag in ("a", "r") and len(values) == 2:
+        return tag, values[0], values[1]
+    return None
+
+
+async def _mark_done(q, sid: int, course_ids: List[str], label: str):
+    """Drop the handled items' controls from a receipt message and note the outcome on it."""
+    done = set(course_ids)
+    markup = q.message.reply_markup
+    rows = []
+    for row in (markup.inline_keyboard if markup else []):
+        items = [_item_of(b) for b in row]
+        if any(i and i[1] == sid and i[2] in done for i in items):
+            continue
+        rows.append(row)
+    # Only "approve all" left: nothing to act on anymore
+    if not any(_item_of(b) for row in rows for b in row):
+        rows = []
+    names = [(get_course_by_id(cid) or {"name": cid}).get("name") for cid in course_ids]
+    note = "\n".join(f"{label}: {n}" for n in names)
+    try:
+        if q.message.photo:
+            await q.edit_message_caption(
+                caption=f"{q.message.caption or ''}\n\n{note}", reply_markup=InlineKeyboardMarkup(rows)
+            )
+        else:
+            await q.edit_message_text(f"{q.message.text or ''}\n\n{note}", reply_markup=InlineKeyboardMarkup(rows))
+    except Exception:
+        pass
+
+
+async def _approve(sid: int, course_id: str, reviewer: Optional[int] = None) -> Optional[str]:
+    """Approve one enrollment and notify the student. Returns the student name ("" when journaled), None if missing."""
+    student_name = await journal.run("approve", telegram_id=sid, course_id=course_id, reviewer=reviewer)
+    if student_name is None:
+        return None
+    if student_name is journal.JOURNALED:
+        student_name = ""
+    analytics.track("approve", sid, course_id)
+    return student_name
+
+
 async def approve_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    if not _is_admin(context, q.from_user.id):
+    if not _is_reviewer(context, q.from_user.id):
         await q.edit_message_text("غير مخول.")
         return
-    _, _, sid, course_id = q.data.split("_", 3)
-    sid = int(sid)
-
-    user: User = await User.find_one(User.telegram_id == sid)
-    if not user:
-        await q.edit_message_text("الطالب غير موجود.")
-        return
-    updated = False
-    for e in user.courses:
-        if e.course_id == course_id:
-            e.approval_status = "approved"
-            updated = True
-            break
-    if not updated:
-        await q.edit_message_text("لا يوجد طلب لهذه الدورة.")
-        return
-
-    user.notifications.append(
-        Notification(
-            student_id=user.telegram_id,
-            type="approved",
-            message=f"تمت الموافقة على تسجيلك في {course_id}",
-        )
-    )
-    await user.save()
+    try:
+        sid, course_id = _parse_item(q.data)
+    except ValueError:
+        await q.edit_message_text("❌ بيانات الطلب غير صالحة.")
+        return
 
     course = get_course_by_id(course_id) or {"name": course_id}
     course_name = course.get("name")
-    group_link = get_group_link(course_id)
-
-    # Notify student immediately
-    try:
-        text = f"تمت الموافقة على تسجيلك في {course_name} ✅"
-        if group_link:
-            text += f"\n\nرابط المجموعة: {group_link}"
-        await context.bot.send_message(chat_id=sid, text=text)
-    except Exception:
-        pass
+    # The student's notice, with a personal link once the approval is in, goes out through the outbox
+    student_name = await _approve(sid, course_id, reviewer=q.from_user.id)
+    if student_name is None:
+        await _not_applied(q, sid, course_id)
+        return
 
     # Notify admin that approval was completed
     admin_id = context.bot_data.get("ADMIN_ID")
     if admin_id:
-        student_name = user.full_name or str(sid)
+        student_name = student_name or str(sid)
         try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=(
-                    "✅ تم تنفيذ الموافقة بنجاح\n\n"
-                    f"👤 الطالب: {student_name} ({sid})\n"
-                    f"📘 الدورة/المادة: {course_name}"
-                ),
-            )
+            await outbox.enqueue([outbox.message(
+                admin_id,
+                "✅ تم تنفيذ الموافقة بنجاح\n\n"
+                f"👤 الطالب: {student_name} ({sid})\n"
+                f"📘 الدورة/المادة: {course_name}",
+            )])
         except Exception:
             pass
 
-    await q.edit_message_text("تمت الموافقة وإرسال الرسالة للطالب.")
+    await _mark_done(q, sid, [course_id], "✅ تمت الموافقة")
+
+
+async def _decide(
+    context: ContextTypes.DEFAULT_TYPE, items: List[Tuple[int, str]], status: str, reviewer: int
+) -> List[Tuple[int, str]]:
+    """Apply a bulk decision; the outbox delivers the students' notices at bulk priority."""
+    applied, promoted = await review.apply(items, status, reviewer)
+    for tid, course_id in promoted:
+        await _promote_from_waitlist(context, tid, course_id)
+    return applied
+
+
+async def _report_bulk(context: ContextTypes.DEFAULT_TYPE, chat_id: int, applied: List[Tuple[int, str]], status: str):
+    label = "✅ تمت الموافقة على" if status == "approved" else "❌ تم رفض"
+    if not applied:
+        text = "لا توجد طلبات معلقة مطابقة."
+    else:
+        students = len({tid for tid, _ in applied})
+        text = f"{label} {len(applied)} طلب لـ {students} طالب. يتم إشعار الطلاب الآن."
+    try:
+        await context.bot.send_message(chat_id=chat_id, text=text)
+    except Exception:
+        pass
+
+
+async def approve_all_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Approve every item still open on a receipt message."""
+    q = update.callback_query
+    await q.answer()
+    if not _is_reviewer(context, q.from_user.id):
+        return
+    try:
+        _, (sid,) = codec.unpack(q.data)
+    except (codec.StaleCallback, ValueError):
+        await q.answer("❌ بيانات الطلب غير صالحة.", show_alert=True)
+        return
+    markup = q.message.reply_markup
+    course_ids = [
+        item[2]
+        for row in (markup.inline_keyboard if markup else [])
+        for item in map(_item_of, row)
+        if item and item[0] == "a" and item[1] == sid
+    ]
+    decided = await _decide(context, [(sid, cid) for cid in course_ids], "approved", q.from_user.id)
+    approved = [cid for _, cid in decided]
+    if approved:
+        await _mark_done(q, sid, approved, "✅ تمت الموافقة")
+    missing = [cid for cid in course_ids if cid not in approved]
+    if missing:
+        await _mark_done(q, sid, missing, "⚠️ لا يوجد طلب أو يراجعه مشرف آخر")
+
+
+async def approve_student_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Approve everything pending for one student."""
+    q = update.callback_query
+    await q.answer()
+    if not _is_reviewer(context, q.from_user.id):
+        return
+    try:
+        _, (sid,) = codec.unpack(q.data)
+    except (codec.StaleCallback, ValueError):
+        await q.answer("❌ بيانات الطلب غير صالحة.", show_alert=True)
+        return
+    items = [(tid, cid) for tid, cid, _ in await enrollments.pending_items(telegram_ids=[sid], reviewer=q.from_user.id)]
+    applied = await _decide(context, items, "approved", q.from_user.id)
+    await _report_bulk(context, q.message.chat_id, applied, "approved")
+
+
+async def approve_course_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Approve everything pending for one course."""
+    q = update.callback_query
+    await q.answer()
+    if not _is_reviewer(context, q.from_user.id):
+        return
+    try:
+        _, (course_id,) = codec.unpack(q.data)
+    except (codec.StaleCallback, ValueError):
+        await q.answer("❌ بيانات الطلب غير صالحة.", show_alert=True)
+        return
+    items = [(tid, cid) for tid, cid, _ in await enrollments.pending_items(course_id=course_id, reviewer=q.from_user.id)]
+    applied = await _decide(context, items, "approved", q.from_user.id)
+    await _report_bulk(context, q.message.chat_id, applied, "approved")
+
+
+# Multi-select works on the first page of the (sorted) pending queue, minus what other reviewers
+# have claimed; the selection is a bitmask in the callback and a fingerprint of the page detects
+# that the queue changed in between.
+SELECT_PAGE = 30
+
+
+def _fingerprint(items) -> int:
+    return zlib.crc32(repr([(tid, cid) for tid, cid, _ in items]).encode()) & 0xFFFF
+
+
+async def _select_page(reviewer: int):
+    items = (await enrollments.pending_items(reviewer=reviewer))[:SELECT_PAGE]
+    return items, _fingerprint(items)
+
+
+def _select_keyboard(items, fp: int, mask: int) -> InlineKeyboardMarkup:
+    rows = []
+    for i, (tid, cid, name) in enumerate(items):
+        course = get_course_by_id(cid) or {"name": cid}
+        mark = "☑️" if mask >> i & 1 else "⬜"
+        rows.append([InlineKeyboardButton(
+            f"{mark} {name or tid} • {course.get('name')}", callback_data=codec.pack("m", mask ^ (1 << i), fp)
+        )])
+    everything = (1 << len(items)) - 1
+    rows.append([
+        InlineKeyboardButton("تحديد الكل", callback_data=codec.pack("m", everything, fp)),
+        InlineKeyboardButton("إلغاء التحديد", callback_data=codec.pack("m", 0, fp)),
+    ])
+    rows.append([
+        InlineKeyboardButton("✅ موافقة على المحدد", callback_data=codec.pack("M", mask, fp, 1)),
+        InlineKeyboardButton("❌ رفض المحدد", callback_data=codec.pack("M", mask, fp, 0)),
+    ])
+    return InlineKeyboardMarkup(rows)
+
+
+async def select_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not _is_reviewer(context, q.from_user.id):
+        await q.answer()
+        return
+    try:
+        _, (mask, fp) = codec.unpack(q.data)
+    except (codec.StaleCallback, ValueError):
+        mask, fp = 0, None
+    items, current = await _select_page(q.from_user.id)
+    if fp is not None and fp != current:
+        # Someone else decided something meanwhile; start over on the fresh page
+        mask = 0
+        await q.answer("تغيّرت قائمة الطلبات، تم تحديثها.")
+    else:
+        await q.answer()
+    if not items:
+        await q.edit_message_text("لا توجد طلبات قيد الانتظار.")
+        return
+    await q.edit_message_text(
+        f"☑️ تحديد متعدد ({len(codec.indexes_of(mask))} محدد من {len(items)})",
+        reply_markup=_select_keyboard(items, current, mask),
+    )
+
+
+async def select_apply_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not _is_reviewer(context, q.from_user.id):
+        await q.answer()
+        return
+    try:
+        _, (mask, fp, approve) = codec.unpack(q.data)
+    except (codec.StaleCallback, ValueError):
+        await q.answer("❌ بيانات الطلب غير صالحة.", show_alert=True)
+        return
+    items, current = await _select_page(q.from_user.id)
+    if fp != current:
+        await q.answer("تغيّرت قائمة الطلبات، راجع التحديد من جديد.", show_alert=True)
+        await q.edit_message_text("☑️ تحديد متعدد", reply_markup=_select_keyboard(items, current, 0))
+        return
+    chosen = [(items[i][0], items[i][1]) for i in codec.indexes_of(mask) if i < len(items)]
+    if not chosen:
+        await q.answer("لم يتم تحديد أي طلب.")
+        return
+    await q.answer()
+    status = "approved" if approve else "rejected"
+    applied = await _decide(context, chosen, status, q.from_user.id)
+    await q.edit_message_reply_markup(reply_markup=None)
+    await _report_bulk(context, q.message.chat_id, applied, status)
 
 
 async def reject_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    if not _is_admin(context, q.from_user.id):
+    if not _is_reviewer(context, q.from_user.id):
         await q.edit_message_text("غير مخول.")
         return
-    _, _, sid, course_id = q.data.split("_", 3)
-    sid = int(sid)
+    try:
+        sid, course_id = _parse_item(q.data)
+    except ValueError:
+        await q.edit_message_text("❌ بيانات الطلب غير صالحة.")
+        return
 
-    user: User = await User.find_one(User.telegram_id == sid)
-    if not user:
-        await q.edit_message_text("الطالب غير موجود.")
-        return
-    updated = False
-    for e in user.courses:
-        if e.course_id == course_id:
-            e.approval_status = "rejected"
-            updated = True
-            break
-    if not updated:
-        await q.edit_message_text("لا يوجد طلب لهذه الدورة.")
-        return
-
-    user.notifications.append(
-        Notification(
-            student_id=user.telegram_id,
-            type="rejected",
-            message=f"تم رفض طلبك للدورة {course_id}",
-        )
+    course = get_course_by_id(course_id) or {"name": course_id}
+    student_name = await journal.run(
+        "set_status",
+        telegram_id=sid,
+        course_id=course_id,
+        status="rejected",
+        message=f"تم رفض طلبك للدورة {course_id}",
+        notify=[outbox.message(sid, f"تم رفض طلبك للدورة {course.get('name')} ❌")],
+        reviewer=q.from_user.id,
     )
-    await user.save()
+    if student_name is None:
+        await _not_applied(q, sid, course_id)
+        return
 
-    course = get_course_by_id(course_id) or {"name": course_id}
     try:
-        await context.bot.send_message(
-            chat_id=sid,
-            text=f"تم رفض طلبك للدورة {course.get('name')} ❌",
-        )
+        promoted = await seats.release(course_id, sid)
+        if promoted:
+            await _promote_from_waitlist(context, promoted, course_id)
     except Exception:
-        pass
+        logging.getLogger(__name__).exception("seat release failed for %s/%s", sid, course_id)
 
-    await q.edit_message_text("تم الرفض.")
+    await _mark_done(q, sid, [course_id], "❌ تم الرفض")
+
+
+async def _promote_from_waitlist(context: ContextTypes.DEFAULT_TYPE, sid: int, course_id: str):
+    """A seat freed up: move the waitlisted enrollment into the admin's review queue."""
+    from .payment import _notify_admin
+
+    course = get_course_by_id(course_id) or {"name": course_id}
+    name = await enrollments.set_status(
+        sid,
+        course_id,
+        "pending",
+        f"توفر مقعد في {course_id}",
+        notify=[outbox.message(sid, f"🎉 توفر مقعد لك في {course.get('name')}!\nطلبك الآن قيد المراجعة.")],
+    )
+    if name is None:
+        return
+    user = await find_user(sid)
+    enrollment = next((e for e in (user.courses if user else []) if e.course_id == course_id), None)
+    if enrollment:
+        await _notify_admin(
+            context, sid, name or str(sid), [course_id], enrollment.payment_method, enrollment.payment_receipt
+        )
 
 
 async def ack_notification_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -334,9 +585,14 @@ async def cancel_chat_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text("تم إلغاء طلب المراسلة.")
 
 
+async def direct_message_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop("awaiting_direct_to", None)
+
+
 # ========== Admin utilities ==========
 async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop("awaiting_contact_message", None)
+    contact.discard(update.effective_user.id, context)
     context.user_data.pop("awaiting_broadcast", None)
     context.user_data.pop("awaiting_direct_to", None)
     await update.message.reply_text("تم الإلغاء.")
@@ -392,6 +648,26 @@ async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def funnel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _is_admin(context, update.effective_user.id):
+        await update.message.reply_text("❌ غير مخول.")
+        return
+    await analytics.flush()
+    rows = await analytics.conversion_by_course()
+    if not rows:
+        await update.message.reply_text("لا توجد بيانات بعد.")
+        return
+    lines = ["📈 التحويل خلال آخر 30 يوماً (مشاهدة ← دفع ← إيصال ← موافقة):\n"]
+    for r in rows:
+        course = get_course_by_id(r["course_id"]) or {"name": r["course_id"]}
+        lines.append(
+            f"• {course.get('name')}\n"
+            f"   {r['view']} ← {r['pay']} ← {r['receipt']} ← {r['approve']}"
+            f"  ({r['view_to_receipt']:.0%} / {r['receipt_to_approve']:.0%})"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+
 async def admin_stat_select_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -462,23 +738,30 @@ def get_handlers():
         CommandHandler("broadcast", broadcast_cmd),
         CommandHandler("students", students_cmd),
         CommandHandler("stats", stats_cmd),
-        CallbackQueryHandler(admin_pending_detail_cb, pattern="^admin_pending_"),
-        CallbackQueryHandler(approve_cb, pattern="^admin_approve_"),
-        CallbackQueryHandler(reject_cb, pattern="^admin_reject_"),
-        CallbackQueryHandler(ack_notification_cb, pattern="^notification_course_approved_"),
-        CallbackQueryHandler(admin_stat_select_cb, pattern="^admin_stat_"),
-        CallbackQueryHandler(start_chat_cb, pattern="^start_chat$"),
-        CallbackQueryHandler(cancel_chat_cb, pattern="^cancel_chat$"),
-        # Admin menu buttons - must be before other text handlers
-        MessageHandler(
-            filters.TEXT
-            & filters.Regex(
-                "^(✅ الموافقة على الدفع|👥 قائمة الطلاب|📢 بث جماعي|📢 ارسال رسالة|📢  ارسال رسالة|📊 الإحصائيات|🏠 الرئيسية)$"
-            ),
-            handle_admin_menu_text,
-        ),
+        CommandHandler("funnel", funnel_cmd),
     ]
 
 
-def get_catchall_handler():
-    return MessageHandler(filters.TEXT & ~filters.COMMAND, capture_messages)
+def add_routes(router: Router):
+    router.query(codec.route("v"), admin_pending_detail_cb)
+    router.query(codec.route("a"), approve_cb)
+    router.query(codec.route("r"), reject_cb)
+    router.query(codec.route("A"), approve_all_cb)
+    router.query(codec.route("S"), approve_student_cb)
+    router.query(codec.route("C"), approve_course_cb)
+    router.query(codec.route("m"), select_cb)
+    router.query(codec.route("M"), select_apply_cb)
+    router.query(codec.route("u"), release_cb)
+    # Buttons sent before callbacks were packed
+    router.query("admin_pending_", admin_pending_detail_cb)
+    router.query("admin_approve_", approve_cb)
+    router.query("admin_reject_", reject_cb)
+    router.query("notification_course_approved_", ack_notification_cb)
+    router.query("admin_stat_", admin_stat_select_cb)
+    router.query("start_chat", start_chat_cb, exact=True)
+    router.query("cancel_chat", cancel_chat_cb, exact=True)
+    # Admin menu buttons win over the student menu for shared labels
+    router.text(
+        ["✅ الموافقة على الدفع", "👥 قائمة الطلاب", "📢 بث جماعي", "📢 ارسال رسالة", "📢  ارسال رسالة", "📊 الإحصائيات", "🏠 الرئيسية"],
+        handle_admin_menu_text,
+    )
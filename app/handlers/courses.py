@@ -1,11 +1,16 @@
-from typing import Optional, List, Dict
+import time
+from typing import Optional, List, Dict, Tuple
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import ContextTypes, MessageHandler, CommandHandler, CallbackQueryHandler, filters
+from telegram.ext import ContextTypes, CommandHandler
 
+from .. import analytics, codec, contact, edits, invites, tenants
 from ..models import User
-from ..loaders import get_courses, get_course_by_id, get_group_link
+from ..router import Router
+from ..users import find_user_cached
+from ..loaders import get_courses, get_course_by_id
 from ..catalog import MATERIALS_BY_YEAR, MATERIALS, get_materials_by_year_semester, calculate_materials_price
 from ..keyboards import get_courses_keyboard, course_details_keyboard, categories_keyboard
+from .payment import seats_note
 
 
 CATEGORY_PRO = "📚 الدورات الاحترافية"
@@ -56,7 +61,7 @@ async def handle_category_text(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     
     if text == "📋 حالة الدفع":
-        user_doc: User = await User.find_one(User.telegram_id == update.effective_user.id)
+        user_doc: User = await find_user_cached(update.effective_user.id)
         if not user_doc or not user_doc.courses:
             await update.message.reply_text(
                 "📋 حالة دفعاتك:\n\n"
@@ -69,7 +74,7 @@ async def handle_category_text(update: Update, context: ContextTypes.DEFAULT_TYP
         for course in user_doc.courses:
             course_obj = get_course_by_id(course.course_id)
             course_name = course_obj.get("name") if course_obj else course.course_id
-            status_emoji = "✅" if course.approval_status == "approved" else "⏳" if course.approval_status == "pending" else "❌"
+            status_emoji = {"approved": "✅", "pending": "⏳", "waitlisted": "🕒"}.get(course.approval_status, "❌")
             status_text += f"{status_emoji} {course_name}\n"
             status_text += f"   الحالة: {course.approval_status}\n\n"
         
@@ -106,9 +111,10 @@ async def course_details_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not course:
         await q.edit_message_text("❌ لم يتم العثور على الدورة.")
         return
+    analytics.track("view", q.from_user.id, course_id)
 
     # Check enrollment status
-    user_doc: User = await User.find_one(User.telegram_id == q.from_user.id)
+    user_doc: User = await find_user_cached(q.from_user.id)
     status = None
     if user_doc:
         for e in user_doc.courses:
@@ -119,7 +125,7 @@ async def course_details_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if status == "approved":
         # Show full details for approved students
         text = course.get("description") or f"الدورة: {course.get('name')}"
-        group_link = get_group_link(course_id)
+        group_link = await invites.issue(q.from_user.id, course_id)
         if group_link:
             text += f"\n\n🔗 رابط المجموعة:\n{group_link}"
         text += "\n\n✅ أنت مسجل في هذه الدورة!"
@@ -157,7 +163,6 @@ async def uni_year_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     year = int(q.data.split("_")[-1])
-    context.user_data["uni_ctx"] = {"year": year}
     year_name = {3: "الثالثة ", 4: "الرابعة (ذكاء)", 5: " (ذكاء)الخامسة"}.get(year, str(year))
     buttons = [
         [InlineKeyboardButton("📚 الفصل الأول", callback_data=f"uni_sem_{year}_1")],
@@ -167,41 +172,80 @@ async def uni_year_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.edit_message_text(f"📖 السنة {year_name}\n\nاختر الفصل:", reply_markup=InlineKeyboardMarkup(buttons))
 
 
-def _materials_keyboard(year: int, sem: int, selected: List[str]) -> InlineKeyboardMarkup:
+# The cart is the selection within one semester, carried as a bitmask in every button
+# (see app.codec), so these handlers keep no per-user state.
+
+def _selected(year: int, sem: int, mask: int) -> List[str]:
+    mats = get_materials_by_year_semester(year, sem)
+    return [mats[i]["id"] for i in codec.indexes_of(mask) if i < len(mats)]
+
+
+def _materials_keyboard(year: int, sem: int, mask: int) -> InlineKeyboardMarkup:
     mats = get_materials_by_year_semester(year, sem)
     rows: List[List[InlineKeyboardButton]] = []
-    for m in mats:
-        mid = m["id"]
-        name = m["name"]
-        chosen = "✅" if mid in selected else "➕"
+    for i, m in enumerate(mats):
+        chosen = "✅" if mask >> i & 1 else "➕"
         rows.append([
-            InlineKeyboardButton(f"📖 {name}", callback_data=f"uni_detail_{mid}"),
-            InlineKeyboardButton(f"{chosen}", callback_data=f"uni_toggle_{mid}"),
+            InlineKeyboardButton(f"📖 {m['name']}", callback_data=codec.pack("d", year, sem, mask, i)),
+            InlineKeyboardButton(f"{chosen}", callback_data=codec.pack("t", year, sem, mask, i)),
         ])
     # cart and back
-    rows.append([InlineKeyboardButton(f"🧺 السلة ({len(selected)})", callback_data="uni_cart")])
+    rows.append([InlineKeyboardButton(f"🧺 السلة ({len(_selected(year, sem, mask))})", callback_data=codec.pack("c", year, sem, mask))])
     rows.append([InlineKeyboardButton("⬅️ رجوع", callback_data="back_courses")])
     return InlineKeyboardMarkup(rows)
 
 
+# Semester screens with toggles in flight: (chat_id, message_id) -> [year, sem, shown mask, latest mask, at].
+# Per tenant: every bot numbers its messages separately, and a private chat's id is the user's for all of them
+_carts: "tenants.Local[Dict[Tuple[int, int], List]]" = tenants.Local(dict)
+CART_TTL = 600.0
+
+
+def _forget(q):
+    """The message is being redrawn by another screen."""
+    if q.message:
+        _carts.get().pop((q.message.chat_id, q.message.message_id), None)
+        edits.forget(q.message.chat_id, q.message.message_id)
+
+
+async def _unpack(q) -> Optional[List]:
+    try:
+        return codec.unpack(q.data)[1]
+    except codec.StaleCallback:
+        await q.answer("انتهت صلاحية هذه القائمة، افتح المواد من جديد.", show_alert=True)
+        return None
+
+
 async def uni_sem_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    if q.data.startswith("uni_sem_"):
+        _, _, year, sem = q.data.split("_")
+        year, sem, mask = int(year), int(sem), 0
+    else:
+        values = await _unpack(q)
+        if values is None:
+            return
+        year, sem, mask = values
     await q.answer()
-    _, _, year, sem = q.data.split("_")
-    year, sem = int(year), int(sem)
-    context.user_data["uni_ctx"] = {"year": year, "sem": sem}
-    selected: List[str] = context.user_data.get("uni_selected") or []
+    _forget(q)
     await q.edit_message_text(
         "اختر المواد (يمكنك اختيار أكثر من مادة):",
-        reply_markup=_materials_keyboard(year, sem, selected),
+        reply_markup=_materials_keyboard(year, sem, mask),
     )
 
 
 async def uni_detail_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    values = await _unpack(q)
+    if values is None:
+        return
+    year, sem, mask, index = values
     await q.answer()
-    mid = q.data.split("uni_detail_", 1)[1]
-    mat: Dict = MATERIALS.get(mid) or {"id": mid, "name": mid}
+    _forget(q)
+    mats = get_materials_by_year_semester(year, sem)
+    mat: Dict = mats[index] if index < len(mats) else {}
+    mid = mat.get("id", "")
+    analytics.track("view", q.from_user.id, mid)
     # Professional details text
     text = (
         f"📚 {mat.get('name')}\n\n"
@@ -218,35 +262,52 @@ async def uni_detail_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Add payment and contact buttons
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("💳 الدفع عبر Sham", callback_data=f"pay_sham_{mid}"), InlineKeyboardButton("💳 الدفع عبر HARAM", callback_data=f"pay_haram_{mid}")],
-        [InlineKeyboardButton("➕ إضافة للسلة", callback_data=f"uni_toggle_{mid}" )],
+        [InlineKeyboardButton("➕ إضافة للسلة", callback_data=codec.pack("t", year, sem, mask, index))],
         [InlineKeyboardButton("💬 تواصل مع الإدارة", callback_data="contact_admin")],
-        [InlineKeyboardButton("⬅️ رجوع", callback_data=f"uni_sem_{mat.get('year')}_{mat.get('semester')}")],
+        [InlineKeyboardButton("⬅️ رجوع", callback_data=codec.pack("s", year, sem, mask))],
     ])
     await q.edit_message_text(text, reply_markup=kb)
 
 
 async def uni_toggle_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
-    mid = q.data.split("uni_toggle_", 1)[1]
-    selected: List[str] = context.user_data.get("uni_selected") or []
-    if mid in selected:
-        selected.remove(mid)
-        msg = "❌ تم إزالة المادة من السلة"
-    else:
-        selected.append(mid)
+    values = await _unpack(q)
+    if values is None:
+        return
+    year, sem, mask, index = values
+    key = (q.message.chat_id, q.message.message_id)
+    now = time.monotonic()
+    carts = _carts.get()
+    cart = carts.get(key)
+    # Taps on a keyboard that hasn't been redrawn yet all carry the mask it was drawn with;
+    # build on the toggles already applied since
+    if cart and cart[:3] == [year, sem, mask]:
+        mask = cart[3]
+    shown = cart[2] if cart and cart[:2] == [year, sem] else values[2]
+    mask ^= 1 << index
+    if len(carts) > 5000:
+        for k in [k for k, c in carts.items() if now - c[4] > CART_TTL]:
+            del carts[k]
+    carts[key] = [year, sem, shown, mask, now]
+    if mask >> index & 1:
         msg = "✅ تم إضافة المادة للسلة"
-    context.user_data["uni_selected"] = selected
+        mats = get_materials_by_year_semester(year, sem)
+        if index < len(mats):
+            analytics.track("cart", q.from_user.id, mats[index]["id"])
+    else:
+        msg = "❌ تم إزالة المادة من السلة"
     await q.answer(msg, show_alert=False)
-    ctx = context.user_data.get("uni_ctx") or {}
-    year, sem = ctx.get("year"), ctx.get("sem")
-    if year and sem:
-        await q.edit_message_text(
-            f"اختر المواد (محدد: {len(selected)}):",
-            reply_markup=_materials_keyboard(year, sem, selected),
+
+    def render():
+        latest = carts[key]
+        latest[2] = latest[3]
+        return (
+            f"اختر المواد (محدد: {len(_selected(year, sem, latest[3]))}):",
+            _materials_keyboard(year, sem, latest[3]),
         )
-    else:
-        await _edit_university_years(update, context)
+
+    # Rapid taps on the same message end up as one edit with the final selection
+    edits.later(context, key[0], key[1], render)
 
 
 def _calc_price(selected: List[str]) -> int:
@@ -255,8 +316,17 @@ def _calc_price(selected: List[str]) -> int:
 
 async def uni_cart_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    values = await _unpack(q)
+    if values is None:
+        return
+    year, sem, mask = values
     await q.answer()
-    selected: List[str] = context.user_data.get("uni_selected") or []
+    cart = _carts.get().get((q.message.chat_id, q.message.message_id))
+    if cart and cart[:3] == [year, sem, mask]:
+        # The cart button was tapped before the last toggles were drawn
+        mask = cart[3]
+    _forget(q)
+    selected = _selected(year, sem, mask)
     if not selected:
         await q.edit_message_text("❌ سلتك فارغة. اختر مواداً أولاً.")
         return
@@ -273,64 +343,89 @@ async def uni_cart_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"💵 الإجمالي النهائي: {total:,} ل.س"
     )
     kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton("💳 الدفع عبر Sham", callback_data="uni_pay_sham"), InlineKeyboardButton("💳 الدفع عبر HARAM", callback_data="uni_pay_haram")],
-        [InlineKeyboardButton("⬅️ رجوع للمواد", callback_data=f"uni_sem_{context.user_data.get('uni_ctx',{}).get('year',3)}_{context.user_data.get('uni_ctx',{}).get('sem',1)}")],
-        [InlineKeyboardButton("🗑️ إلغاء السلة", callback_data="uni_clear")],
+        [
+            InlineKeyboardButton("💳 الدفع عبر Sham", callback_data=codec.pack("p", year, sem, mask, 0)),
+            InlineKeyboardButton("💳 الدفع عبر HARAM", callback_data=codec.pack("p", year, sem, mask, 1)),
+        ],
+        [InlineKeyboardButton("⬅️ رجوع للمواد", callback_data=codec.pack("s", year, sem, mask))],
+        [InlineKeyboardButton("🗑️ إلغاء السلة", callback_data=codec.pack("x", year, sem))],
     ])
     await q.edit_message_text(text, reply_markup=kb)
 
 
 async def uni_clear_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    values = await _unpack(q)
+    if values is None:
+        return
+    year, sem = values
     await q.answer()
-    context.user_data.pop("uni_selected", None)
-    ctx = context.user_data.get("uni_ctx") or {}
-    year, sem = ctx.get("year"), ctx.get("sem")
-    if year and sem:
-        await q.edit_message_text("تم إفراغ السلة.", reply_markup=_materials_keyboard(year, sem, []))
-    else:
-        await _edit_university_years(update, context)
+    _forget(q)
+    await q.edit_message_text("تم إفراغ السلة.", reply_markup=_materials_keyboard(year, sem, 0))
 
 
 async def uni_pay_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    values = await _unpack(q)
+    if values is None:
+        return
+    year, sem, mask, method_flag = values
     await q.answer()
-    selected: List[str] = context.user_data.get("uni_selected") or []
+    _forget(q)
+    selected = _selected(year, sem, mask)
     if not selected:
         await q.edit_message_text("سلتك فارغة.")
         return
-    method = "sham" if q.data.endswith("sham") else "haram"
-    context.user_data["payment_material_ids"] = selected.copy()
+    method = "haram" if method_flag else "sham"
+    for mid in selected:
+        analytics.track("pay", q.from_user.id, mid)
+    # The receipt arrives as a photo, which carries no callback data
+    context.user_data["payment_material_ids"] = selected
     context.user_data["payment_method"] = method
     sham = context.bot_data.get("SHAM") or ""
     haram = context.bot_data.get("HARAM") or ""
     target_num = sham if method == "sham" else haram
     await q.edit_message_text(
         f"طريقة الدفع: {'Sham' if method=='sham' else 'HARAM'}\nأرسل الآن صورة إثبات الدفع.\nرقم التحويل: {target_num}"
+        + await seats_note(selected)
     )
 
 
+async def uni_expired_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cart buttons from before the cart moved into callback data."""
+    q = update.callback_query
+    await q.answer("انتهت صلاحية هذه القائمة، افتح المواد من جديد.")
+    await _edit_university_years(update, context)
+
+
 def get_handlers():
     return [
         CommandHandler("courses", show_categories),
         CommandHandler("university", show_categories),
-        # Main menu buttons - must be before other text handlers
-        MessageHandler(filters.TEXT & filters.Regex("^(📚 الدورات الاحترافية|🎓 المواد الجامعية|💬 تواصل مع المعلمة|📋 حالة الدفع|🏠 الرئيسية)$"), handle_category_text),
-        CallbackQueryHandler(back_courses_cb, pattern="^back_courses$"),
-        CallbackQueryHandler(course_details_cb, pattern="^course_"),
-        # University hierarchy
-        CallbackQueryHandler(uni_year_cb, pattern="^uni_year_"),
-        CallbackQueryHandler(uni_sem_cb, pattern="^uni_sem_\\d+_\\d+$"),
-        CallbackQueryHandler(uni_detail_cb, pattern="^uni_detail_"),
-        CallbackQueryHandler(uni_toggle_cb, pattern="^uni_toggle_"),
-        CallbackQueryHandler(uni_cart_cb, pattern="^uni_cart$"),
-        CallbackQueryHandler(uni_clear_cb, pattern="^uni_clear$"),
-        CallbackQueryHandler(uni_pay_cb, pattern="^uni_pay_(sham|haram)$"),
-        CallbackQueryHandler(contact_admin_cb, pattern="^contact_admin$"),
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_student_contact_message, block=False),
     ]
 
 
+def add_routes(router: Router):
+    # offline: catalog browsing works from in-memory data while Mongo is unavailable
+    router.text([CATEGORY_PRO, CATEGORY_UNI], handle_category_text, offline=True)
+    router.text(["💬 تواصل مع المعلمة", "📋 حالة الدفع", "🏠 الرئيسية"], handle_category_text)
+    router.query("back_courses", back_courses_cb, exact=True, offline=True)
+    router.query("course_", course_details_cb, offline=True)
+    # University hierarchy
+    router.query("uni_year_", uni_year_cb, offline=True)
+    router.query("uni_sem_", uni_sem_cb, pattern=r"uni_sem_\d+_\d+", offline=True)
+    router.query(codec.route("s"), uni_sem_cb, offline=True)
+    router.query(codec.route("d"), uni_detail_cb, offline=True)
+    router.query(codec.route("t"), uni_toggle_cb, offline=True)
+    router.query(codec.route("c"), uni_cart_cb, offline=True)
+    router.query(codec.route("x"), uni_clear_cb, offline=True)
+    router.query(codec.route("p"), uni_pay_cb)
+    router.query("uni_", uni_expired_cb, offline=True)
+    router.query("contact_admin", contact_admin_cb, exact=True)
+    # Any other text; also hands broadcast/direct-message input over to the admin flow
+    router.fallback_text(handle_student_contact_message, block=False)
+
+
 async def contact_admin_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle contact admin button from course details"""
     q = update.callback_query
@@ -350,19 +445,11 @@ async def handle_student_contact_message(update: Update, context: ContextTypes.D
     
     # Check if student is waiting to send a contact message
     if context.user_data.get("awaiting_contact_message"):
-        admin_id = context.bot_data.get("ADMIN_ID")
-        student_name = update.effective_user.full_name or f"الطالب {update.effective_user.id}"
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"📧 رسالة من الطالب\n\n"
-                     f"👤 الاسم: {student_name}\n"
-                     f"🆔 المعرف: {update.effective_user.id}\n\n"
-                     f"💬 الرسالة:\n{update.message.text}",
-            )
-        except Exception as e:
-            await update.message.reply_text(f"❌ حدث خطأ: {str(e)}")
-            return
-        context.user_data.pop("awaiting_contact_message", None)
-        await update.message.reply_text("✅ تم إرسال رسالتك للمعلمة شهد طراف بنجاح!")
+        # Lines sent in quick succession reach the admin as one message
+        await contact.add(update, context)
         return
+
+    # This catch-all shadows the admin one registered after it, so hand over the
+    # remaining admin flows (broadcast text) explicitly
+    from .admin import capture_messages
+    await capture_messages(update, context)
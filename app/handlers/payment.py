@@ -1,57 +1,54 @@
-from typing import Optional
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, filters
-from datetime import datetime
+from typing import List, Optional
+from telegram import Update
+from telegram.ext import ContextTypes, MessageHandler, filters
 
-from ..models import User, CourseEnrollment, Notification
+from .. import analytics, breaker, digest, enrollments, journal, outbox, roles, seats
 from ..loaders import get_course_by_id
-
-
-async def _find_or_create_user(tg_user_id: int) -> User:
-    user = await User.find_one(User.telegram_id == tg_user_id)
-    if not user:
-        user = User(
-            telegram_id=tg_user_id,
-            full_name="",
-            phone="",
-            email="",
-        )
-        await user.save()
-    return user
+from ..router import Router
 
 
 async def _notify_admin(
     context: ContextTypes.DEFAULT_TYPE,
-    student: User,
-    course_id: str,
+    student_id: int,
+    student_name: str,
+    course_ids: List[str],
     method: str,
     receipt_file_id: Optional[str] = None,
 ):
-    admin_id = context.bot_data.get("ADMIN_ID")
-    course = get_course_by_id(course_id) or {"name": course_id}
-    if not admin_id:
+    """One message per receipt for every reviewer, or a digest line for the admin."""
+    reviewers = roles.reviewers(context.bot_data)
+    if not reviewers or not course_ids:
+        return
+    names = [(get_course_by_id(cid) or {"name": cid}).get("name") for cid in course_ids]
+    if await digest.defer("receipt", f"{student_name} ({student_id}): " + "، ".join(names), student_id):
         return
-    caption = (
-        f"طلب جديد لموافقة الدفع\n"
-        f"الطالب: {student.full_name or student.telegram_id}\n"
-        f"الدورة/المادة: {course.get('name')}\n"
-        f"الطريقة: {'Sham' if method=='sham' else 'HARAM'}"
-    )
-    kb = InlineKeyboardMarkup([
-        [
-            InlineKeyboardButton("موافقة", callback_data=f"admin_approve_{student.telegram_id}_{course_id}"),
-            InlineKeyboardButton("رفض", callback_data=f"admin_reject_{student.telegram_id}_{course_id}"),
-        ]
-    ])
     try:
-        if receipt_file_id:
-            await context.bot.send_photo(chat_id=admin_id, photo=receipt_file_id, caption=caption, reply_markup=kb)
-        else:
-            await context.bot.send_message(chat_id=admin_id, text=caption, reply_markup=kb)
+        await outbox.enqueue([
+            enrollments.receipt_notice(r, student_id, student_name, course_ids, method, receipt_file_id) for r in reviewers
+        ])
     except Exception:
         pass
 
 
+async def seats_note(course_ids) -> str:
+    """Warn the student before paying when a cohort is already full."""
+    full = []
+    if not breaker.MONGO.available():
+        return ""
+    for cid in course_ids:
+        try:
+            if await seats.available(cid) == 0:
+                full.append((get_course_by_id(cid) or {"name": cid}).get("name"))
+        except Exception:
+            continue
+    if not full:
+        return ""
+    return (
+        "\n\n🕒 المقاعد ممتلئة حالياً في: " + "، ".join(full)
+        + "\nسيتم وضعك في قائمة الانتظار بعد إرسال الإيصال."
+    )
+
+
 async def pay_method_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -65,6 +62,7 @@ async def pay_method_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("لم يتم العثور على الدورة.")
         return
 
+    analytics.track("pay", q.from_user.id, course_id)
     context.user_data["payment_course_id"] = course_id
     context.user_data["payment_method"] = method
 
@@ -78,6 +76,7 @@ async def pay_method_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"أرسل الآن صورة إثبات الدفع (screenshot/صورة للوصل).\n"
         f"رقم التحويل: {target_num}"
     )
+    text += await seats_note([course_id])
     await q.edit_message_text(text)
 
 
@@ -92,64 +91,32 @@ async def receive_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     file_id = update.message.photo[-1].file_id
-    student = await _find_or_create_user(update.effective_user.id)
-
+    course_ids = list(mat_ids) if mat_ids else [course_id]
+    for cid in course_ids:
+        analytics.track("receipt", update.effective_user.id, cid)
+    # Without a digest, the reviewers' requests are written together with the enrollments
+    reviewers = roles.reviewers(context.bot_data)
+    in_outbox = bool(reviewers) and not digest.buffers("receipt")
     # Two flows: single course or multiple materials from university cart
-    # mat_ids was already fetched above
-    if mat_ids:
-        for mid in mat_ids:
-            updated = False
-            for e in student.courses:
-                if e.course_id == mid:
-                    e.payment_method = method
-                    e.payment_receipt = file_id
-                    e.approval_status = "pending"
-                    updated = True
-                    break
-            if not updated:
-                student.courses.append(
-                    CourseEnrollment(
-                        course_id=mid,
-                        payment_method=method,
-                        payment_receipt=file_id,
-                        approval_status="pending",
-                    )
-                )
-    else:
-        # single course/material
-        updated = False
-        for e in student.courses:
-            if e.course_id == course_id:
-                e.payment_method = method
-                e.payment_receipt = file_id
-                e.approval_status = "pending"
-                updated = True
-                break
-        if not updated:
-            student.courses.append(
-                CourseEnrollment(
-                    course_id=course_id,
-                    payment_method=method,
-                    payment_receipt=file_id,
-                    approval_status="pending",
-                )
-            )
-    student.notifications.append(
-        Notification(
-            student_id=student.telegram_id,
-            type="payment_submitted",
-            message=f"تم إرسال إثبات الدفع",
-        )
+    result = await journal.run(
+        "submit_receipt",
+        telegram_id=update.effective_user.id,
+        course_ids=course_ids,
+        method=method,
+        file_id=file_id,
+        notify_admin=reviewers if in_outbox else None,
     )
-    student.last_active = datetime.utcnow()
-    await student.save()
-
-    # notify admin per item without sending the photo
-    if mat_ids:
-        for mid in mat_ids:
-            await _notify_admin(context, student, mid, method, file_id)
-    else:
-        await _notify_admin(context, student, course_id, method, file_id)
+    student_name, waitlisted = ("", []) if result is journal.JOURNALED else result
+    if not student_name:
+        # Database is down or the student has no profile yet: use the Telegram name
+        student_name = update.effective_user.full_name or str(update.effective_user.id)
+    student_id = update.effective_user.id
+
+    # One admin message for the whole receipt; waitlisted items are sent once a seat frees up
+    if not in_outbox:
+        await _notify_admin(
+            context, student_id, student_name, [cid for cid in course_ids if cid not in waitlisted], method, file_id
+        )
 
     # Confirmation message to student
     await update.message.reply_text(
@@ -157,6 +124,13 @@ async def receive_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "سيتم مراجعة طلبك من قبل المعلمة شهد طراف.\n"
         "سيتم إشعارك بحالة الموافقة قريباً."
     )
+    if waitlisted:
+        names = [(get_course_by_id(cid) or {"name": cid}).get("name") for cid in waitlisted]
+        await update.message.reply_text(
+            "🕒 المقاعد ممتلئة حالياً في:\n"
+            + "\n".join(f"• {n}" for n in names)
+            + "\n\nتمت إضافتك إلى قائمة الانتظار وسيتم إشعارك فور توفر مقعد."
+        )
     # clear state
     context.user_data.pop("payment_course_id", None)
     context.user_data.pop("payment_material_ids", None)
@@ -166,6 +140,11 @@ async def receive_receipt(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def get_handlers():
     return [
-        CallbackQueryHandler(pay_method_cb, pattern="^pay_(sham|haram)_"),
         MessageHandler(filters.PHOTO, receive_receipt),
     ]
+
+
+def add_routes(router: Router):
+    # offline: only sets up the receipt, which is journaled while Mongo is unavailable
+    router.query("pay_sham_", pay_method_cb, offline=True)
+    router.query("pay_haram_", pay_method_cb, offline=True)
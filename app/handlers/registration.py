@@ -1,17 +1,27 @@
 from telegram import Update, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
+from typing import Optional
+
+from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, TypeHandler, filters
 from beanie import PydanticObjectId
 from datetime import datetime
-from ..models import User
+from pymongo.errors import PyMongoError
+from .. import digest, journal, roles
+from ..users import find_user_cached
 from ..keyboards import categories_keyboard, main_menu_keyboard, admin_menu_keyboard
 
 ASKING_NAME, ASKING_PHONE, ASKING_EMAIL, ASKING_YEAR, ASKING_SPECIALIZATION = range(5)
+# Answers collected in user_data while the form is being filled
+FORM_KEYS = ("full_name", "phone", "email", "study_year")
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    admin_id = context.bot_data.get("ADMIN_ID")
-    if admin_id and user.id == admin_id:
+    if roles.is_admin(context.bot_data, user.id):
+        # Deep links from the admin digest
+        if context.args:
+            from .admin import open_deep_link
+            if await open_deep_link(update, context, context.args[0]):
+                return ConversationHandler.END
         await update.message.reply_text(
             "🔑 **مرحباً أستاذة شهد!**\n\n"
             "🎯 **لوحة التحكم الإدارية**\n"
@@ -19,10 +29,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=admin_menu_keyboard(),
         )
         return ConversationHandler.END
-    existing = await User.find_one(User.telegram_id == user.id)
+    existing = await find_user_cached(user.id)
     if existing and existing.phone and existing.email:
         existing.last_active = datetime.utcnow()
-        await existing.save()
+        try:
+            await existing.save()
+        except PyMongoError:
+            # last_active is best effort; keep answering from the cached profile
+            pass
         await update.message.reply_text(
             f"👋 **مرحباً {existing.full_name}!**\n\n"
             "🎓 **منصة التعليم الإلكترونية**\n\n"
@@ -129,28 +143,23 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
     email = context.user_data.get("email")
     study_year = context.user_data.get("study_year")
     tg_user = update.effective_user
-    user_doc = await User.find_one(User.telegram_id == tg_user.id)
-    is_new = user_doc is None
-    if not user_doc:
-        user_doc = User(
-            telegram_id=tg_user.id,
-            full_name=full_name,
-            phone=phone,
-            email=email,
-            study_year=study_year,
-            specialization=specialization,
-        )
-    else:
-        user_doc.full_name = full_name
-        user_doc.phone = phone
-        user_doc.email = email
-        user_doc.study_year = study_year
-        user_doc.specialization = specialization
-        user_doc.last_active = datetime.utcnow()
-    await user_doc.save()
+    is_new = await journal.run(
+        "save_profile",
+        telegram_id=tg_user.id,
+        full_name=full_name,
+        phone=phone,
+        email=email,
+        study_year=study_year,
+        specialization=specialization,
+    )
+    if is_new is journal.JOURNALED:
+        # Can't tell while the database is down; let the admin know anyway
+        is_new = True
 
     admin_id = context.bot_data.get("ADMIN_ID")
-    if is_new and admin_id:
+    if is_new and admin_id and not await digest.defer(
+        "registration", f"{full_name} ({tg_user.id}) • {specialization or '-'} • {phone}", tg_user.id
+    ):
         try:
             await context.bot.send_message(
                 chat_id=admin_id,
@@ -174,15 +183,27 @@ async def finish_registration(update: Update, context: ContextTypes.DEFAULT_TYPE
         "اختر من القائمة أدناه لبدء رحلتك التعليمية:", 
         reply_markup=main_menu_keyboard()
     )
+    _clear_form(context)
     return ConversationHandler.END
 
 
+def _clear_form(context: ContextTypes.DEFAULT_TYPE):
+    for key in FORM_KEYS:
+        context.user_data.pop(key, None)
+
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _clear_form(context)
     await update.message.reply_text("تم الإلغاء.")
     return ConversationHandler.END
 
 
-def get_handler() -> ConversationHandler:
+async def timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Abandoned half way; the student starts over with /start
+    _clear_form(context)
+
+
+def get_handler(conversation_timeout: Optional[float] = None) -> ConversationHandler:
     return ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
@@ -191,8 +212,10 @@ def get_handler() -> ConversationHandler:
             ASKING_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_study_year)],
             ASKING_YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_specialization)],
             ASKING_SPECIALIZATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, finish_registration)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, timeout)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         name="registration_conversation",
-        persistent=False,
+        persistent=True,
+        conversation_timeout=conversation_timeout,
     )
@@ -0,0 +1,113 @@
+"""Pool of single-use group invite links.
+
+A background job keeps ``_pool_size`` unused ``member_limit=1`` links per course group in Mongo,
+so approving a student only pops one instead of calling the Bot API. Groups need their chat id
+in the ``chats`` section of group_links.json (the bot must be an admin there); without it, or
+when the pool is empty, the static link is used as before. In fake mode links are made up
+locally, which lets the whole flow run without a real group.
+"""
+import logging
+import secrets
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+
+from . import breaker, tenants
+from .loaders import get_group_chat, get_group_ids, get_group_link
+from .models import User
+
+INVITES_COLLECTION = "invite_links"
+
+logger = logging.getLogger(__name__)
+
+_pool_size = 0
+_fake = False
+_indexed: Set[str] = set()
+
+
+def configure(pool_size: int, fake: bool = False):
+    global _pool_size, _fake
+    _pool_size = pool_size
+    _fake = fake
+
+
+def _links():
+    return User.get_motor_collection().database[INVITES_COLLECTION]
+
+
+def _pooled_groups() -> List[Tuple[str, int]]:
+    groups = []
+    for cid in get_group_ids():
+        chat_id = get_group_chat(cid)
+        if chat_id or _fake:
+            groups.append((cid, chat_id or 0))
+    return groups
+
+
+async def _create(bot: Bot, chat_id: int, course_id: str) -> str:
+    if _fake:
+        return f"https://t.me/+fake{secrets.token_urlsafe(12)}"
+    invite = await bot.create_chat_invite_link(chat_id=chat_id, member_limit=1, name=course_id[:32])
+    return invite.invite_link
+
+
+async def issue(telegram_id: int, course_id: str) -> Optional[str]:
+    """The student's personal link to the course group, falling back to the static one.
+
+    Calling it again for the same student returns the link they already got.
+    """
+    if _pool_size > 0 and breaker.MONGO.available():
+        try:
+            coll = _links()
+            doc = await coll.find_one({"course_id": course_id, "issued_to": telegram_id})
+            if not doc:
+                doc = await coll.find_one_and_update(
+                    {"course_id": course_id, "issued_to": None},
+                    {"$set": {"issued_to": telegram_id, "issued_at": datetime.utcnow()}},
+                    sort=[("created_at", 1)],
+                    return_document=ReturnDocument.AFTER,
+                )
+            if doc:
+                return doc["link"]
+            logger.info("invite pool for %s is empty, using the static link", course_id)
+        except PyMongoError as e:
+            logger.warning("invite pool unavailable: %r", e)
+    return get_group_link(course_id)
+
+
+async def issue_many(items: Iterable[Tuple[int, str]]) -> Dict[Tuple[int, str], Optional[str]]:
+    return {(tid, cid): await issue(tid, cid) for tid, cid in items}
+
+
+async def refill(bot: Bot) -> int:
+    """Top every pooled group back up to the pool size. Returns the number of links created."""
+    if _pool_size <= 0:
+        return 0
+    coll = _links()
+    if tenants.current() not in _indexed:
+        await coll.create_index([("course_id", 1), ("issued_to", 1)])
+        _indexed.add(tenants.current())
+    created = 0
+    for cid, chat_id in _pooled_groups():
+        missing = _pool_size - await coll.count_documents({"course_id": cid, "issued_to": None})
+        for _ in range(missing):
+            try:
+                link = await _create(bot, chat_id, cid)
+            except TelegramError as e:
+                logger.warning("could not create an invite link for %s: %r", cid, e)
+                break
+            await coll.insert_one({"course_id": cid, "link": link, "issued_to": None, "created_at": datetime.utcnow()})
+            created += 1
+    return created
+
+
+async def refill_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await refill(context.bot)
+    except PyMongoError as e:
+        logger.warning("invite pool refill failed: %r", e)
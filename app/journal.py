@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from pymongo.errors import PyMongoError
+from telegram.ext import ContextTypes
+
+from . import breaker, enrollments, tenants
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+JOURNALED = object()
+APPLIED_COLLECTION = "journal_applied"
+
+# An entry can run twice: a write that commits but misses its deadline is journaled and replayed.
+# Each op takes the entry id as ``op_id`` and uses it to skip notifications it already added.
+OPS: Dict[str, Callable[..., Awaitable[Any]]] = {
+    "submit_receipt": enrollments.submit_receipt,
+    "save_profile": enrollments.save_profile,
+    "set_status": enrollments.set_status,
+    "approve": enrollments.approve,
+}
+
+_path = Path("journal/pending.ndjson")
+_write_timeout = 5.0
+_replay_lock = asyncio.Lock()
+# Appends run in a worker thread; replay rewrites the file only while holding this
+_file_lock = asyncio.Lock()
+
+
+def configure(path: str, write_timeout: float):
+    global _path, _write_timeout
+    _path = Path(path)
+    _write_timeout = write_timeout
+
+
+def _file() -> Path:
+    # Entries replay into the current tenant's database, so each tenant has its own file
+    return tenants.path(_path)
+
+
+def _append(path: Path, entry: Dict[str, Any]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read() -> List[Dict[str, Any]]:
+    path = _file()
+    if not path.exists():
+        return []
+    with path.open("r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def has_pending() -> bool:
+    path = _file()
+    return path.exists() and path.stat().st_size > 0
+
+
+async def run(op: str, **kwargs) -> Any:
+    """Apply ``op`` now, or journal it when Mongo is unavailable.
+
+    Returns the op's result, or ``JOURNALED`` if the write was deferred.
+    """
+    entry = {"id": uuid.uuid4().hex, "op": op, "args": kwargs, "at": datetime.utcnow().isoformat()}
+    # Keep per-student ordering: catch up on queued entries first and, if any are still left,
+    # queue behind them. Replay stops at once while Mongo's breaker is open.
+    if has_pending():
+        await replay()
+    if not has_pending():
+        try:
+            # Fails at once while Mongo's breaker is open, so the write goes straight to the journal
+            return await breaker.MONGO.call(lambda: OPS[op](**kwargs, op_id=entry["id"]), timeout=_write_timeout)
+        except (PyMongoError, asyncio.TimeoutError) as e:
+            logger.warning("journaling %s after database error: %r", op, e)
+    async with _file_lock:
+        # fsync blocks for as long as the disk takes; keep it off the event loop
+        await asyncio.to_thread(_append, _file(), entry)
+    return JOURNALED
+
+
+async def _apply(entry: Dict[str, Any], applied_coll):
+    if not await applied_coll.find_one({"_id": entry["id"]}, {"_id": 1}):
+        await OPS[entry["op"]](**entry["args"], op_id=entry["id"])
+        await applied_coll.insert_one({"_id": entry["id"], "op": entry["op"], "at": datetime.utcnow()})
+
+
+async def replay() -> int:
+    """Apply journaled entries in order until the first database failure."""
+    async with _replay_lock:
+        entries = _read()
+        if not entries:
+            return 0
+        applied_coll = User.get_motor_collection().database[APPLIED_COLLECTION]
+        done = 0
+        for entry in entries:
+            try:
+                await breaker.MONGO.call(lambda: _apply(entry, applied_coll), timeout=_write_timeout)
+            except PyMongoError as e:
+                logger.warning("journal replay paused: %r", e)
+                break
+            except Exception:
+                # A poisoned entry must not block the queue forever.
+                logger.exception("dropping journal entry %s", entry["id"])
+            done += 1
+        # Entries appended during replay are kept intact: appends wait for the lock.
+        async with _file_lock:
+            remaining = _read()[done:]
+            path = _file()
+            tmp = path.with_suffix(".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                for entry in remaining:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            tmp.replace(path)
+        if done:
+            logger.info("replayed %s journal entries, %s left", done, len(remaining))
+        return done
+
+
+async def replay_job(context: ContextTypes.DEFAULT_TYPE):
+    if has_pending():
+        await replay()
@@ -1,11 +1,16 @@
 import json
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+from . import tenants
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
-COURSES_FILE = DATA_DIR / "courses.json"
-GROUP_LINKS_FILE = DATA_DIR / "group_links.json"
+COURSES_FILE = "courses.json"
+GROUP_LINKS_FILE = "group_links.json"
+
+# Parsed files shared by every tenant that uses them, refreshed when the file changes
+_json_cache: Dict[Path, Tuple[float, Any]] = {}
 
 try:
     # Primary source provided by user
@@ -14,11 +19,24 @@ except Exception:
     CATALOG_COURSES, CATALOG_MATERIALS = {}, {}
 
 
-def _read_json(path: Path) -> Any:
-    if not path.exists():
+def _data_file(name: str) -> Path:
+    # Each tenant may keep its own group links (and a courses.json, used only without a catalog)
+    return (tenants.data_dir() or DATA_DIR) / name
+
+
+def _read_json(name: str) -> Any:
+    path = _data_file(name)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
         return {}
+    cached = _json_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
     with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+        data = json.load(f)
+    _json_cache[path] = (mtime, data)
+    return data
 
 
 def _course_from_catalog(cid: str) -> Optional[Dict[str, Any]]:
@@ -182,3 +200,21 @@ def get_group_link(course_id: str) -> Optional[str]:
         if isinstance(sec, dict) and course_id in sec:
             return sec.get(course_id)
     return None
+
+
+def get_group_chat(course_id: str) -> Optional[int]:
+    """Chat id of a course group, from the optional ``chats`` section of group_links.json."""
+    chats = (_read_json(GROUP_LINKS_FILE) or {}).get("chats") or {}
+    chat_id = chats.get(course_id)
+    return int(chat_id) if chat_id else None
+
+
+def get_group_ids() -> List[str]:
+    """Every course and material id that has a group link."""
+    links = _read_json(GROUP_LINKS_FILE) or {}
+    ids: List[str] = []
+    for section in ("courses", "materials"):
+        sec = links.get(section)
+        if isinstance(sec, dict):
+            ids.extend(sec.keys())
+    return ids
@@ -1,15 +1,31 @@
 from typing import List, Optional, Literal
 from datetime import datetime
-from beanie import Document
+from beanie import Document, Insert, Replace, Save, SaveChanges, Update, before_event
 from pydantic import BaseModel, Field
+from pymongo import ASCENDING, IndexModel
+
+from . import tenants
+
+
+class TenantScoped:
+    """Resolves the collection in the current tenant's database on every query."""
+
+    @classmethod
+    def get_motor_collection(cls):
+        return tenants.collection(super().get_motor_collection())
 
 
 class CourseEnrollment(BaseModel):
     course_id: str
-    approval_status: Literal["pending", "approved", "rejected"] = "pending"
+    approval_status: Literal["pending", "approved", "rejected", "waitlisted"] = "pending"
     payment_method: Literal["sham", "haram"]
     payment_receipt: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Reviewer working on it while pending (see app.claims)
+    claimed_by: Optional[int] = None
+    claimed_until: Optional[datetime] = None
+    # Set by the bulk decision that last changed it, to tell which of its updates matched
+    decision_id: Optional[str] = None
 
 
 class Notification(BaseModel):
@@ -17,9 +33,11 @@ class Notification(BaseModel):
     type: str
     message: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    # Journal entry that wrote it, so a replay of an applied write doesn't add it again
+    op_id: Optional[str] = None
 
 
-class User(Document):
+class User(TenantScoped, Document):
     telegram_id: int
     full_name: str
     phone: str
@@ -30,6 +48,80 @@ class User(Document):
     last_active: datetime = Field(default_factory=datetime.utcnow)
     courses: List[CourseEnrollment] = Field(default_factory=list)
     notifications: List[Notification] = Field(default_factory=list)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    @before_event(Insert, Replace, Save, SaveChanges, Update)
+    def touch(self):
+        self.updated_at = datetime.utcnow()
 
     class Settings:
         name = "users"
+        indexes = [
+            IndexModel([("telegram_id", ASCENDING)]),
+            IndexModel([("last_active", ASCENDING)]),
+            IndexModel([("updated_at", ASCENDING)]),
+        ]
+
+
+class WaitlistEntry(BaseModel):
+    telegram_id: int
+    at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class CourseSeats(TenantScoped, Document):
+    course_id: str
+    capacity: int
+    taken: int = 0
+    holders: List[int] = Field(default_factory=list)
+    waitlist: List[WaitlistEntry] = Field(default_factory=list)
+
+    class Settings:
+        name = "course_seats"
+        indexes = [
+            IndexModel([("course_id", ASCENDING)], unique=True),
+        ]
+
+
+class BroadcastJob(TenantScoped, Document):
+    text: str
+    status: Literal["queued", "running", "done", "failed"] = "queued"
+    source: str = "bot"
+    last_telegram_id: int = 0
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    # Runs since the last checkpoint; a job that keeps dying without progress is given up
+    attempts: int = 0
+    error: Optional[str] = None
+    progress_chat_id: Optional[int] = None
+    progress_message_id: Optional[int] = None
+    lease_until: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    class Settings:
+        name = "broadcast_jobs"
+        indexes = [
+            IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)]),
+        ]
+
+
+class Reminder(TenantScoped, Document):
+    kind: Literal["installment", "stale_pending"]
+    telegram_id: int
+    course_id: str
+    seq: int = 1
+    due_at: datetime
+    status: Literal["scheduled", "sent", "cancelled"] = "scheduled"
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+    class Settings:
+        name = "reminders"
+        indexes = [
+            IndexModel([("status", ASCENDING), ("due_at", ASCENDING)]),
+            IndexModel(
+                [("kind", ASCENDING), ("telegram_id", ASCENDING), ("course_id", ASCENDING), ("seq", ASCENDING)],
+                unique=True,
+            ),
+        ]
@@ -0,0 +1,162 @@
+"""Telegram notifications written to Mongo together with the change that caused them.
+
+Handlers put the messages they owe into the ``outbox`` collection inside the same transaction as
+their state change (when the deployment supports transactions, e.g. Atlas or any replica set;
+on a standalone server the two writes simply follow each other). A background dispatcher
+delivers them with retries, so a slow Telegram never holds up a handler and a crash after the
+write doesn't lose the notification.
+"""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import ContextTypes
+
+from . import tenants
+from .db import get_client
+from .models import User
+from .ratelimit import NORMAL
+
+OUTBOX_COLLECTION = "outbox"
+BATCH = 50
+LEASE = timedelta(minutes=2)
+MAX_ATTEMPTS = 8
+# How long a delivered keyed item is kept, so enqueueing it again can't send it twice
+KEEP_SENT = timedelta(days=7)
+
+logger = logging.getLogger(__name__)
+
+_indexed: Set[str] = set()
+
+
+def _items():
+    return User.get_motor_collection().database[OUTBOX_COLLECTION]
+
+
+def message(
+    chat_id: int,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    photo: Optional[str] = None,
+    priority: int = NORMAL,
+) -> Dict[str, Any]:
+    """A message to deliver; plain data, so it can also travel through the journal."""
+    return {
+        "chat_id": chat_id,
+        "text": text,
+        "photo": photo,
+        "reply_markup": reply_markup.to_dict() if reply_markup else None,
+        "priority": priority,
+    }
+
+
+def _supports_transactions() -> bool:
+    client = get_client()
+    if client is None:
+        return False
+    return client.topology_description.topology_type_name in ("ReplicaSetWithPrimary", "Sharded", "LoadBalanced")
+
+
+@asynccontextmanager
+async def transaction() -> AsyncIterator[Any]:
+    """Session to pass to the state change and to :func:`enqueue`; None without transactions."""
+    if not _supports_transactions():
+        yield None
+        return
+    async with await get_client().start_session() as session:
+        async with session.start_transaction():
+            yield session
+
+
+async def enqueue(messages: Iterable[Dict[str, Any]], session: Any = None, key: Optional[str] = None):
+    """Queue ``messages``. With ``key`` (e.g. a journal entry id) queueing them again is a no-op."""
+    now = datetime.utcnow()
+    docs = [dict(m, status="pending", attempts=0, due_at=now, created_at=now) for m in messages]
+    if not docs:
+        return
+    if not key:
+        await _items().insert_many(docs, session=session)
+        return
+    ops = []
+    for i, doc in enumerate(docs):
+        doc["key"] = f"{key}:{i}"
+        ops.append(UpdateOne({"key": doc["key"]}, {"$setOnInsert": doc}, upsert=True))
+    await _items().bulk_write(ops, ordered=False, session=session)
+
+
+async def _claim(now: datetime) -> Optional[Dict[str, Any]]:
+    # Includes items whose dispatcher died mid-send
+    return await _items().find_one_and_update(
+        {"$or": [
+            {"status": "pending", "due_at": {"$lte": now}},
+            {"status": "sending", "lease_until": {"$lt": now}},
+        ]},
+        {"$set": {"status": "sending", "lease_until": now + LEASE}},
+        sort=[("due_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _deliver(bot: Bot, item: Dict[str, Any]):
+    coll = _items()
+    markup = InlineKeyboardMarkup.de_json(item["reply_markup"], bot) if item.get("reply_markup") else None
+    limits = {"priority": item.get("priority", NORMAL)}
+    try:
+        if item.get("photo"):
+            await bot.send_photo(
+                chat_id=item["chat_id"], photo=item["photo"], caption=item["text"], reply_markup=markup, rate_limit_args=limits
+            )
+        else:
+            await bot.send_message(chat_id=item["chat_id"], text=item["text"], reply_markup=markup, rate_limit_args=limits)
+    except (Forbidden, BadRequest) as e:
+        # Blocked bot, deleted chat, bad markup: retrying won't help
+        logger.info("outbox item %s undeliverable: %r", item["_id"], e)
+        await coll.update_one({"_id": item["_id"]}, {"$set": {"status": "failed", "error": str(e)}})
+        return
+    except TelegramError as e:
+        attempts = item.get("attempts", 0) + 1
+        update: Dict[str, Any] = {"attempts": attempts, "error": str(e)}
+        if attempts >= MAX_ATTEMPTS:
+            update["status"] = "failed"
+        else:
+            update["status"] = "pending"
+            update["due_at"] = datetime.utcnow() + timedelta(seconds=min(5 * 2 ** attempts, 600))
+        await coll.update_one({"_id": item["_id"]}, {"$set": update})
+        return
+    if item.get("key"):
+        # Left behind as a marker for enqueue; the TTL index removes it later
+        await coll.update_one({"_id": item["_id"]}, {"$set": {"status": "sent", "sent_at": datetime.utcnow()}})
+        return
+    await coll.delete_one({"_id": item["_id"]})
+
+
+async def dispatch(bot: Bot) -> int:
+    """Deliver up to one batch of due items. Returns how many were picked up."""
+    if tenants.current() not in _indexed:
+        await _items().create_index([("status", 1), ("due_at", 1)])
+        await _items().create_index("key", unique=True, partialFilterExpression={"key": {"$exists": True}})
+        await _items().create_index("sent_at", expireAfterSeconds=int(KEEP_SENT.total_seconds()))
+        _indexed.add(tenants.current())
+    now = datetime.utcnow()
+    claimed = []
+    for _ in range(BATCH):
+        item = await _claim(now)
+        if not item:
+            break
+        claimed.append(item)
+    # Pacing is left to the shared rate limiter
+    await asyncio.gather(*(_deliver(bot, item) for item in claimed))
+    return len(claimed)
+
+
+async def dispatch_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await dispatch(context.bot)
+    except PyMongoError as e:
+        logger.warning("outbox dispatch failed: %r", e)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import time
+from copy import deepcopy
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import bson
+from bson.errors import InvalidDocument
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import PyMongoError
+from telegram.ext import Application, BasePersistence, ContextTypes, PersistenceInput
+
+from . import breaker
+from .db import get_client, init_db
+
+USER_DATA_COLLECTION = "bot_user_data"
+CONVERSATIONS_COLLECTION = "bot_conversations"
+# One-shot input modes; a user who went idle in one of them starts fresh when they come back
+TRANSIENT_PREFIXES = ("awaiting_",)
+
+ConversationKey = Tuple[int, ...]
+ConversationDict = Dict[ConversationKey, object]
+
+logger = logging.getLogger(__name__)
+
+# Marks a pending delete in the write-behind buffers
+_DROP = object()
+
+
+def _conv_id(name: str, key: ConversationKey) -> str:
+    return f"{name}:{json.dumps(list(key))}"
+
+
+class MongoPersistence(BasePersistence[Dict[str, Any], Dict[str, Any], Dict[str, Any]]):
+    """Stores ``user_data`` and conversation states in Mongo.
+
+    Nothing per-user is loaded at boot: a user's data is fetched the first time one of their
+    updates reaches a handler. Writes are skipped when the data didn't change since it was last
+    stored, and everything PTB hands over in one persistence run goes out in a single bulk write
+    per collection. ``bot_data``/``chat_data`` are rebuilt by post_init and not stored.
+    """
+
+    def __init__(self, mongo_url: str, db_name: str, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._mongo_url = mongo_url
+        self._db_name = db_name
+        # Last state known to be in Mongo, used to skip no-op writes
+        self._saved_users: Dict[int, Dict[str, Any]] = {}
+        self._saved_convs: Dict[Tuple[str, ConversationKey], Any] = {}
+        self._pending_users: Dict[int, Any] = {}
+        self._pending_convs: Dict[Tuple[str, ConversationKey], Any] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # user_id -> monotonic time of their last update that reached a handler
+        self._last_seen: Dict[int, float] = {}
+        # Users whose stored data couldn't be read; their in-memory data isn't written over it
+        self._unloaded: set = set()
+
+    async def _db(self):
+        if get_client() is None:
+            # get_conversations runs in Application.initialize, before post_init connects
+            await init_db(self._mongo_url, self._db_name)
+        return get_client()[self._db_name]
+
+    # --- loading ---
+
+    async def get_user_data(self) -> Dict[int, Dict[str, Any]]:
+        # Loaded lazily in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        self._last_seen[user_id] = time.monotonic()
+        if user_id in self._saved_users or user_id in self._pending_users:
+            return
+        try:
+            doc = await breaker.MONGO.call(lambda: self._load_user(user_id))
+        except PyMongoError as e:
+            # Handle the update from memory; the stored data is merged in on a later update
+            logger.warning("could not load user_data of %s: %r", user_id, e)
+            self._unloaded.add(user_id)
+            return
+        self._unloaded.discard(user_id)
+        data = doc.get("data", {}) if doc else {}
+        # Don't clobber anything a handler already wrote before the first load finished
+        for k, v in data.items():
+            user_data.setdefault(k, v)
+        self._saved_users[user_id] = deepcopy(data)
+
+    async def _load_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        db = await self._db()
+        return await db[USER_DATA_COLLECTION].find_one({"_id": user_id})
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        db = await self._db()
+        conversations: ConversationDict = {}
+        async for doc in db[CONVERSATIONS_COLLECTION].find({"name": name}):
+            key = tuple(doc["key"])
+            conversations[key] = doc["state"]
+            self._saved_convs[(name, key)] = doc["state"]
+        return conversations
+
+    async def get_chat_data(self) -> Dict[int, Dict[str, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[str, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[str, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[str, Any]) -> None:
+        pass
+
+    # --- writing ---
+
+    async def update_user_data(self, user_id: int, data: Dict[str, Any]) -> None:
+        if self._saved_users.get(user_id) == data and user_id not in self._pending_users:
+            return
+        if user_id in self._unloaded:
+            return
+        try:
+            bson.encode({"data": data})
+        except (InvalidDocument, TypeError) as e:
+            logger.warning("user_data of %s is not storable, skipping: %r", user_id, e)
+            return
+        self._pending_users[user_id] = data
+        await self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = _DROP
+        await self._schedule_write()
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        ck = (name, key)
+        if ck not in self._pending_convs and self._saved_convs.get(ck) == new_state:
+            return
+        self._pending_convs[ck] = _DROP if new_state is None else new_state
+        await self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: Dict[str, Any]) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[str, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def _schedule_write(self):
+        # PTB runs all updates of a persistence run concurrently; they all join one write task
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+        await asyncio.shield(self._flush_task)
+
+    async def _write_pending(self):
+        # Let the other coroutines of this run enqueue before writing
+        await asyncio.sleep(0)
+        while self._pending_users or self._pending_convs:
+            users, self._pending_users = self._pending_users, {}
+            convs, self._pending_convs = self._pending_convs, {}
+            try:
+                await self._write(users, convs)
+            except Exception:
+                # Keep the batch for the next run, without overriding anything newer
+                for k, v in users.items():
+                    self._pending_users.setdefault(k, v)
+                for k, v in convs.items():
+                    self._pending_convs.setdefault(k, v)
+                raise
+
+    async def _write(self, users: Dict[int, Any], convs: Dict[Tuple[str, ConversationKey], Any]):
+        db = await self._db()
+        now = datetime.utcnow()
+        if users:
+            ops = [
+                DeleteOne({"_id": uid}) if data is _DROP
+                else ReplaceOne({"_id": uid}, {"data": data, "updated_at": now}, upsert=True)
+                for uid, data in users.items()
+            ]
+            await db[USER_DATA_COLLECTION].bulk_write(ops, ordered=False)
+            for uid, data in users.items():
+                if data is _DROP:
+                    self._saved_users.pop(uid, None)
+                else:
+                    self._saved_users[uid] = data
+        if convs:
+            ops = [
+                DeleteOne({"_id": _conv_id(name, key)}) if state is _DROP
+                else ReplaceOne(
+                    {"_id": _conv_id(name, key)},
+                    {"name": name, "key": list(key), "state": state, "updated_at": now},
+                    upsert=True,
+                )
+                for (name, key), state in convs.items()
+            ]
+            await db[CONVERSATIONS_COLLECTION].bulk_write(ops, ordered=False)
+            for ck, state in convs.items():
+                if state is _DROP:
+                    self._saved_convs.pop(ck, None)
+                else:
+                    self._saved_convs[ck] = state
+
+    async def evict_idle(
+        self, application: Application, idle_seconds: float, transient_prefixes: Iterable[str] = TRANSIENT_PREFIXES
+    ) -> int:
+        """Unload users idle for ``idle_seconds`` from memory. Returns how many were unloaded.
+
+        Their data is written first (minus transient keys) and loaded again by
+        refresh_user_data on their next update, so memory follows active users only.
+        """
+        prefixes = tuple(transient_prefixes)
+        now = time.monotonic()
+        idle = [uid for uid, seen in self._last_seen.items() if now - seen >= idle_seconds]
+        if not idle:
+            return 0
+        for uid in idle:
+            data = application.user_data.get(uid)
+            if data is None:
+                continue
+            for key in [k for k in data if isinstance(k, str) and k.startswith(prefixes)]:
+                del data[key]
+            await self.update_user_data(uid, deepcopy(data))
+        await self.flush()
+        evicted = 0
+        now = time.monotonic()
+        for uid in idle:
+            # Skip anyone who came back while we were writing, or whose write didn't go through
+            if now - self._last_seen.get(uid, now) < idle_seconds or uid in self._pending_users:
+                continue
+            if uid in self._unloaded:
+                continue
+            # PTB has no public way to unload without also deleting from persistence
+            application._user_data.pop(uid, None)
+            application._chat_data.pop(uid, None)
+            self._saved_users.pop(uid, None)
+            del self._last_seen[uid]
+            evicted += 1
+        return evicted
+
+    async def flush(self) -> None:
+        if self._pending_users or self._pending_convs:
+            await self._schedule_write()
+        elif self._flush_task and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+
+
+async def evict_job(context: ContextTypes.DEFAULT_TYPE):
+    persistence = context.application.persistence
+    if not isinstance(persistence, MongoPersistence):
+        return
+    try:
+        evicted = await persistence.evict_idle(context.application, context.job.data["idle_seconds"])
+    except Exception as e:
+        logger.warning("user_data eviction failed: %r", e)
+        return
+    if evicted:
+        logger.info("unloaded %s idle users", evicted)
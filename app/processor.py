@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from . import tenants
+
+
+def _ordering_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates of different users concurrently while keeping each user's updates in order.
+
+    PTB takes its own semaphore before calling :meth:`do_process_update`, so it is sized as the
+    queue bound here; the real concurrency limit is applied only once an update holds its user's
+    lock, so a user waiting on their own earlier update never occupies a worker slot. Updates
+    run with ``tenant_id`` as the current tenant.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_queued_updates: Optional[int] = None, tenant_id: str = ""):
+        super().__init__(max_queued_updates or max_concurrent_updates * 16)
+        self._tenant_id = tenant_id
+        self._workers = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        with tenants.use(self._tenant_id):
+            await self._process(update, coroutine)
+
+    async def _process(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = _ordering_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            # asyncio.Lock wakes waiters FIFO, which preserves arrival order per user
+            async with lock:
+                async with self._workers:
+                    await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from telegram.error import NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from . import breaker, tenants
+
+# Priority classes, lower wins
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+logger = logging.getLogger(__name__)
+
+# Methods that post a message into a chat; only these count against the quota
+_MESSAGE_METHODS = ("copymessage", "copymessages", "forwardmessage", "forwardmessages")
+
+
+def _posts_message(endpoint: str) -> bool:
+    endpoint = endpoint.lower()
+    return (endpoint.startswith("send") and endpoint != "sendchataction") or endpoint in _MESSAGE_METHODS
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class TelegramRateLimiter:
+    """Outbound Telegram quota shared by every sender of one bot.
+
+    A global bucket (~30 msg/s) is handed out in priority order, bulk traffic is additionally
+    capped by its own bucket so interactive replies always find headroom, and each chat has its
+    own bucket (1 msg/s with a small burst for private chats, 20/min for groups).
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        bulk_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._bulk = TokenBucket(bulk_rate, bulk_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._pump_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def pause(self, seconds: float):
+        """Stop all sending, e.g. after Telegram answered with RetryAfter."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                now = time.monotonic()
+                for key in [k for k, b in self._chats.items() if b.wait_time(now) == 0 and b.tokens >= b.capacity]:
+                    del self._chats[key]
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self._group_rate, 1)
+            else:
+                bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _take_chat(self, chat_id: Union[int, str]):
+        bucket = self._chat_bucket(chat_id)
+        while True:
+            wait = bucket.wait_time(time.monotonic())
+            if not wait:
+                bucket.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    def _wait_for(self, priority: int, now: float) -> float:
+        wait = max(self._paused_until - now, self._global.wait_time(now))
+        if priority >= BULK:
+            wait = max(wait, self._bulk.wait_time(now))
+        return wait
+
+    def _take(self, priority: int):
+        self._global.tokens -= 1
+        if priority >= BULK:
+            self._bulk.tokens -= 1
+
+    async def acquire(self, chat_id: Optional[Union[int, str]] = None, priority: int = NORMAL):
+        if chat_id is not None:
+            await self._take_chat(chat_id)
+        if not self._waiters and not self._wait_for(priority, time.monotonic()):
+            self._take(priority)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._ensure_pump()
+        await fut
+
+    def _ensure_pump(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _pump(self):
+        while self._waiters:
+            priority, _, fut = self._waiters[0]
+            if fut.cancelled():
+                heapq.heappop(self._waiters)
+                continue
+            wait = self._wait_for(priority, time.monotonic())
+            if not wait:
+                heapq.heappop(self._waiters)
+                self._take(priority)
+                fut.set_result(None)
+                continue
+            # Sleep until a token is due, or until a higher priority waiter shows up
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        chat_id: Optional[Union[int, str]] = None,
+        priority: int = NORMAL,
+        max_retries: int = 3,
+    ) -> Any:
+        """Run ``func`` under the limiter, retrying on RetryAfter and transient network errors."""
+        for attempt in range(max_retries + 1):
+            await self.acquire(chat_id, priority)
+            try:
+                return await func()
+            except RetryAfter as e:
+                self.pause(float(e.retry_after) + 0.1)
+                logger.info("Telegram asked to retry after %ss", e.retry_after)
+                if attempt == max_retries:
+                    raise
+            except TimedOut:
+                # The request may have gone through; retrying could duplicate the message
+                raise
+            except NetworkError:
+                # No point retrying into an open circuit
+                if attempt == max_retries or not breaker.TELEGRAM.available():
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+
+_rates: Dict[str, float] = {}
+# Telegram's quotas are per bot token, so every tenant gets its own limiter
+_limiters = tenants.Local(lambda: TelegramRateLimiter(**_rates))
+
+
+def configure(global_rate: float, bulk_rate: float, chat_rate: float):
+    _rates.update(global_rate=global_rate, bulk_rate=bulk_rate, chat_rate=chat_rate)
+
+
+def limiter() -> TelegramRateLimiter:
+    """The current tenant's limiter."""
+    return _limiters.get()
+
+
+class PTBRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """Routes every PTB request that posts a message to a chat through its bot's limiter.
+
+    ``limiter`` defaults to the current tenant's at the time of the request. Pass ``rate_limit_args={"priority": BULK}`` for background sends; everything else is
+    treated as an interactive reply. Each request to Telegram goes through the Telegram circuit
+    breaker, with a ``timeout`` second deadline for interactive replies. Time spent queued in the
+    limiter is not covered: a broadcast's RetryAfter pauses every sender, and that local backlog
+    must not look like Telegram being down.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, limiter: Optional[TelegramRateLimiter] = None):
+        self._timeout = timeout or None
+        self._limiter = limiter
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        opts = rate_limit_args or {}
+        priority = opts.get("priority", INTERACTIVE)
+        timeout = self._timeout if priority == INTERACTIVE else None
+        chat_id = data.get("chat_id")
+        if chat_id is None or not _posts_message(endpoint):
+            # Edits, chat actions, invite links, answerCallbackQuery...: not part of the quota
+            return await breaker.TELEGRAM.call(lambda: callback(*args, **kwargs), timeout=timeout)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        return await (self._limiter or limiter()).call(
+            lambda: breaker.TELEGRAM.call(lambda: callback(*args, **kwargs), timeout=timeout),
+            chat_id=chat_id,
+            priority=priority,
+            max_retries=opts.get("max_retries", 3),
+        )
@@ -0,0 +1,218 @@
+"""Installment and stale-review reminders.
+
+Timers are stored in the ``reminders`` collection. Only the ones due within the next window are
+held in memory, in a heap keyed by due time, so a tick looks at what is actually due instead of
+scanning users. Each timer is claimed atomically before it fires, so several workers can run the
+job without sending a reminder twice. Nothing is cancelled eagerly: a timer whose enrollment
+moved on is dropped when it comes due.
+"""
+import heapq
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import ContextTypes
+
+from . import codec, tenants
+from .archive import duration_months
+from .loaders import get_course_by_id
+from .models import Reminder, User
+from .ratelimit import BULK
+
+# Upper bound on timers held in memory; the window shrinks to fit when more are due
+MAX_LOADED = 10000
+RETRY_AFTER = timedelta(minutes=5)
+
+logger = logging.getLogger(__name__)
+
+_window = timedelta(minutes=60)
+_installment_days = 30
+_stale_after = timedelta(hours=24)
+_stale_repeats = 3
+
+
+
+class _Timers:
+    def __init__(self):
+        self.heap: List[Tuple[datetime, ObjectId]] = []
+        self.queued: Set[Tuple[datetime, ObjectId]] = set()
+        # Every scheduled timer due before this is in the heap; None until the first load
+        self.loaded_until: Optional[datetime] = None
+
+
+# Each tenant's timers live in its own database, so each gets its own heap
+_timers = tenants.Local(_Timers)
+
+
+def configure(window_minutes: int, installment_days: int, stale_hours: int, stale_repeats: int):
+    global _window, _installment_days, _stale_after, _stale_repeats
+    _window = timedelta(minutes=window_minutes)
+    _installment_days = installment_days
+    _stale_after = timedelta(hours=stale_hours)
+    _stale_repeats = stale_repeats
+
+
+def _push(due_at: datetime, reminder_id: ObjectId):
+    timers = _timers.get()
+    entry = (due_at, reminder_id)
+    if entry not in timers.queued:
+        timers.queued.add(entry)
+        heapq.heappush(timers.heap, entry)
+
+
+async def load_window(now: Optional[datetime] = None):
+    """Pull the timers due within the next window into the heap."""
+    now = now or datetime.utcnow()
+    until = now + _window
+    cursor = (
+        Reminder.get_motor_collection()
+        .find({"status": "scheduled", "due_at": {"$lte": until}}, {"due_at": 1})
+        .sort("due_at", 1)
+        .limit(MAX_LOADED)
+    )
+    docs = await cursor.to_list(length=MAX_LOADED)
+    for doc in docs:
+        _push(doc["due_at"], doc["_id"])
+    # A full page means there may be more; only trust the heap up to the last one loaded
+    _timers.get().loaded_until = docs[-1]["due_at"] if len(docs) == MAX_LOADED else until
+
+
+async def schedule(kind: str, telegram_id: int, course_id: str, due_at: datetime, seq: int = 1):
+    """Arm (or re-arm) one timer. Safe to call again for the same enrollment."""
+    try:
+        doc = await Reminder.get_motor_collection().find_one_and_update(
+            {"kind": kind, "telegram_id": telegram_id, "course_id": course_id, "seq": seq},
+            {
+                "$set": {"due_at": due_at, "status": "scheduled", "sent_at": None},
+                "$setOnInsert": {"created_at": datetime.utcnow()},
+            },
+            upsert=True,
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+    except PyMongoError as e:
+        logger.warning("could not schedule %s reminder for %s/%s: %r", kind, telegram_id, course_id, e)
+        return
+    # Timers beyond the loaded window are picked up by a later load
+    loaded_until = _timers.get().loaded_until
+    if loaded_until is not None and due_at <= loaded_until:
+        _push(due_at, doc["_id"])
+
+
+async def on_status(telegram_id: int, course_id: str, status: str, at: Optional[datetime] = None):
+    """Arm the timers that follow an enrollment entering ``status``."""
+    at = at or datetime.utcnow()
+    if status == "pending":
+        await schedule("stale_pending", telegram_id, course_id, at + _stale_after)
+    elif status == "approved" and _installments(course_id):
+        await schedule("installment", telegram_id, course_id, at + timedelta(days=_installment_days))
+
+
+def _installments(course_id: str) -> int:
+    """Monthly installments of a course; university materials have none."""
+    course = get_course_by_id(course_id)
+    if not course or not course.get("duration"):
+        return 0
+    return duration_months(course) or 0
+
+
+def _monthly_amount(course_id: str) -> Optional[str]:
+    course = get_course_by_id(course_id) or {}
+    m = re.search(r"القسط الشهري:\s*([\d,]+\s*ل\.س)", str(course.get("description") or ""))
+    return m.group(1) if m else None
+
+
+async def _enrollment(telegram_id: int, course_id: str) -> Tuple[str, Optional[Dict]]:
+    doc = await User.get_motor_collection().find_one(
+        {"telegram_id": telegram_id, "courses.course_id": course_id},
+        {"full_name": 1, "courses.$": 1},
+    )
+    if not doc:
+        return "", None
+    return doc.get("full_name") or "", (doc.get("courses") or [None])[0]
+
+
+async def _claim(reminder_id: ObjectId, now: datetime) -> Optional[Dict]:
+    return await Reminder.get_motor_collection().find_one_and_update(
+        {"_id": reminder_id, "status": "scheduled", "due_at": {"$lte": now}},
+        {"$set": {"status": "sent", "sent_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _fire(bot: Bot, admin_id: int, r: Dict) -> bool:
+    """Send one claimed reminder. Returns False when its enrollment no longer needs it."""
+    tid, cid, seq = r["telegram_id"], r["course_id"], r["seq"]
+    name, enrollment = await _enrollment(tid, cid)
+    course_name = (get_course_by_id(cid) or {"name": cid}).get("name")
+    if r["kind"] == "installment":
+        total = _installments(cid)
+        if not enrollment or enrollment.get("approval_status") != "approved" or seq > total:
+            return False
+        amount = _monthly_amount(cid)
+        text = (
+            f"⏰ تذكير بالقسط الشهري ({seq}/{total})\n\n"
+            f"الكورس: {course_name}\n"
+            + (f"المبلغ: {amount}\n" if amount else "")
+            + "يرجى إرسال إثبات الدفع عبر البوت."
+        )
+        await bot.send_message(chat_id=tid, text=text, rate_limit_args={"priority": BULK})
+        if seq < total:
+            await schedule("installment", tid, cid, r["due_at"] + timedelta(days=_installment_days), seq + 1)
+        return True
+
+    if not enrollment or enrollment.get("approval_status") != "pending" or not admin_id:
+        return False
+    hours = int(_stale_after.total_seconds() // 3600) * seq
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("👁️ مراجعة", callback_data=codec.pack("v", tid, cid))]])
+    await bot.send_message(
+        chat_id=admin_id,
+        text=f"⏳ طلب بانتظار المراجعة منذ {hours} ساعة\n\n👤 {name or tid}\n📚 {course_name}",
+        reply_markup=keyboard,
+        rate_limit_args={"priority": BULK},
+    )
+    if seq < _stale_repeats:
+        await schedule("stale_pending", tid, cid, r["due_at"] + _stale_after, seq + 1)
+    return True
+
+
+async def run_due(bot: Bot, admin_id: int, now: Optional[datetime] = None) -> int:
+    """Fire every loaded timer that is due. Returns how many were sent."""
+    now = now or datetime.utcnow()
+    timers = _timers.get()
+    if timers.loaded_until is None or now + _window / 2 >= timers.loaded_until:
+        await load_window(now)
+    sent = 0
+    while timers.heap and timers.heap[0][0] <= now:
+        entry = heapq.heappop(timers.heap)
+        timers.queued.discard(entry)
+        # Claimed by another worker, re-armed for later, or already handled
+        r = await _claim(entry[1], now)
+        if not r:
+            continue
+        try:
+            if await _fire(bot, admin_id, r):
+                sent += 1
+            else:
+                await Reminder.get_motor_collection().update_one({"_id": r["_id"]}, {"$set": {"status": "cancelled"}})
+        except (Forbidden, BadRequest) as e:
+            logger.info("dropping %s reminder for %s: %r", r["kind"], r["telegram_id"], e)
+        except TelegramError as e:
+            logger.warning("%s reminder for %s failed, retrying later: %r", r["kind"], r["telegram_id"], e)
+            await schedule(r["kind"], r["telegram_id"], r["course_id"], now + RETRY_AFTER, r["seq"])
+    return sent
+
+
+async def reminders_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        await run_due(context.bot, context.bot_data.get("ADMIN_ID") or 0)
+    except PyMongoError as e:
+        # Entries popped before the failure are still scheduled in Mongo; reload them next tick
+        _timers.get().loaded_until = None
+        logger.warning("reminders tick failed: %r", e)
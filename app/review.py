@@ -0,0 +1,31 @@
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+from . import analytics, enrollments, seats
+
+logger = logging.getLogger(__name__)
+
+Item = Tuple[int, str]
+
+
+async def apply(items: Iterable[Item], status: str, reviewer: Optional[int] = None) -> Tuple[List[Item], List[Item]]:
+    """Approve or reject many pending enrollments at once, skipping those other reviewers claimed.
+
+    The students' notices are queued in the outbox together with the change. Returns the
+    enrollments that changed and, for rejections, the (telegram_id, course_id) of
+    waitlisted students who got the freed seats and still need to be moved into review.
+    """
+    applied = await enrollments.bulk_set_status(items, status, reviewer)
+    promoted: List[Item] = []
+    for tid, cid in applied:
+        if status == "approved":
+            analytics.track("approve", tid, cid)
+            continue
+        try:
+            next_tid = await seats.release(cid, tid)
+            if next_tid:
+                promoted.append((next_tid, cid))
+        except Exception:
+            logger.exception("seat release failed for %s/%s", tid, cid)
+    return applied, promoted
+
@@ -0,0 +1,34 @@
+"""Who may use the admin side of the bot.
+
+``TELEGRAM_ADMIN_ID`` is the instructor: digests, reminders and student messages go to them.
+``TELEGRAM_ADMIN_IDS`` adds more full admins, and ``TELEGRAM_MODERATOR_IDS`` people who only work
+the payment review queue. Both are comma-separated Telegram ids. The sets are kept in
+``bot_data`` so every tenant has its own.
+"""
+from typing import Any, List, Mapping, Set, Tuple
+
+from .config import Config
+
+
+def parse_ids(value: str) -> List[int]:
+    return [int(part) for part in str(value or "").replace(" ", "").split(",") if part]
+
+
+def from_config(cfg: Config) -> Tuple[Set[int], Set[int]]:
+    """(admins, moderators); someone listed as both is an admin."""
+    admins = ({cfg.TELEGRAM_ADMIN_ID} | set(parse_ids(cfg.TELEGRAM_ADMIN_IDS))) - {0}
+    moderators = set(parse_ids(cfg.TELEGRAM_MODERATOR_IDS)) - admins
+    return admins, moderators
+
+
+def is_admin(bot_data: Mapping[str, Any], user_id: int) -> bool:
+    return user_id in bot_data.get("ADMIN_IDS", ())
+
+
+def is_reviewer(bot_data: Mapping[str, Any], user_id: int) -> bool:
+    """Admins and moderators: may approve and reject payments."""
+    return is_admin(bot_data, user_id) or user_id in bot_data.get("MODERATOR_IDS", ())
+
+
+def reviewers(bot_data: Mapping[str, Any]) -> List[int]:
+    return sorted(set(bot_data.get("ADMIN_IDS", ())) | set(bot_data.get("MODERATOR_IDS", ())))
@@ -0,0 +1,119 @@
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, BaseHandler, ContextTypes, filters
+
+Callback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+
+
+@dataclass
+class Route:
+    callback: Callback
+    block: bool = True
+    priority: int = 0
+    exact: bool = False
+    pattern: Optional["re.Pattern[str]"] = None
+    # Served from in-memory data only, so it keeps working while Mongo is unavailable
+    offline: bool = False
+
+
+class _TrieNode:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.routes: List[Route] = []
+
+
+class Router(BaseHandler[Update, ContextTypes.DEFAULT_TYPE]):
+    """One handler for all menu texts and callback queries.
+
+    Menu texts are looked up in a dict and callback data is walked through a prefix trie, so the
+    cost of an update depends on the length of its callback data, not on the number of screens.
+    When several routes match, the one registered first wins, like a chain of handlers would.
+    """
+
+    def __init__(self):
+        super().__init__(self._unrouted)
+        self._texts: Dict[str, Route] = {}
+        self._trie = _TrieNode()
+        self._fallback: Optional[Route] = None
+        self._count = 0
+
+    def _route(self, callback: Callback, block: bool, **kwargs) -> Route:
+        self._count += 1
+        return Route(callback=callback, block=block, priority=self._count, **kwargs)
+
+    def text(self, texts: Iterable[str], callback: Callback, block: bool = True, offline: bool = False):
+        route = self._route(callback, block, offline=offline)
+        for t in texts:
+            self._texts.setdefault(t, route)
+
+    def query(
+        self,
+        prefix: str,
+        callback: Callback,
+        exact: bool = False,
+        pattern: Optional[str] = None,
+        block: bool = True,
+        offline: bool = False,
+    ):
+        """Route callback data starting with ``prefix`` (or equal to it when ``exact``).
+
+        ``pattern`` is an extra full match for routes that also validate the rest of the data.
+        """
+        node = self._trie
+        for ch in prefix:
+            node = node.children.setdefault(ch, _TrieNode())
+        route = self._route(callback, block, exact=exact, pattern=re.compile(pattern) if pattern else None, offline=offline)
+        node.routes.append(route)
+
+    def fallback_text(self, callback: Callback, block: bool = True):
+        """Any other non-command text; only the first registered fallback is used."""
+        if self._fallback is None:
+            self._fallback = self._route(callback, block)
+
+    def _match_callback(self, data: str) -> Optional[Route]:
+        best: Optional[Route] = None
+        node = self._trie
+        depth = 0
+        while node is not None:
+            for route in node.routes:
+                if best is not None and route.priority > best.priority:
+                    continue
+                if route.exact and depth != len(data):
+                    continue
+                if route.pattern and not route.pattern.fullmatch(data):
+                    continue
+                best = route
+            if depth == len(data):
+                break
+            node = node.children.get(data[depth])
+            depth += 1
+        return best
+
+    def check_update(self, update: object) -> Optional[Route]:
+        if not isinstance(update, Update):
+            return None
+        if update.callback_query:
+            data = update.callback_query.data
+            return self._match_callback(data) if isinstance(data, str) else None
+        if update.message and update.message.text:
+            route = self._texts.get(update.message.text)
+            if route:
+                return route
+            if self._fallback and not filters.COMMAND.check_update(update):
+                return self._fallback
+        return None
+
+    async def handle_update(self, update: Update, application: Application, check_result: Route, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        if check_result.block:
+            return await check_result.callback(update, context)
+        application.create_task(check_result.callback(update, context), update=update)
+        return None
+
+    async def _unrouted(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # handle_update always calls the matched route instead
+        return None
@@ -0,0 +1,105 @@
+from datetime import datetime
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .catalog import COURSES, MATERIALS
+from .models import CourseSeats
+
+RESERVED = "reserved"
+WAITLISTED = "waitlisted"
+UNLIMITED = "unlimited"
+
+_default_capacity = 0
+
+
+def configure(default_capacity: int):
+    global _default_capacity
+    _default_capacity = default_capacity
+
+
+def capacity(course_id: str) -> int:
+    """Cohort size for a course; 0 means unlimited. A catalog "seats" key wins over the default."""
+    item = COURSES.get(course_id) or MATERIALS.get(course_id) or {}
+    return int(item.get("seats", _default_capacity) or 0)
+
+
+async def _ensure(course_id: str, cap: int):
+    try:
+        await CourseSeats.get_motor_collection().update_one(
+            {"course_id": course_id},
+            {
+                "$setOnInsert": {"course_id": course_id, "taken": 0, "holders": [], "waitlist": []},
+                "$set": {"capacity": cap},
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Another student created the counter at the same moment
+        pass
+
+
+async def available(course_id: str) -> Optional[int]:
+    """Free seats left, or None when the course is unlimited."""
+    cap = capacity(course_id)
+    if not cap:
+        return None
+    doc = await CourseSeats.get_motor_collection().find_one({"course_id": course_id}, {"taken": 1})
+    return max(cap - (doc or {}).get("taken", 0), 0)
+
+
+async def reserve(course_id: str, telegram_id: int) -> str:
+    """Take a seat with a conditional $inc, or join the FIFO waitlist when the cohort is full."""
+    cap = capacity(course_id)
+    if not cap:
+        return UNLIMITED
+    await _ensure(course_id, cap)
+    coll = CourseSeats.get_motor_collection()
+    res = await coll.update_one(
+        {"course_id": course_id, "holders": {"$ne": telegram_id}, "$expr": {"$lt": ["$taken", "$capacity"]}},
+        {"$inc": {"taken": 1}, "$push": {"holders": telegram_id}},
+    )
+    if res.modified_count:
+        return RESERVED
+    if await coll.count_documents({"course_id": course_id, "holders": telegram_id}, limit=1):
+        return RESERVED
+    await coll.update_one(
+        {"course_id": course_id, "waitlist.telegram_id": {"$ne": telegram_id}},
+        {"$push": {"waitlist": {"telegram_id": telegram_id, "at": datetime.utcnow()}}},
+    )
+    return WAITLISTED
+
+
+async def release(course_id: str, telegram_id: int) -> Optional[int]:
+    """Give a seat back (or leave the waitlist). Returns the student promoted into the freed seat."""
+    if not capacity(course_id):
+        return None
+    coll = CourseSeats.get_motor_collection()
+    await coll.update_one(
+        {"course_id": course_id, "holders": telegram_id},
+        {"$inc": {"taken": -1}, "$pull": {"holders": telegram_id}},
+    )
+    await coll.update_one({"course_id": course_id}, {"$pull": {"waitlist": {"telegram_id": telegram_id}}})
+    return await promote(course_id)
+
+
+async def promote(course_id: str) -> Optional[int]:
+    """Move the head of the waitlist into a free seat in one atomic pipeline update."""
+    doc = await CourseSeats.get_motor_collection().find_one_and_update(
+        {"course_id": course_id, "waitlist.0": {"$exists": True}, "$expr": {"$lt": ["$taken", "$capacity"]}},
+        [
+            {
+                "$set": {
+                    "taken": {"$add": ["$taken", 1]},
+                    "holders": {"$concatArrays": ["$holders", [{"$arrayElemAt": ["$waitlist.telegram_id", 0]}]]},
+                    "waitlist": {"$slice": ["$waitlist", 1, {"$size": "$waitlist"}]},
+                }
+            }
+        ],
+        projection={"waitlist": {"$slice": 1}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if not doc or not doc.get("waitlist"):
+        return None
+    return doc["waitlist"][0]["telegram_id"]
@@ -0,0 +1,232 @@
+"""Incremental snapshot / restore tool for the users collection.
+
+Usage:
+    python -m app.snapshot dump --out backups/users
+    python -m app.snapshot dump --out backups/users --full --format bson
+    python -m app.snapshot restore --src backups/users [--telegram-id 123 ...]
+
+Segments only hold documents modified since the previous dump, so removals (users moved to
+``users_archive`` by app.archive, or deleted) are recorded separately: every dump writes the ids
+still in the collection (``live_ids.ndjson.gz``) and the ids that disappeared since the previous
+dump (``<segment>.removed.ndjson.gz``). ``restore`` skips documents that weren't live at the last
+dump, so an older segment can't bring a removed user back.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import bson
+from bson import json_util
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from .archive import ARCHIVE_USERS
+from .config import load_config
+from .db import get_client, init_db
+
+MANIFEST = "manifest.json"
+LIVE_IDS = "live_ids.ndjson.gz"
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+
+def _read_manifest(root: Path) -> Dict[str, Any]:
+    path = root / MANIFEST
+    if not path.exists():
+        return {"segments": [], "watermark": None}
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_ids(path: Path, ids: Iterable[Any]):
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wb") as out:
+        for _id in ids:
+            out.write(json_util.dumps({"_id": _id}).encode("utf-8") + b"\n")
+    tmp.replace(path)
+
+
+def _read_ids(path: Path) -> Set[Any]:
+    with gzip.open(path, "rb") as f:
+        return {json_util.loads(line)["_id"] for line in f if line.strip()}
+
+
+def _write_manifest(root: Path, manifest: Dict[str, Any]):
+    tmp = root / (MANIFEST + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    tmp.replace(root / MANIFEST)
+
+
+async def dump(collection, root: Path, fmt: str = "ndjson", full: bool = False, batch_size: int = 1000) -> Dict[str, Any]:
+    """Write every document modified since the last dump into a new gzip segment."""
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = _read_manifest(root)
+    since = None if full else manifest.get("watermark")
+    until = datetime.utcnow()
+    query: Dict[str, Any] = {"updated_at": {"$lte": until}}
+    if since:
+        query["updated_at"]["$gt"] = datetime.fromisoformat(since)
+    elif not full and manifest["segments"]:
+        raise RuntimeError("manifest has segments but no watermark")
+    if not since:
+        # The first dump also picks up documents written before updated_at existed.
+        query = {"$or": [query, {"updated_at": {"$exists": False}}]}
+
+    name = f"{until:%Y%m%dT%H%M%S}{'-full' if not since else ''}.{'ndjson' if fmt == 'ndjson' else 'bson'}.gz"
+    path = root / name
+    count = 0
+    with gzip.open(path, "wb") as out:
+        async for doc in collection.find(query).batch_size(batch_size):
+            if fmt == "ndjson":
+                out.write(json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS).encode("utf-8") + b"\n")
+            else:
+                out.write(bson.encode(doc))
+            count += 1
+
+    # Removals leave nothing behind to select by updated_at; diff the ids against the last dump
+    live = {doc["_id"] async for doc in collection.find({}, {"_id": 1}).batch_size(batch_size)}
+    live_path = root / LIVE_IDS
+    removed = (_read_ids(live_path) - live) if since and live_path.exists() else set()
+    removed_name = f"{until:%Y%m%dT%H%M%S}.removed.ndjson.gz"
+    if removed:
+        _write_ids(root / removed_name, removed)
+    _write_ids(live_path, live)
+
+    segment = {
+        "file": name,
+        "format": fmt,
+        "since": since,
+        "until": until.isoformat(),
+        "count": count,
+        "full": not since,
+        "removed": len(removed),
+        "removed_file": removed_name if removed else None,
+    }
+    if count == 0:
+        path.unlink()
+        segment["file"] = None
+    if count or removed:
+        if not since:
+            manifest["segments"] = []
+        manifest["segments"].append(segment)
+    manifest["watermark"] = until.isoformat()
+    _write_manifest(root, manifest)
+    return segment
+
+
+def _iter_segment(path: Path, fmt: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, "rb") as f:
+        if fmt == "ndjson":
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+        else:
+            yield from bson.decode_file_iter(f)
+
+
+def _replace_op(doc: Dict[str, Any]) -> ReplaceOne:
+    ts = doc.get("updated_at")
+    if ts is None:
+        return ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+    # Never overwrite a newer copy; the failed upsert surfaces as a duplicate key and is ignored.
+    return ReplaceOne(
+        {"_id": doc["_id"], "$or": [{"updated_at": {"$lte": ts}}, {"updated_at": {"$exists": False}}]},
+        doc,
+        upsert=True,
+    )
+
+
+async def _apply_batch(collection, batch: List[Dict[str, Any]], sem: asyncio.Semaphore) -> int:
+    async with sem:
+        try:
+            res = await collection.bulk_write([_replace_op(d) for d in batch], ordered=False)
+            return res.upserted_count + res.modified_count
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+            return e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+
+
+async def restore(
+    collection,
+    root: Path,
+    telegram_ids: Optional[List[int]] = None,
+    batch_size: int = 500,
+    workers: int = 4,
+) -> int:
+    """Replay segments oldest first using parallel batched upserts.
+
+    Documents removed by the time of the last dump are skipped. Backups made before removals
+    were recorded have no id list; for those, users found in the archive are skipped instead.
+    """
+    manifest = _read_manifest(root)
+    wanted = set(telegram_ids or [])
+    live_path = root / LIVE_IDS
+    live: Optional[Set[Any]] = _read_ids(live_path) if live_path.exists() else None
+    archived: Set[Any] = set()
+    if live is None and collection.name == "users":
+        archived = {doc["_id"] async for doc in collection.database[ARCHIVE_USERS].find({}, {"_id": 1})}
+    sem = asyncio.Semaphore(workers)
+    restored = 0
+    for seg in manifest["segments"]:
+        if not seg.get("file"):
+            continue
+        tasks: List[asyncio.Task] = []
+        batch: List[Dict[str, Any]] = []
+        for doc in _iter_segment(root / seg["file"], seg["format"]):
+            if wanted and doc.get("telegram_id") not in wanted:
+                continue
+            if (live is not None and doc["_id"] not in live) or doc["_id"] in archived:
+                continue
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                tasks.append(asyncio.create_task(_apply_batch(collection, batch, sem)))
+                batch = []
+            if len(tasks) >= workers * 2:
+                # Bound memory: never hold more than a couple of batches per worker.
+                restored += sum(await asyncio.gather(*tasks))
+                tasks = []
+        if batch:
+            tasks.append(asyncio.create_task(_apply_batch(collection, batch, sem)))
+        restored += sum(await asyncio.gather(*tasks))
+        logger.info("restored segment %s", seg["file"])
+    return restored
+
+
+async def _main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m app.snapshot")
+    parser.add_argument("--collection", default="users")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    d = sub.add_parser("dump")
+    d.add_argument("--out", required=True)
+    d.add_argument("--format", choices=("ndjson", "bson"), default="ndjson")
+    d.add_argument("--full", action="store_true")
+    r = sub.add_parser("restore")
+    r.add_argument("--src", required=True)
+    r.add_argument("--telegram-id", type=int, action="append")
+    r.add_argument("--batch-size", type=int, default=500)
+    r.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    await init_db(cfg.MONGODB_URL, cfg.MONGODB_DB_NAME)
+    collection = get_client()[cfg.MONGODB_DB_NAME][args.collection]
+    if args.cmd == "dump":
+        seg = await dump(collection, Path(args.out), args.format, args.full)
+        print(f"dumped {seg['count']} documents, {seg['removed']} removed")
+    else:
+        n = await restore(collection, Path(args.src), args.telegram_id, args.batch_size, args.workers)
+        print(f"restored {n} documents")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
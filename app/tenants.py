@@ -0,0 +1,145 @@
+"""Several instructors' bots in one process.
+
+A tenant is one instructor: their own bot token, admin, payment numbers, Mongo database (on the
+shared client) and data directory for group_links.json. ``TENANTS_FILE`` lists them as JSON::
+
+    [{"id": "shahd", "TELEGRAM_BOT_TOKEN": "...", "TELEGRAM_ADMIN_ID": 1,
+      "TELEGRAM_MODERATOR_IDS": [2, 3], "SHAM_CASH_NUMBER": "...", "HARAM_NUMBER": "...",
+      "DATA_DIR": "data/shahd"}]
+
+Everything else is process-wide and comes from the environment. So is the course catalog in
+app/catalog.py; a tenant's courses.json is only read when that catalog is empty. The tenant an
+update or job belongs to travels in a context variable, set by the update processor and
+:class:`TenantJobQueue`; models and module state look it up to pick the tenant's database and
+in-memory structures.
+Without a tenants file there is one tenant with the empty id, stored exactly as before.
+"""
+import dataclasses
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+from telegram.ext import JobQueue
+
+from .config import Config
+
+# What a tenant entry may set; the rest of the config is shared
+TENANT_KEYS = (
+    "TELEGRAM_BOT_TOKEN", "TELEGRAM_ADMIN_ID", "TELEGRAM_ADMIN_IDS", "TELEGRAM_MODERATOR_IDS",
+    "SHAM_CASH_NUMBER", "HARAM_NUMBER", "MONGODB_DB_NAME", "DATA_DIR",
+)
+
+T = TypeVar("T")
+
+_current: ContextVar[str] = ContextVar("tenant", default="")
+_databases: Dict[str, str] = {}
+_data_dirs: Dict[str, Path] = {}
+_collections: Dict[Tuple[str, str], object] = {}
+
+
+def load(cfg: Config) -> List[Config]:
+    """One config per tenant: ``cfg`` with the tenant's own keys applied."""
+    register(cfg)
+    if not cfg.TENANTS_FILE:
+        return [cfg]
+    with open(cfg.TENANTS_FILE, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    configs = []
+    for entry in entries:
+        tenant_id = str(entry.get("id") or "")
+        # The id becomes part of the webhook path and the journal directory
+        if not tenant_id.isidentifier():
+            raise ValueError(f"bad tenant id {tenant_id!r} in {cfg.TENANTS_FILE}")
+        overrides = {k: entry[k] for k in TENANT_KEYS if k in entry}
+        overrides.setdefault("MONGODB_DB_NAME", f"{cfg.MONGODB_DB_NAME}_{tenant_id}")
+        if "TELEGRAM_ADMIN_ID" in overrides:
+            overrides["TELEGRAM_ADMIN_ID"] = int(overrides["TELEGRAM_ADMIN_ID"])
+        for key in ("TELEGRAM_ADMIN_IDS", "TELEGRAM_MODERATOR_IDS"):
+            # A JSON list of ids or the same comma-separated string as in the environment
+            if isinstance(overrides.get(key), list):
+                overrides[key] = ",".join(str(i) for i in overrides[key])
+        tenant_cfg = dataclasses.replace(cfg, TENANT_ID=tenant_id, **overrides)
+        register(tenant_cfg)
+        configs.append(tenant_cfg)
+    return configs
+
+
+def register(cfg: Config):
+    _databases[cfg.TENANT_ID] = cfg.MONGODB_DB_NAME
+    if cfg.DATA_DIR:
+        _data_dirs[cfg.TENANT_ID] = Path(cfg.DATA_DIR)
+
+
+def current() -> str:
+    return _current.get()
+
+
+@contextmanager
+def use(tenant_id: str) -> Iterator[None]:
+    """Make ``tenant_id`` the current tenant for the code (and tasks started) inside."""
+    token = _current.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def collection(coll):
+    """``coll`` as the current tenant sees it: same name, in the tenant's database."""
+    name = _databases.get(current())
+    if not name or name == coll.database.name:
+        return coll
+    key = (name, coll.name)
+    tenant_coll = _collections.get(key)
+    if tenant_coll is None:
+        tenant_coll = _collections[key] = coll.database.client[name][coll.name]
+    return tenant_coll
+
+
+def owner(db_name: str) -> str:
+    """The tenant whose database ``db_name`` is, or the current one if none is registered."""
+    for tenant_id, name in _databases.items():
+        if name == db_name:
+            return tenant_id
+    return current()
+
+
+def data_dir() -> Optional[Path]:
+    """The current tenant's data directory, or None for the shared one."""
+    return _data_dirs.get(current())
+
+
+def path(p: Path) -> Path:
+    """A per-tenant location for a local file: a subdirectory named after the tenant."""
+    tenant_id = current()
+    return p.parent / tenant_id / p.name if tenant_id else p
+
+
+class Local(Generic[T]):
+    """Module state kept separately for each tenant, created on first use."""
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._values: Dict[str, T] = {}
+
+    def get(self) -> T:
+        tenant_id = current()
+        value = self._values.get(tenant_id)
+        if value is None:
+            value = self._values[tenant_id] = self._factory()
+        return value
+
+
+class TenantJobQueue(JobQueue):
+    """Runs every job with its application's tenant as the current one."""
+
+    def __init__(self, tenant_id: str = ""):
+        super().__init__()
+        self.tenant_id = tenant_id
+
+    @staticmethod
+    async def job_callback(job_queue: "JobQueue", job) -> None:
+        with use(getattr(job_queue, "tenant_id", "")):
+            await JobQueue.job_callback(job_queue, job)
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+from typing import Optional
+
+from pymongo.errors import PyMongoError
+
+from . import breaker, tenants
+from .archive import restore_user
+from .models import User
+
+_CACHE_SIZE = 2048
+# One student may be enrolled with several instructors, so each tenant has its own cache
+_cache: "tenants.Local[OrderedDict[int, User]]" = tenants.Local(OrderedDict)
+
+
+def _remember(user: User):
+    cache = _cache.get()
+    cache[user.telegram_id] = user
+    cache.move_to_end(user.telegram_id)
+    while len(cache) > _CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+async def find_user(telegram_id: int) -> Optional[User]:
+    """Look a student up in the hot collection, falling back to the archive."""
+    user = await breaker.MONGO.call(lambda: _lookup(telegram_id))
+    if user:
+        _remember(user)
+    return user
+
+
+async def _lookup(telegram_id: int) -> Optional[User]:
+    user = await User.find_one(User.telegram_id == telegram_id)
+    return user or await restore_user(telegram_id)
+
+
+async def find_user_cached(telegram_id: int) -> Optional[User]:
+    """Read-only lookup that serves the last known copy while Mongo is unreachable."""
+    try:
+        return await find_user(telegram_id)
+    except PyMongoError:
+        return _cache.get().get(telegram_id)
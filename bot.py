@@ -1,21 +1,40 @@
 import asyncio
 import logging
 import os
-
-from telegram.ext import Application, ConversationHandler, CallbackQueryHandler, MessageHandler, CommandHandler, filters
+from contextlib import suppress
+
+from telegram import Update
+from telegram.ext import (
+    Application,
+    ConversationHandler,
+    CallbackQueryHandler,
+    MessageHandler,
+    CommandHandler,
+    TypeHandler,
+    filters,
+)
 
 from app.config import load_config
-from app.db import init_db
+from app.db import configure as configure_db, init_db
+from app.archive import archive_job
+from app.flood import FloodGuard, parse_limits
+from app.persistence import MongoPersistence, evict_job
+from app.processor import PerUserUpdateProcessor
+from app import (
+    analytics, breaker, broadcast, claims, contact, digest, invites, journal, outbox, ratelimit, reminders, roles, seats, tenants,
+)
 from app.handlers.registration import get_handler as registration_handler
+from app.router import Router
+from app.handlers import admin, courses, payment
 from app.handlers.courses import get_handlers as courses_handlers
 from app.handlers.payment import get_handlers as payment_handlers
 from app.handlers.admin import (
     get_handlers as admin_handlers,
-    get_catchall_handler as admin_catchall_handler,
     AWAITING_DIRECT_MESSAGE,
     admin_msg_select_cb,
     capture_messages,
     cancel_cmd,
+    direct_message_timeout,
 )
 
 
@@ -32,13 +51,58 @@ def build_application(cfg, init_db_on_startup: bool = True):
         if init_db_on_startup:
             await init_db(cfg.MONGODB_URL, cfg.MONGODB_DB_NAME)
         app.bot_data["ADMIN_ID"] = cfg.TELEGRAM_ADMIN_ID
+        app.bot_data["ADMIN_IDS"], app.bot_data["MODERATOR_IDS"] = roles.from_config(cfg)
         app.bot_data["SHAM"] = cfg.SHAM_CASH_NUMBER
         app.bot_data["HARAM"] = cfg.HARAM_NUMBER
 
-    application = Application.builder().token(cfg.TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+    async def post_stop(app: Application):
+        # Don't lose buffered events on deploys
+        with suppress(Exception), tenants.use(cfg.TENANT_ID):
+            await analytics.flush()
+
+    # Process-wide settings: tenants can't override them, so every tenant sets the same values.
+    # Per-tenant state (limiter, carts, edits...) lives in tenants.Local, never in these globals.
+    configure_db(cfg.MONGO_TIMEOUT_SECONDS)
+    breaker.configure(cfg.BREAKER_FAILURES, cfg.BREAKER_RESET_SECONDS)
+    journal.configure(cfg.JOURNAL_PATH, cfg.JOURNAL_WRITE_TIMEOUT)
+    seats.configure(cfg.COURSE_SEATS)
+    claims.configure(cfg.CLAIM_TIMEOUT_MINUTES)
+    analytics.configure(cfg.ANALYTICS_BUFFER_SIZE)
+    broadcast.configure(cfg.BROADCAST_CONCURRENCY)
+    contact.configure(cfg.CONTACT_DEBOUNCE_SECONDS)
+    invites.configure(cfg.INVITE_POOL_SIZE, cfg.INVITE_FAKE_API)
+    digest.configure(cfg.ADMIN_DIGEST_MINUTES, cfg.ADMIN_DIGEST_URGENT.split(","))
+    reminders.configure(
+        cfg.REMINDER_WINDOW_MINUTES, cfg.INSTALLMENT_DAYS, cfg.STALE_PENDING_HOURS, cfg.STALE_PENDING_REPEATS
+    )
+    ratelimit.configure(cfg.TELEGRAM_GLOBAL_RATE, cfg.TELEGRAM_BULK_RATE, cfg.TELEGRAM_CHAT_RATE)
+    with tenants.use(cfg.TENANT_ID):
+        limiter = ratelimit.limiter()
+    application = (
+        Application.builder()
+        .token(cfg.TELEGRAM_BOT_TOKEN)
+        .base_url(f"{cfg.TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{cfg.TELEGRAM_API_URL}/file/bot")
+        .local_mode(cfg.TELEGRAM_LOCAL_MODE)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .concurrent_updates(PerUserUpdateProcessor(max(cfg.MAX_CONCURRENT_UPDATES, 1), tenant_id=cfg.TENANT_ID))
+        .job_queue(tenants.TenantJobQueue(cfg.TENANT_ID))
+        .rate_limiter(ratelimit.PTBRateLimiter(cfg.TELEGRAM_TIMEOUT_SECONDS, limiter))
+        .persistence(MongoPersistence(cfg.MONGODB_URL, cfg.MONGODB_DB_NAME, cfg.PERSISTENCE_FLUSH_SECONDS))
+        .build()
+    )
+
+    # Flood control runs first, in its own group, so throttled updates never reach the handlers below
+    flood_limits = parse_limits(cfg.FLOOD_LIMITS)
+    if flood_limits:
+        admins, moderators = roles.from_config(cfg)
+        application.add_handler(FloodGuard(flood_limits, exempt=admins | moderators), group=-1)
 
     # Handlers - Order matters! More specific handlers first
-    application.add_handler(registration_handler())
+    conversation_timeout = cfg.CONVERSATION_TIMEOUT_MINUTES * 60 or None
+    registration = registration_handler(conversation_timeout)
+    application.add_handler(registration)
 
     # Direct admin -> student message conversation
     direct_message_handler = ConversationHandler(
@@ -49,24 +113,93 @@ def build_application(cfg, init_db_on_startup: bool = True):
             AWAITING_DIRECT_MESSAGE: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, capture_messages),
             ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, direct_message_timeout)],
         },
         fallbacks=[CommandHandler("cancel", cancel_cmd)],
         per_user=True,
         per_chat=False,
+        name="direct_message_conversation",
+        persistent=True,
+        conversation_timeout=conversation_timeout,
     )
     application.add_handler(direct_message_handler)
 
-    # Admin handlers first
-    for h in admin_handlers():
-        application.add_handler(h)
-    # Courses handlers
-    for h in courses_handlers():
-        application.add_handler(h)
-    # Payment handlers
-    for h in payment_handlers():
+    # Commands
+    receipts = payment_handlers()
+    for h in admin_handlers() + courses_handlers() + receipts:
         application.add_handler(h)
-    # Admin catch-all text handler LAST
-    application.add_handler(admin_catchall_handler())
+
+    # Menu texts and callback queries; registration order is priority order (admin first)
+    router = Router()
+    admin.add_routes(router)
+    courses.add_routes(router)
+    payment.add_routes(router)
+    application.add_handler(router)
+    # After flood control: while Mongo is down only offline routes and journal-backed flows get through
+    application.add_handler(breaker.DegradedGuard(router, offline=[registration, *receipts]), group=-1)
+    application.add_error_handler(breaker.error_handler)
+
+    # Background jobs
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            archive_job,
+            interval=cfg.ARCHIVE_INTERVAL_HOURS * 3600,
+            first=600,
+            data={"horizon_days": cfg.ARCHIVE_INACTIVE_DAYS, "batch_size": cfg.ARCHIVE_BATCH_SIZE},
+            name="archive",
+        )
+        application.job_queue.run_repeating(
+            journal.replay_job,
+            interval=cfg.JOURNAL_REPLAY_SECONDS,
+            first=cfg.JOURNAL_REPLAY_SECONDS,
+            name="journal_replay",
+        )
+        application.job_queue.run_repeating(
+            analytics.flush_job,
+            interval=cfg.ANALYTICS_FLUSH_SECONDS,
+            first=cfg.ANALYTICS_FLUSH_SECONDS,
+            name="analytics_flush",
+        )
+        application.job_queue.run_repeating(
+            outbox.dispatch_job,
+            interval=cfg.OUTBOX_POLL_SECONDS,
+            first=1,
+            name="outbox_dispatch",
+        )
+        application.job_queue.run_repeating(
+            broadcast.poll_job,
+            interval=cfg.BROADCAST_POLL_SECONDS,
+            first=5,
+            name="broadcast_poll",
+        )
+        application.job_queue.run_repeating(
+            reminders.reminders_job,
+            interval=cfg.REMINDER_TICK_SECONDS,
+            first=cfg.REMINDER_TICK_SECONDS,
+            name="reminders",
+        )
+        if cfg.USER_DATA_IDLE_MINUTES > 0:
+            application.job_queue.run_repeating(
+                evict_job,
+                interval=max(cfg.USER_DATA_IDLE_MINUTES * 60 // 4, 60),
+                first=cfg.USER_DATA_IDLE_MINUTES * 60,
+                data={"idle_seconds": cfg.USER_DATA_IDLE_MINUTES * 60},
+                name="user_data_evict",
+            )
+        if cfg.INVITE_POOL_SIZE > 0:
+            application.job_queue.run_repeating(
+                invites.refill_job,
+                interval=cfg.INVITE_REFILL_SECONDS,
+                first=10,
+                name="invite_refill",
+            )
+        if digest.enabled():
+            application.job_queue.run_repeating(
+                digest.digest_job,
+                interval=cfg.ADMIN_DIGEST_MINUTES * 60,
+                first=cfg.ADMIN_DIGEST_MINUTES * 60,
+                name="admin_digest",
+            )
 
     return application
 
@@ -77,6 +210,9 @@ def main():
 
     if not cfg.TELEGRAM_BOT_TOKEN:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is missing")
+    if cfg.TENANTS_FILE:
+        raise RuntimeError("TENANTS_FILE is served by main.py, which hosts every tenant behind one webhook server")
+    tenants.load(cfg)
 
     app = build_application(cfg)
 
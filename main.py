@@ -1,15 +1,19 @@
 import os
 from contextlib import suppress
+from typing import Dict
 
 from fastapi import Request, Response
 from telegram import Update
+from telegram.ext import Application
 
 from windserve_app.main import app
 
+from app import tenants
 from app.config import load_config
 from bot import build_application, setup_logging
 
-_tg_app = None
+# tenant id -> its bot; the default (single-tenant) bot has the empty id
+_tg_apps: Dict[str, Application] = {}
 
 
 def _normalize_webhook_url(url: str) -> str:
@@ -23,16 +27,26 @@ def _normalize_webhook_url(url: str) -> str:
     return url + "/bot"
 
 
-@app.post("/bot")
-async def telegram_webhook(request: Request) -> Response:
-    if _tg_app is None:
-        return Response(status_code=503)
+async def _dispatch(tenant_id: str, request: Request) -> Response:
+    tg_app = _tg_apps.get(tenant_id)
+    if tg_app is None:
+        return Response(status_code=503 if not _tg_apps else 404)
     payload = await request.json()
-    update = Update.de_json(payload, _tg_app.bot)
-    await _tg_app.update_queue.put(update)
+    update = Update.de_json(payload, tg_app.bot)
+    await tg_app.update_queue.put(update)
     return Response(status_code=200)
 
 
+@app.post("/bot")
+async def telegram_webhook(request: Request) -> Response:
+    return await _dispatch("", request)
+
+
+@app.post("/bot/{tenant_id}")
+async def tenant_webhook(tenant_id: str, request: Request) -> Response:
+    return await _dispatch(tenant_id, request)
+
+
 @app.on_event("startup")
 async def _startup() -> None:
     cfg = load_config()
@@ -40,7 +54,7 @@ async def _startup() -> None:
 
     if not os.getenv("MONGODB_URL") or not os.getenv("MONGODB_DB_NAME"):
         raise RuntimeError("MONGODB_URL / MONGODB_DB_NAME are required")
-    if not os.getenv("TELEGRAM_BOT_TOKEN"):
+    if not os.getenv("TELEGRAM_BOT_TOKEN") and not cfg.TENANTS_FILE:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is required")
 
     if os.getenv("ENABLE_TELEGRAM_BOT", "true").lower() in {"0", "false", "no", "off"}:
@@ -50,29 +64,42 @@ async def _startup() -> None:
     if not webhook_url:
         raise RuntimeError("WEBHOOK_URL is required (e.g. https://<repl-name>.<username>.repl.co)")
 
-    print(f"Telegram webhook URL (set_webhook): {webhook_url}")
-
-    global _tg_app
-    _tg_app = build_application(cfg, init_db_on_startup=False)
-    await _tg_app.initialize()
-    await _tg_app.start()
-
-    await _tg_app.bot.set_webhook(
-        url=webhook_url,
-        drop_pending_updates=True,
-    )
+    # Every tenant shares this event loop, the Mongo client and the catalog caches
+    for tenant_cfg in tenants.load(cfg):
+        tenant_id = tenant_cfg.TENANT_ID
+        if not tenant_cfg.TELEGRAM_BOT_TOKEN:
+            raise RuntimeError(f"TELEGRAM_BOT_TOKEN is required for tenant {tenant_id!r}")
+        tenant_url = f"{webhook_url}/{tenant_id}" if tenant_id else webhook_url
+        print(f"Telegram webhook URL (set_webhook): {tenant_url}")
+
+        with tenants.use(tenant_id):
+            # Sets up the tenant's database on the shared client; a no-op for the default one
+            tg_app = build_application(tenant_cfg)
+            await tg_app.initialize()
+            # initialize() doesn't run the lifecycle hooks; only run_polling/run_webhook do
+            if tg_app.post_init:
+                await tg_app.post_init(tg_app)
+            await tg_app.start()
+
+            await tg_app.bot.set_webhook(
+                url=tenant_url,
+                drop_pending_updates=True,
+            )
+        _tg_apps[tenant_id] = tg_app
 
 
 @app.on_event("shutdown")
 async def _shutdown() -> None:
-    global _tg_app
-    if _tg_app is None:
-        return
-    with suppress(Exception):
-        await _tg_app.stop()
-    with suppress(Exception):
-        await _tg_app.shutdown()
-    _tg_app = None
+    for tenant_id, tg_app in list(_tg_apps.items()):
+        with tenants.use(tenant_id):
+            with suppress(Exception):
+                await tg_app.stop()
+            if tg_app.post_stop:
+                with suppress(Exception):
+                    await tg_app.post_stop(tg_app)
+            with suppress(Exception):
+                await tg_app.shutdown()
+    _tg_apps.clear()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import uuid
 from pathlib import Path
@@ -11,8 +12,14 @@ from fastapi.templating import Jinja2Templates
 
 from .data import YEARS, material_details, COURSES, get_course
 import requests
+from telegram.error import NetworkError, RetryAfter
+from app import digest, enrollments, invites, outbox, ratelimit, reminders, review, tenants
+from app.config import load_config, str_to_bool
 from app.models import User, CourseEnrollment
-from app.db import init_db
+from app.db import configure as configure_db, init_db
+from app.users import find_user
+from app.loaders import get_course_by_id
+from app.broadcast import create_job as create_broadcast_job
 
 BASE_DIR = Path(__file__).resolve().parent
 ROOT_DIR = BASE_DIR.parent
@@ -52,33 +59,61 @@ async def startup():
     mongo_url = os.getenv("MONGODB_URL")
     db_name = os.getenv("MONGODB_DB_NAME")
     if mongo_url and db_name:
+        cfg = load_config()
+        # The panel works on the default tenant's data
+        tenants.register(cfg)
+        configure_db(cfg.MONGO_TIMEOUT_SECONDS)
         await init_db(mongo_url, db_name)
+        # Same digest settings as the bot, which sends what we buffer
+        digest.configure(cfg.ADMIN_DIGEST_MINUTES, cfg.ADMIN_DIGEST_URGENT.split(","))
+        # Approvals here pop from the invite pool the bot keeps filled
+        invites.configure(cfg.INVITE_POOL_SIZE, cfg.INVITE_FAKE_API)
 
 
-def _tg_send_message(chat_id: int, text: str):
+async def _tg_post(method: str, chat_id: int, data: Dict[str, Any], photo: Path = None, priority: int = ratelimit.NORMAL):
+    """Bot API call through the same rate limiter the bot uses."""
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token or not chat_id:
         return
+    api_url = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+    url = f"{api_url}/bot{token}/{method}"
+    if photo is not None and str_to_bool(os.getenv("TELEGRAM_LOCAL_MODE", "false")):
+        # A local Bot API server reads the upload straight from disk (it must see the same path)
+        data = dict(data, photo=photo.resolve().as_uri())
+        photo = None
+
+    def post():
+        if photo is None:
+            return requests.post(url, data=data, timeout=30)
+        with photo.open("rb") as fp:
+            return requests.post(url, data=data, files={"photo": fp}, timeout=30)
+
+    async def attempt():
+        try:
+            resp = await asyncio.to_thread(post)
+        except requests.RequestException as e:
+            raise NetworkError(str(e))
+        if resp.status_code == 429:
+            retry_after = resp.json().get("parameters", {}).get("retry_after", 1)
+            raise RetryAfter(int(retry_after))
+        return resp
+
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        requests.post(url, data={"chat_id": chat_id, "text": text})
+        # Same token as the default tenant's bot, so the same limiter
+        await ratelimit.limiter().call(attempt, chat_id=chat_id, priority=priority)
     except Exception:
         pass
 
 
-def _tg_send_photo_to_admin(file_path: Path, caption: str):
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
+async def _tg_send_message(chat_id: int, text: str, priority: int = ratelimit.NORMAL):
+    await _tg_post("sendMessage", chat_id, {"chat_id": chat_id, "text": text}, priority=priority)
+
+
+async def _tg_send_photo_to_admin(file_path: Path, caption: str):
     admin_id = os.getenv("TELEGRAM_ADMIN_ID")
-    if not token or not admin_id:
+    if not admin_id:
         return
-    try:
-        url = f"https://api.telegram.org/bot{token}/sendPhoto"
-        with file_path.open("rb") as fp:
-            files = {"photo": fp}
-            data = {"chat_id": int(admin_id), "caption": caption}
-            requests.post(url, data=data, files=files)
-    except Exception:
-        pass
+    await _tg_post("sendPhoto", int(admin_id), {"chat_id": int(admin_id), "caption": caption}, photo=file_path)
 
 
 def _get_group_link(item_type: str, item_id: str) -> str:
@@ -201,8 +236,8 @@ async def submit_contact(request: Request, message: str = Form(...)):
     _write_json(STORAGE_DIR / "messages.json", messages)
     # Notify admin via Telegram
     admin_id = os.getenv("TELEGRAM_ADMIN_ID")
-    if admin_id and admin_id.isdigit():
-        _tg_send_message(int(admin_id), f"رسالة جديدة من موقع الويب\nSID: {sid}\n{message}")
+    if admin_id and admin_id.isdigit() and not await digest.defer("web_contact", f"{sid}: {message}"):
+        await _tg_send_message(int(admin_id), f"رسالة جديدة من موقع الويب\nSID: {sid}\n{message}")
     return RedirectResponse("/inbox", status_code=303)
 
 
@@ -233,11 +268,14 @@ async def admin_broadcast(title: str = Form(...), body: str = Form("")):
     broadcasts = _read_json(STORAGE_DIR / "broadcast.json") or []
     broadcasts.append({"title": title, "body": body})
     _write_json(STORAGE_DIR / "broadcast.json", broadcasts)
-    # send to all registered users via Telegram
+    # Queue a broadcast job; the bot process sends it rate-limited and reports progress to the admin
+    admin_id = os.getenv("TELEGRAM_ADMIN_ID")
     try:
-        users = await User.find_all().to_list()
-        for u in users:
-            _tg_send_message(u.telegram_id, f"{title}\n\n{body}")
+        await create_broadcast_job(
+            f"{title}\n\n{body}",
+            progress_chat_id=int(admin_id) if admin_id and admin_id.isdigit() else None,
+            source="web",
+        )
     except Exception:
         pass
     return RedirectResponse("/admin/messages", status_code=303)
@@ -273,7 +311,9 @@ async def upload_proof(
     proofs.setdefault(sid, []).append(entry)
     _write_json(STORAGE_DIR / "proofs.json", proofs)
     cap = f"Proof upload\nType: {item_type}\nID: {item_id}\nMethod: {payment_method}\nTG: {telegram_id or '-'}"
-    _tg_send_photo_to_admin(target, cap)
+    line = f"{item_type} {item_id} • {payment_method} • TG: {telegram_id or '-'} (/admin/proofs)"
+    if not await digest.defer("web_proof", line, int(telegram_id) if telegram_id.isdigit() else None):
+        await _tg_send_photo_to_admin(target, cap)
     return RedirectResponse("/inbox", status_code=303)
 
 
@@ -288,41 +328,49 @@ async def admin_approve_proof(sid: str, pid: str):
             break
     _write_json(STORAGE_DIR / "proofs.json", proofs)
     if found:
-        link = _get_group_link(found["item_type"], found["item_id"]) or ""
-        if found.get("telegram_id"):
-            msg = "تمت الموافقة على الدفع ✅. أهلاً بك! رابط المجموعة: " + (link or "")
-            _tg_send_message(found["telegram_id"], msg)
+        static_link = _get_group_link(found["item_type"], found["item_id"]) or ""
+        tg_id = found.get("telegram_id")
+        if tg_id:
+            msg = "تمت الموافقة على الدفع ✅. أهلاً بك! رابط المجموعة: " + static_link
             try:
-                tg_id = found.get("telegram_id")
-                if tg_id:
-                    user = await User.find_one(User.telegram_id == tg_id)
-                    if not user:
-                        user = User(
-                            telegram_id=tg_id,
-                            full_name="",
-                            phone="",
-                            email="",
+                user = await find_user(tg_id)
+                if not user:
+                    user = User(
+                        telegram_id=tg_id,
+                        full_name="",
+                        phone="",
+                        email="",
+                    )
+                course_id = found.get("item_id")
+                payment_method = found.get("payment_method") or "sham"
+                updated = False
+                for enr in user.courses:
+                    if enr.course_id == course_id:
+                        enr.payment_method = payment_method
+                        enr.approval_status = "approved"
+                        updated = True
+                        break
+                if not updated and course_id:
+                    user.courses.append(
+                        CourseEnrollment(
+                            course_id=course_id,
+                            payment_method=payment_method,
+                            approval_status="approved",
                         )
-                    course_id = found.get("item_id")
-                    payment_method = found.get("payment_method") or "sham"
-                    updated = False
-                    for enr in user.courses:
-                        if enr.course_id == course_id:
-                            enr.payment_method = payment_method
-                            enr.approval_status = "approved"
-                            updated = True
-                            break
-                    if not updated and course_id:
-                        user.courses.append(
-                            CourseEnrollment(
-                                course_id=course_id,
-                                payment_method=payment_method,
-                                approval_status="approved",
-                            )
-                        )
-                    await user.save()
+                    )
+                # The notice is written with the approval and delivered by the bot's outbox. The
+                # personal link is taken once the approval is saved; issuing it again for the same
+                # student returns the same link, so an aborted transaction doesn't use one up.
+                async with outbox.transaction() as session:
+                    await user.save(session=session)
+                    link = await invites.issue(tg_id, found["item_id"]) or static_link
+                    msg = "تمت الموافقة على الدفع ✅. أهلاً بك! رابط المجموعة: " + link
+                    await outbox.enqueue([outbox.message(tg_id, msg)], session=session)
+                if course_id:
+                    await reminders.on_status(tg_id, course_id, "approved")
             except Exception:
-                pass
+                # The database is unavailable; the approval is in proofs.json, so tell the student now
+                await _tg_send_message(tg_id, msg)
     return RedirectResponse("/admin/proofs", status_code=303)
 
 
@@ -333,7 +381,11 @@ async def admin_reject_proof(sid: str, pid: str):
         if e["id"] == pid:
             e["status"] = "rejected"
             if e.get("telegram_id"):
-                _tg_send_message(e["telegram_id"], "تم رفض الدفع ❌. يرجى التواصل مع الإدارة.")
+                msg = "تم رفض الدفع ❌. يرجى التواصل مع الإدارة."
+                try:
+                    await outbox.enqueue([outbox.message(e["telegram_id"], msg)])
+                except Exception:
+                    await _tg_send_message(e["telegram_id"], msg)
             break
     _write_json(STORAGE_DIR / "proofs.json", proofs)
     return RedirectResponse("/admin/proofs", status_code=303)
@@ -350,6 +402,53 @@ async def admin_proofs(request: Request):
     return templates.TemplateResponse("admin_proofs.html", {"request": request, "rows": rows})
 
 
+@app.get("/admin/pending", response_class=HTMLResponse)
+async def admin_pending(request: Request):
+    try:
+        items = await enrollments.pending_items()
+    except Exception:
+        items = []
+    rows = [
+        {"telegram_id": tid, "course_id": cid, "name": name or str(tid), "course": (get_course_by_id(cid) or {}).get("name", cid)}
+        for tid, cid, name in items
+    ]
+    students = {r["telegram_id"]: r["name"] for r in rows}
+    courses = {r["course_id"]: r["course"] for r in rows}
+    return templates.TemplateResponse(
+        "admin_pending.html", {"request": request, "rows": rows, "students": students, "courses": courses}
+    )
+
+
+@app.post("/admin/pending/bulk")
+async def admin_pending_bulk(request: Request):
+    """Approve/reject a selection, everything of one student or everything of one course."""
+    form = await request.form()
+    action = form.get("action")
+    if action not in ("approve", "reject"):
+        return HTMLResponse("Bad action", status_code=400)
+    status = "approved" if action == "approve" else "rejected"
+    if form.get("student"):
+        student = str(form["student"]).strip()
+        if not student.isdigit():
+            return HTMLResponse("Bad student id", status_code=400)
+        items = [(tid, cid) for tid, cid, _ in await enrollments.pending_items(telegram_ids=[int(student)])]
+    elif form.get("course"):
+        items = [(tid, cid) for tid, cid, _ in await enrollments.pending_items(course_id=form["course"])]
+    else:
+        items = []
+        for value in form.getlist("items"):
+            tid, _, cid = value.partition(":")
+            if tid.isdigit() and cid:
+                items.append((int(tid), cid))
+    # The students' notices are queued in the outbox with the decision; the bot delivers them
+    _, promoted = await review.apply(items, status)
+    for tid, cid in promoted:
+        # A seat freed up: the waitlisted student goes into review
+        notice = f"🎉 توفر مقعد لك في {(get_course_by_id(cid) or {}).get('name', cid)}!\nطلبك الآن قيد المراجعة."
+        await enrollments.set_status(tid, cid, "pending", f"توفر مقعد في {cid}", notify=[outbox.message(tid, notice)])
+    return RedirectResponse("/admin/pending", status_code=303)
+
+
 @app.get("/admin/students", response_class=HTMLResponse)
 async def admin_students(request: Request):
     try:
@@ -367,7 +466,7 @@ async def admin_student_message_form(request: Request, tid: int):
 @app.post("/admin/students/{tid}/message")
 async def admin_student_message(tid: int, body: str = Form("")):
     if body:
-        _tg_send_message(tid, body)
+        await _tg_send_message(tid, body)
     return RedirectResponse(f"/admin/students", status_code=303)
 
 